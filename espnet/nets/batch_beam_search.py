@@ -6,20 +6,23 @@ from typing import Dict
 from typing import List
 from typing import NamedTuple
 from typing import Tuple
+from typing import Union
 
 import torch
-from torch.nn.utils.rnn import pad_sequence
 
 from espnet.nets.beam_search import BeamSearch
 from espnet.nets.beam_search import Hypothesis
+from espnet.nets.e2e_asr_common import EndDetector
+from espnet.nets.pytorch_backend.nets_utils import make_pad_mask
+from espnet.nets.scorer_interface import BatchStateScorerInterface
 
 
 class BatchHypothesis(NamedTuple):
     """Batchfied/Vectorized hypothesis data type."""
 
-    yseq: torch.Tensor = torch.tensor([])  # (batch, maxlen)
+    yseq: torch.Tensor = torch.tensor([])  # (batch, capacity), eos padded buffer
     score: torch.Tensor = torch.tensor([])  # (batch,)
-    length: torch.Tensor = torch.tensor([])  # (batch,)
+    length: torch.Tensor = torch.tensor([])  # (batch,), on cpu
     scores: Dict[str, torch.Tensor] = dict()  # values: (batch,)
     states: Dict[str, Dict] = dict()
 
@@ -29,59 +32,165 @@ class BatchHypothesis(NamedTuple):
 
 
 class BatchBeamSearch(BeamSearch):
-    """Batch beam search implementation."""
-
-    def batchfy(self, hyps: List[Hypothesis]) -> BatchHypothesis:
-        """Convert list to batch."""
-        if len(hyps) == 0:
-            return BatchHypothesis()
-        yseq=pad_sequence(
-            [h.yseq for h in hyps], batch_first=True, padding_value=self.eos
-        )
-        return BatchHypothesis(
-            yseq=yseq,
-            length=torch.tensor([len(h.yseq) for h in hyps], dtype=torch.int64, device=yseq.device),
-            score=torch.tensor([h.score for h in hyps]).to(yseq.device),
-            scores={k: torch.tensor([h.scores[k] for h in hyps], device=yseq.device) for k in self.scorers},
-            states={k: [h.states[k] for h in hyps] for k in self.scorers},
-        )
+    """Batch beam search implementation.
+
+    Running hypotheses are kept as one :class:`BatchHypothesis` for the whole
+    search: token ids live in a preallocated `(beam, capacity)` buffer, scores
+    are `(beam,)` tensors and the scorer states are reordered by
+    :meth:`espnet.nets.scorer_interface.BatchScorerInterface.batch_select_state`.
+    :class:`Hypothesis` objects are only built for ended hypotheses.
+
+    The search can be restricted to a shortlist of tokens with
+    :meth:`set_shortlist`, and run with static shapes with
+    :meth:`enable_static_step`.
+
+    """
+
+    # sorted ids of the searched tokens, None searches the whole vocabulary
+    shortlist = None
+    # searched tokens of each utterance (n_utt, n_vocab), None if they share the shortlist
+    shortlist_mask = None
+    # decode single utterances on the padded beam of `batch_forward`
+    static_shapes = False
+
+    def enable_static_step(self, compile: bool = True, **compile_kwargs):
+        """Decode with static-shape steps.
+
+        Single utterances are decoded by :meth:`batch_forward`, whose beam is
+        padded to `beam_size` hypotheses with masked scores instead of shrinking,
+        and the scorers that support it (e.g. the transformer decoder) run their
+        step on fixed-size buffers, compiled by `torch.compile` if `compile`.
+
+        Args:
+            compile (bool): Compile the static-shape steps
+            compile_kwargs: Keyword arguments of `torch.compile`
+
+        """
+        self.static_shapes = True
+        for d in self.scorers.values():
+            if hasattr(d, "enable_static_step"):
+                d.enable_static_step(compile, **compile_kwargs)
+
+    def forward(
+        self,
+        x: torch.Tensor,
+        maxlenratio: float = 0.0,
+        minlenratio: float = 0.0,
+        prefix: torch.Tensor = None,
+    ) -> List[Hypothesis]:
+        """Perform beam search.
+
+        See :meth:`espnet.nets.beam_search.BeamSearch.forward`. With static
+        shapes, `minlenratio` is ignored because the padded search always
+        forces <eos> at the maximum length.
+
+        """
+        if not self.static_shapes:
+            return super().forward(x, maxlenratio, minlenratio, prefix)
+        if prefix is not None:
+            prefix = prefix.unsqueeze(0)
+        xlens = torch.tensor([x.size(0)])
+        return self.batch_forward(x.unsqueeze(0), xlens, maxlenratio, prefix)[0]
+
+    def set_shortlist(self, ids: Union[torch.Tensor, List[torch.Tensor]] = None):
+        """Restrict the searched tokens to a shortlist.
+
+        The scorers that support it (see
+        :meth:`espnet.nets.scorer_interface.BatchStateScorerInterface.batch_set_shortlist`)
+        compute their output layers on the shortlist only and normalize over it,
+        and the pre-beam and beam `topk` only consider the shortlisted tokens.
+        <eos> is always added to the shortlist.
+
+        With one shortlist per utterance, the output layers are computed on
+        their union and each utterance is masked to its own tokens, using the
+        grouping of the hypotheses by utterance of :meth:`batch_forward`.
+
+        Args:
+            ids (Union[torch.Tensor, List[torch.Tensor]]): torch.int64 token ids,
+                or a list of them for each utterance of the next search,
+                None to search all the tokens
+
+        """
+        mask = None
+        if isinstance(ids, (list, tuple)):
+            mask = torch.zeros(
+                (len(ids), self.n_vocab), dtype=torch.bool, device=ids[0].device
+            )
+            for b, utt_ids in enumerate(ids):
+                mask[b, utt_ids] = True
+            mask[:, self.eos] = True
+            ids = torch.cat(ids)
+        if ids is not None:
+            ids = torch.unique(torch.cat((ids.view(-1), ids.new_tensor([self.eos]))))
+            logging.info(f"shortlist of {len(ids)} tokens out of {self.n_vocab}")
+        self.shortlist = ids
+        self.shortlist_mask = mask
+        for d in self.scorers.values():
+            if isinstance(d, BatchStateScorerInterface):
+                d.batch_set_shortlist(ids, None if mask is None else mask[:, ids])
+
+    def shortlist_topk(
+        self, scores: torch.Tensor, k: int, n_group: int = 1
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Compute topk (row, token) ids of groups of rows within the shortlist.
+
+        Args:
+            scores (torch.Tensor): Scores of each token `(n_rows, self.n_vocab)`,
+                the rows are grouped by utterance
+            k (int): The number of ids kept per group, at most all of them
+            n_group (int): The number of groups of contiguous rows
 
-    def _batch_select(self, hyps: BatchHypothesis, ids: List[int]) -> BatchHypothesis:
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor, torch.Tensor]: The scores, the row
+                ids within the group and the token ids of the topk,
+                all of shape `(n_group, k)`
+
+        """
+        if self.shortlist_mask is not None:
+            # each utterance only keeps the tokens of its own shortlist
+            mask = self.shortlist_mask.to(scores.device)
+            mask = mask.repeat_interleave(scores.size(0) // mask.size(0), dim=0)
+            scores = scores.masked_fill(~mask, float("-inf"))
+        if self.shortlist is not None:
+            scores = scores.index_select(1, self.shortlist.to(scores.device))
+        n_token = scores.size(1)
+        scores = scores.reshape(n_group, -1)
+        top_scores, top_ids = scores.topk(min(k, scores.size(1)), dim=-1)
+        row_ids = torch.div(top_ids, n_token, rounding_mode='trunc')
+        token_ids = top_ids % n_token
+        if self.shortlist is not None:
+            token_ids = self.shortlist.to(token_ids.device)[token_ids]
+        return top_scores, row_ids, token_ids
+
+    def _extend_buffer(self, yseq: torch.Tensor) -> torch.Tensor:
+        """Double the capacity of the token buffer."""
+        return torch.cat((yseq, torch.full_like(yseq, self.eos)), dim=1)
+
+    def _batch_select(self, hyps: BatchHypothesis, ids: torch.Tensor) -> BatchHypothesis:
         return BatchHypothesis(
-            yseq=hyps.yseq[ids],
-            score=hyps.score[ids],
-            length=hyps.length[ids],
-            scores={k: v[ids] for k, v in hyps.scores.items()},
+            yseq=hyps.yseq.index_select(0, ids),
+            score=hyps.score.index_select(0, ids),
+            length=hyps.length.new_full((len(ids),), int(hyps.length[0])),
+            scores={k: v.index_select(0, ids) for k, v in hyps.scores.items()},
             states={
-                k: [self.scorers[k].select_state(v, i) for i in ids]
+                k: self.scorers[k].batch_select_state(v, ids)
                 for k, v in hyps.states.items()
             },
         )
 
     def _select(self, hyps: BatchHypothesis, i: int) -> Hypothesis:
+        # NOTE: ended hypotheses are never extended again,
+        # so their scorer states are not kept.
         return Hypothesis(
-            yseq=hyps.yseq[i, : hyps.length[i]],
+            yseq=hyps.yseq[i, : int(hyps.length[i])].clone(),
             score=hyps.score[i],
             scores={k: v[i] for k, v in hyps.scores.items()},
-            states={
-                k: self.scorers[k].select_state(v, i) for k, v in hyps.states.items()
-            },
         )
 
-    def unbatchfy(self, batch_hyps: BatchHypothesis) -> List[Hypothesis]:
-        """Revert batch to list."""
-        return [
-            Hypothesis(
-                yseq=batch_hyps.yseq[i][: batch_hyps.length[i]],
-                score=batch_hyps.score[i],
-                scores={k: batch_hyps.scores[k][i] for k in self.scorers},
-                states={
-                    k: v.select_state(batch_hyps.states[k], i)
-                    for k, v in self.scorers.items()
-                },
-            )
-            for i in range(len(batch_hyps.length))
-        ]
+    @staticmethod
+    def best_running_score(running_hyps: BatchHypothesis) -> float:
+        """Get the best score of the running hypotheses."""
+        return float(running_hyps.score.max())
 
     def batch_beam(
         self, weighted_scores: torch.Tensor, ids: torch.Tensor
@@ -98,15 +207,18 @@ class BatchBeamSearch(BeamSearch):
             Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
                 The topk full (prev_hyp, new_token) ids
                 and partial (prev_hyp, new_token) ids.
-                Their shapes are all `(self.beam_size,)`
+                Their shapes are all `(self.beam_size,)`, or shorter
+                when `self.score_beam` prunes the worst ones
 
         """
-        top_ids = weighted_scores.view(-1).topk(self.beam_size)[1]
-        # Because of the flatten above, `top_ids` is organized as:
-        # [hyp1 * V + token1, hyp2 * V + token2, ..., hypK * V + tokenK],
-        # where V is `self.n_vocab` and K is `self.beam_size`
-        prev_hyp_ids = torch.div(top_ids, self.n_vocab, rounding_mode='trunc')
-        new_token_ids = top_ids % self.n_vocab
+        # the topk is taken over all the (hyp, token) pairs
+        top_scores, prev_hyp_ids, new_token_ids = [
+            v.view(-1) for v in self.shortlist_topk(weighted_scores, self.beam_size)
+        ]
+        if self.score_beam is not None:
+            n_keep = int((top_scores >= top_scores[0] - self.score_beam).sum())
+            prev_hyp_ids = prev_hyp_ids[:n_keep]
+            new_token_ids = new_token_ids[:n_keep]
         return prev_hyp_ids, new_token_ids, prev_hyp_ids, new_token_ids
 
     def init_hyp(self, x: torch.Tensor) -> BatchHypothesis:
@@ -116,113 +228,288 @@ class BatchBeamSearch(BeamSearch):
             x (torch.Tensor): The encoder output feature
 
         Returns:
-            Hypothesis: The initial hypothesis.
+            BatchHypothesis: The initial hypothesis.
 
         """
         init_states = dict()
         init_scores = dict()
         for k, d in self.scorers.items():
-            init_states[k] = d.batch_init_state(x)
-            init_scores[k] = 0.0
-        return self.batchfy(
-            [
-                Hypothesis(
-                    score=0.0,
-                    scores=init_scores,
-                    states=init_states,
-                    yseq=torch.tensor([self.sos], device=x.device),
+            if isinstance(d, BatchStateScorerInterface):
+                init_states[k] = d.batch_init_state(x)
+            else:
+                init_states[k] = [d.batch_init_state(x)]
+            init_scores[k] = torch.zeros(1, dtype=x.dtype, device=x.device)
+        # the buffer covers `maxlen = x.shape[0]` plus <sos> and the final <eos>,
+        # it is only extended when a larger maxlenratio is requested
+        yseq = torch.full(
+            (1, x.size(0) + 2), self.eos, dtype=torch.int64, device=x.device
+        )
+        yseq[:, 0] = self.sos
+        return BatchHypothesis(
+            yseq=yseq,
+            score=torch.zeros(1, dtype=x.dtype, device=x.device),
+            length=torch.ones(1, dtype=torch.int64),
+            scores=init_scores,
+            states=init_states,
+        )
+
+    def init_prefix_hyp(self, x: torch.Tensor, prefix: torch.Tensor) -> BatchHypothesis:
+        """Get an initial hypothesis that already contains a prefix.
+
+        Args:
+            x (torch.Tensor): The encoder output feature (T, D)
+            prefix (torch.Tensor): torch.int64 prefix tokens without <sos> (n_prefix,)
+
+        Returns:
+            BatchHypothesis: The hypothesis after the prefix.
+
+        """
+        xlens = torch.tensor([x.size(0)])
+        return self.init_prefix_hyps(x.unsqueeze(0), xlens, prefix.unsqueeze(0))
+
+    def init_prefix_hyps(
+        self, xs: torch.Tensor, xlens: torch.Tensor, prefix: torch.Tensor
+    ) -> BatchHypothesis:
+        """Get initial hypotheses of a batch of utterances after prefixes.
+
+        Scorers with a batched state score the whole prefixes at once with
+        :meth:`espnet.nets.scorer_interface.BatchStateScorerInterface.batch_init_prefix_state`,
+        so that a long prefix does not cost one search step per token.
+        The other scorers are fed the prefixes one token at a time, as in
+        :meth:`espnet.nets.beam_search.BeamSearch.init_prefix_hyp`.
+
+        Args:
+            xs (torch.Tensor): The padded encoder output feature (n_utt, T, D)
+            xlens (torch.Tensor): The encoder output lengths (n_utt,)
+            prefix (torch.Tensor): torch.int64 prefix tokens without <sos>
+                of each utterance (n_utt, n_prefix)
+
+        Returns:
+            BatchHypothesis: One hypothesis per utterance.
+
+        """
+        n_utt, n_prefix = prefix.shape
+        ys = torch.cat(
+            (prefix.new_full((n_utt, 1), self.sos), prefix), dim=1
+        ).to(xs.device)
+        xs_mask = ~make_pad_mask(xlens, maxlen=xs.size(1)).to(xs.device).unsqueeze(1)
+        init_states = dict()
+        init_scores = dict()
+        for k, d in self.scorers.items():
+            if isinstance(d, BatchStateScorerInterface):
+                init_scores[k], init_states[k] = d.batch_init_prefix_state(
+                    ys, xs, xs_mask
+                )
+            else:
+                init_scores[k], init_states[k] = self.score_prefix_stepwise(
+                    k, ys, xs, xlens, xs_mask
                 )
-            ]
+            init_scores[k] = init_scores[k].to(xs.dtype)
+        yseq = torch.full(
+            (n_utt, max(xs.size(1), n_prefix) + 2),
+            self.eos,
+            dtype=torch.int64,
+            device=xs.device,
+        )
+        yseq[:, : n_prefix + 1] = ys
+        return BatchHypothesis(
+            yseq=yseq,
+            score=sum(self.weights[k] * v for k, v in init_scores.items()),
+            length=torch.full((n_utt,), n_prefix + 1, dtype=torch.int64),
+            scores=init_scores,
+            states=init_states,
         )
 
+    def score_prefix_stepwise(
+        self,
+        k: str,
+        ys: torch.Tensor,
+        xs: torch.Tensor,
+        xlens: torch.Tensor,
+        xs_mask: torch.Tensor,
+    ) -> Tuple[torch.Tensor, Any]:
+        """Feed prefixes to a scorer without a batched state one token at a time.
+
+        Args:
+            k (str): The name of the scorer in `self.scorers`
+            ys (torch.Tensor): torch.int64 prefix tokens starting with <sos>,
+                one prefix per utterance (n_utt, ylen)
+            xs (torch.Tensor): The padded encoder output feature (n_utt, T, D)
+            xlens (torch.Tensor): The encoder output lengths (n_utt,)
+            xs_mask (torch.Tensor): Mask of the valid frames in xs (n_utt, 1, T)
+
+        Returns:
+            Tuple[torch.Tensor, Any]: The accumulated scores of `ys[:, 1:]`
+                (n_utt,) and the scorer states after ys
+
+        """
+        d = self.scorers[k]
+        n_utt = ys.size(0)
+        ids = torch.arange(n_utt, device=xs.device)
+        states = [d.batch_init_state(xs[b, : xlens[b]]) for b in range(n_utt)]
+        score = torch.zeros(n_utt, dtype=xs.dtype, device=xs.device)
+        for i in range(1, ys.size(1)):
+            new_ids = ys[:, i]
+            if k in self.part_scorers:
+                scores, states = d.batch_score_partial(
+                    ys[:, :i], new_ids.unsqueeze(1), states, xs
+                )
+                states = d.batch_select_state(states, ids, new_ids)
+            else:
+                scores, states = d.batch_score(ys[:, :i], states, xs, xs_mask)
+                states = d.batch_select_state(states, ids)
+            score += scores.gather(1, new_ids.unsqueeze(1)).view(-1).to(score.dtype)
+        return score, states
+
     def score_full(
-        self, hyp: BatchHypothesis, x: torch.Tensor
+        self, hyp: BatchHypothesis, x: torch.Tensor, x_mask: torch.Tensor = None
     ) -> Tuple[Dict[str, torch.Tensor], Dict[str, Any]]:
         """Score new hypothesis by `self.full_scorers`.
 
         Args:
-            hyp (Hypothesis): Hypothesis with prefix tokens to score
-            x (torch.Tensor): Corresponding input feature
+            hyp (BatchHypothesis): Hypotheses with prefix tokens to score
+            x (torch.Tensor): Corresponding input feature (n_batch, T, D)
+            x_mask (torch.Tensor): Mask of the valid frames in x (n_batch, 1, T)
 
         Returns:
             Tuple[Dict[str, torch.Tensor], Dict[str, Any]]: Tuple of
                 score dict of `hyp` that has string keys of `self.full_scorers`
-                and tensor score values of shape: `(self.n_vocab,)`,
+                and tensor score values of shape: `(n_batch, self.n_vocab)`,
                 and state dict that has string keys
                 and state values of `self.full_scorers`
 
         """
         scores = dict()
         states = dict()
+        ys = hyp.yseq[:, : int(hyp.length[0])]
         for k, d in self.full_scorers.items():
-            scores[k], states[k] = d.batch_score(hyp.yseq, hyp.states[k], x)
+            scores[k], states[k] = d.batch_score(ys, hyp.states[k], x, x_mask)
         return scores, states
 
     def score_partial(
         self, hyp: BatchHypothesis, ids: torch.Tensor, x: torch.Tensor
     ) -> Tuple[Dict[str, torch.Tensor], Dict[str, Any]]:
-        """Score new hypothesis by `self.full_scorers`.
+        """Score new hypothesis by `self.part_scorers`.
 
         Args:
-            hyp (Hypothesis): Hypothesis with prefix tokens to score
+            hyp (BatchHypothesis): Hypotheses with prefix tokens to score
             ids (torch.Tensor): 2D tensor of new partial tokens to score
             x (torch.Tensor): Corresponding input feature
 
         Returns:
             Tuple[Dict[str, torch.Tensor], Dict[str, Any]]: Tuple of
-                score dict of `hyp` that has string keys of `self.full_scorers`
-                and tensor score values of shape: `(self.n_vocab,)`,
+                score dict of `hyp` that has string keys of `self.part_scorers`
+                and tensor score values of shape: `(n_batch, self.n_vocab)`,
                 and state dict that has string keys
-                and state values of `self.full_scorers`
+                and state values of `self.part_scorers`
 
         """
         scores = dict()
         states = dict()
+        ys = hyp.yseq[:, : int(hyp.length[0])]
         for k, d in self.part_scorers.items():
-            scores[k], states[k] = d.batch_score_partial(
-                hyp.yseq, ids, hyp.states[k], x
-            )
+            scores[k], states[k] = d.batch_score_partial(ys, ids, hyp.states[k], x)
         return scores, states
 
-    def merge_states(self, states: Any, part_states: Any, part_idx: int) -> Any:
-        """Merge states for new hypothesis.
+    @staticmethod
+    def batch_merge_scores(
+        prev_scores: Dict[str, torch.Tensor],
+        next_full_scores: Dict[str, torch.Tensor],
+        full_prev_ids: torch.Tensor,
+        full_new_ids: torch.Tensor,
+        next_part_scores: Dict[str, torch.Tensor],
+        part_prev_ids: torch.Tensor,
+        part_new_ids: torch.Tensor,
+    ) -> Dict[str, torch.Tensor]:
+        """Merge scores for the selected hypotheses.
+
+        Args:
+            prev_scores (Dict[str, torch.Tensor]):
+                The previous hypothesis scores by `self.scorers` (n_batch,)
+            next_full_scores (Dict[str, torch.Tensor]):
+                scores by `self.full_scorers` (n_batch, n_vocab)
+            full_prev_ids (torch.Tensor): The previous hypothesis ids (n_best,)
+            full_new_ids (torch.Tensor): The new token ids (n_best,)
+            next_part_scores (Dict[str, torch.Tensor]):
+                scores of partial tokens by `self.part_scorers` (n_batch, n_vocab)
+            part_prev_ids (torch.Tensor): The previous hypothesis ids (n_best,)
+            part_new_ids (torch.Tensor): The new token ids (n_best,)
+
+        Returns:
+            Dict[str, torch.Tensor]: The new score dict.
+                Its keys are names of `self.full_scorers` and `self.part_scorers`.
+                Its values are `(n_best,)` tensors.
+
+        """
+        new_scores = dict()
+        for k, v in next_full_scores.items():
+            new_scores[k] = prev_scores[k][full_prev_ids] + v[full_prev_ids, full_new_ids]
+        for k, v in next_part_scores.items():
+            new_scores[k] = prev_scores[k][part_prev_ids] + v[part_prev_ids, part_new_ids]
+        return new_scores
+
+    def batch_merge_states(
+        self,
+        states: Dict[str, Any],
+        part_states: Dict[str, Any],
+        full_prev_ids: torch.Tensor,
+        part_prev_ids: torch.Tensor,
+        part_new_ids: torch.Tensor,
+    ) -> Dict[str, Any]:
+        """Merge states for the selected hypotheses.
 
         Args:
             states: states of `self.full_scorers`
             part_states: states of `self.part_scorers`
-            part_idx (int): The new token id for `part_scores`
+            full_prev_ids (torch.Tensor): The previous hypothesis ids (n_best,)
+            part_prev_ids (torch.Tensor): The previous hypothesis ids (n_best,)
+            part_new_ids (torch.Tensor): The new token ids (n_best,)
 
         Returns:
-            Dict[str, torch.Tensor]: The new score dict.
+            Dict[str, Any]: The new state dict.
                 Its keys are names of `self.full_scorers` and `self.part_scorers`.
-                Its values are states of the scorers.
+                Its values are batched states of the scorers.
 
         """
         new_states = dict()
         for k, v in states.items():
-            new_states[k] = v
+            new_states[k] = self.full_scorers[k].batch_select_state(v, full_prev_ids)
         for k, v in part_states.items():
-            new_states[k] = v
+            new_states[k] = self.part_scorers[k].batch_select_state(
+                v, part_prev_ids, part_new_ids
+            )
         return new_states
 
-    def search(self, running_hyps: BatchHypothesis, x: torch.Tensor) -> BatchHypothesis:
-        """Search new tokens for running hypotheses and encoded speech x.
+    def batch_score_hyps(
+        self,
+        running_hyps: BatchHypothesis,
+        xs: torch.Tensor,
+        xs_mask: torch.Tensor = None,
+        n_utt: int = 1,
+    ) -> Tuple[torch.Tensor, Dict[str, torch.Tensor], Dict[str, Any], Dict[str, torch.Tensor], Dict[str, Any]]:
+        """Compute the weighted scores of all the next tokens of running hypotheses.
 
         Args:
             running_hyps (BatchHypothesis): Running hypotheses on beam
-            x (torch.Tensor): Encoded speech feature (T, D)
+            xs (torch.Tensor): Encoded speech feature per hypothesis (n_batch, T, D),
+                or per utterance (n_utt, T, D) as the hypotheses are grouped
+                by utterance
+            xs_mask (torch.Tensor): Mask of the valid frames in xs (n_batch or n_utt, 1, T)
+            n_utt (int): The number of utterances the hypotheses belong to
 
         Returns:
-            BatchHypothesis: Best sorted hypotheses
+            Tuple: weighted scores including the previous hypothesis scores
+                `(n_batch, self.n_vocab)`, and the scores and states
+                of `self.full_scorers` and `self.part_scorers`
 
         """
         n_batch = len(running_hyps)
         part_ids = None  # no pre-beam
         # batch scoring
         weighted_scores = torch.zeros(
-            n_batch, self.n_vocab, dtype=x.dtype, device=x.device
+            n_batch, self.n_vocab, dtype=xs.dtype, device=xs.device
         )
-        scores, states = self.score_full(running_hyps, x.expand(n_batch, *x.shape))
+        scores, states = self.score_full(running_hyps, xs, xs_mask)
         for k in self.full_scorers:
             weighted_scores += self.weights[k] * scores[k]
         # partial scoring
@@ -232,57 +519,112 @@ class BatchBeamSearch(BeamSearch):
                 if self.pre_beam_score_key == "full"
                 else scores[self.pre_beam_score_key]
             )
-            part_ids = torch.topk(pre_beam_scores, self.pre_beam_size, dim=-1)[1]
+            pre_beam_size = self.pre_beam_size
+            if self.pre_beam_threshold is not None:
+                # only the running rows count, ended and pruned ones score -inf
+                live = torch.isfinite(running_hyps.score).to(xs.device)
+                n_live = live.view(n_utt, -1).sum(dim=1)
+                if bool(live.any()):
+                    pre_beam_size = self.get_pre_beam_size(
+                        pre_beam_scores[live], int(n_live[n_live > 0].min())
+                    )
+            part_ids = self.shortlist_topk(pre_beam_scores, pre_beam_size, n_batch)[2]
         # NOTE(takaaki-hori): Unlike BeamSearch, we assume that score_partial returns
         # full-size score matrices, which has non-zero scores for part_ids and zeros
         # for others.
-        part_scores, part_states = self.score_partial(running_hyps, part_ids, x)
+        part_scores, part_states = self.score_partial(running_hyps, part_ids, xs)
         for k in self.part_scorers:
             weighted_scores += self.weights[k] * part_scores[k]
         # add previous hyp scores
         weighted_scores += running_hyps.score.to(
-            dtype=x.dtype, device=x.device
+            dtype=xs.dtype, device=xs.device
         ).unsqueeze(1)
+        return weighted_scores, scores, states, part_scores, part_states
 
-        # TODO(karita): do not use list. use batch instead
-        # see also https://github.com/espnet/espnet/pull/1402#discussion_r354561029
-        # update hyps
-        best_hyps = []
-        prev_hyps = self.unbatchfy(running_hyps)
-        for (
-            full_prev_hyp_id,
-            full_new_token_id,
-            part_prev_hyp_id,
-            part_new_token_id,
-        ) in zip(*self.batch_beam(weighted_scores, part_ids)):
-            prev_hyp = prev_hyps[full_prev_hyp_id]
-            best_hyps.append(
-                Hypothesis(
-                    score=weighted_scores[full_prev_hyp_id, full_new_token_id],
-                    yseq=self.append_token(prev_hyp.yseq, full_new_token_id),
-                    scores=self.merge_scores(
-                        prev_hyp.scores,
-                        {k: v[full_prev_hyp_id] for k, v in scores.items()},
-                        full_new_token_id,
-                        {k: v[part_prev_hyp_id] for k, v in part_scores.items()},
-                        part_new_token_id,
-                    ),
-                    states=self.merge_states(
-                        {
-                            k: self.full_scorers[k].select_state(v, full_prev_hyp_id)
-                            for k, v in states.items()
-                        },
-                        {
-                            k: self.part_scorers[k].select_state(
-                                v, part_prev_hyp_id, part_new_token_id
-                            )
-                            for k, v in part_states.items()
-                        },
-                        part_new_token_id,
-                    ),
-                )
-            )
-        return self.batchfy(best_hyps)
+    def batch_update_hyps(
+        self,
+        running_hyps: BatchHypothesis,
+        weighted_scores: torch.Tensor,
+        scores: Dict[str, torch.Tensor],
+        states: Dict[str, Any],
+        part_scores: Dict[str, torch.Tensor],
+        part_states: Dict[str, Any],
+        best_ids: Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor],
+    ) -> BatchHypothesis:
+        """Gather the selected hypotheses and append their new tokens.
+
+        Args:
+            running_hyps (BatchHypothesis): Running hypotheses on beam
+            weighted_scores (torch.Tensor): The weighted scores `(n_batch, n_vocab)`
+            scores (Dict[str, torch.Tensor]): scores by `self.full_scorers`
+            states (Dict[str, Any]): states of `self.full_scorers`
+            part_scores (Dict[str, torch.Tensor]): scores by `self.part_scorers`
+            part_states (Dict[str, Any]): states of `self.part_scorers`
+            best_ids (Tuple[torch.Tensor, ...]): The full (prev_hyp, new_token) ids
+                and partial (prev_hyp, new_token) ids of the selected hypotheses
+
+        Returns:
+            BatchHypothesis: The selected hypotheses
+
+        """
+        (
+            full_prev_hyp_ids,
+            full_new_token_ids,
+            part_prev_hyp_ids,
+            part_new_token_ids,
+        ) = best_ids
+        length = int(running_hyps.length[0])
+        yseq = running_hyps.yseq
+        if length >= yseq.size(1):
+            yseq = self._extend_buffer(yseq)
+        yseq = yseq.index_select(0, full_prev_hyp_ids)
+        yseq[:, length] = full_new_token_ids
+        return BatchHypothesis(
+            yseq=yseq,
+            score=weighted_scores[full_prev_hyp_ids, full_new_token_ids],
+            length=running_hyps.length.new_full((len(full_prev_hyp_ids),), length + 1),
+            scores=self.batch_merge_scores(
+                running_hyps.scores,
+                scores,
+                full_prev_hyp_ids,
+                full_new_token_ids,
+                part_scores,
+                part_prev_hyp_ids,
+                part_new_token_ids,
+            ),
+            states=self.batch_merge_states(
+                states,
+                part_states,
+                full_prev_hyp_ids,
+                part_prev_hyp_ids,
+                part_new_token_ids,
+            ),
+        )
+
+    def search(self, running_hyps: BatchHypothesis, x: torch.Tensor) -> BatchHypothesis:
+        """Search new tokens for running hypotheses and encoded speech x.
+
+        Args:
+            running_hyps (BatchHypothesis): Running hypotheses on beam
+            x (torch.Tensor): Encoded speech feature (T, D)
+
+        Returns:
+            BatchHypothesis: Best sorted hypotheses
+
+        """
+        n_batch = len(running_hyps)
+        weighted_scores, scores, states, part_scores, part_states = (
+            self.batch_score_hyps(running_hyps, x.expand(n_batch, *x.shape))
+        )
+        return self.batch_update_hyps(
+            running_hyps,
+            weighted_scores,
+            scores,
+            states,
+            part_scores,
+            part_states,
+            self.batch_beam(weighted_scores, None),
+        )
 
     def post_process(
         self,
@@ -305,45 +647,280 @@ class BatchBeamSearch(BeamSearch):
             BatchHypothesis: The new running hypotheses.
 
         """
-        n_batch = running_hyps.yseq.shape[0]
+        n_batch = len(running_hyps)
+        length = int(running_hyps.length[0])
         logging.debug(f"the number of running hypothes: {n_batch}")
         if self.token_list is not None:
             logging.debug(
                 "best hypo: "
                 + "".join(
-                    [
-                        self.token_list[x]
-                        for x in running_hyps.yseq[0, 1 : running_hyps.length[0]]
-                    ]
+                    [self.token_list[x] for x in running_hyps.yseq[0, 1:length]]
                 )
             )
         # add eos in the final loop to avoid that there are no ended hyps
         if i == maxlen - 1:
             logging.info("adding <eos> in the last position in the loop")
-            yseq_eos = torch.cat(
-                (
-                    running_hyps.yseq,
-                    torch.full(
-                        (n_batch, 1),
-                        self.eos,
-                        device=running_hyps.yseq.device,
-                        dtype=torch.int64,
-                    ),
-                ),
-                1,
+            yseq = running_hyps.yseq
+            if length >= yseq.size(1):
+                yseq = self._extend_buffer(yseq)
+            yseq[:, length] = self.eos
+            length += 1
+            running_hyps = running_hyps._replace(
+                yseq=yseq, length=running_hyps.length.new_full((n_batch,), length)
             )
-            running_hyps.yseq.resize_as_(yseq_eos)
-            running_hyps.yseq[:] = yseq_eos
-            running_hyps.length[:] = yseq_eos.shape[1]
 
         # add ended hypotheses to a final list, and removed them from current hypotheses
         # (this will be a probmlem, number of hyps < beam)
-        is_eos = (
-            running_hyps.yseq[torch.arange(n_batch), running_hyps.length - 1]
-            == self.eos
-        )
-        for b in torch.nonzero(is_eos, as_tuple=False).view(-1):
-            hyp = self._select(running_hyps, b)
-            ended_hyps.append(hyp)
+        is_eos = running_hyps.yseq[:, length - 1] == self.eos
+        for b in torch.nonzero(is_eos, as_tuple=False).view(-1).tolist():
+            ended_hyps.append(self._select(running_hyps, b))
         remained_ids = torch.nonzero(is_eos == 0, as_tuple=False).view(-1)
+        if self.max_active is not None:
+            # running hypotheses are sorted by score in `batch_beam`
+            remained_ids = remained_ids[: self.max_active]
+        if len(remained_ids) == n_batch:
+            return running_hyps
         return self._batch_select(running_hyps, remained_ids)
+
+    def init_utterance_hyps(
+        self, xs: torch.Tensor, xlens: torch.Tensor
+    ) -> BatchHypothesis:
+        """Get initial hypotheses of a batch of utterances.
+
+        Args:
+            xs (torch.Tensor): The padded encoder output feature (n_utt, T, D)
+            xlens (torch.Tensor): The encoder output lengths (n_utt,)
+
+        Returns:
+            BatchHypothesis: One initial hypothesis per utterance.
+
+        """
+        n_utt = xs.size(0)
+        init_states = dict()
+        init_scores = dict()
+        for k, d in self.scorers.items():
+            if isinstance(d, BatchStateScorerInterface):
+                # one batched state of all the utterances
+                init_states[k] = d.batch_init_state(xs, xlens)
+            else:
+                init_states[k] = [
+                    d.batch_init_state(xs[b, : xlens[b]]) for b in range(n_utt)
+                ]
+            init_scores[k] = torch.zeros(n_utt, dtype=xs.dtype, device=xs.device)
+        yseq = torch.full(
+            (n_utt, xs.size(1) + 2), self.eos, dtype=torch.int64, device=xs.device
+        )
+        yseq[:, 0] = self.sos
+        return BatchHypothesis(
+            yseq=yseq,
+            score=torch.zeros(n_utt, dtype=xs.dtype, device=xs.device),
+            length=torch.ones(n_utt, dtype=torch.int64),
+            scores=init_scores,
+            states=init_states,
+        )
+
+    def utterance_beam(
+        self, weighted_scores: torch.Tensor, n_utt: int
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Compute topk (prev_hyp, new_token) ids separately for each utterance.
+
+        Args:
+            weighted_scores (torch.Tensor): The weighted sum scores for each tokens.
+                Its shape is `(n_utt * n_hyps, self.vocab_size)`, hypotheses
+                are grouped by utterance.
+            n_utt (int): The number of utterances
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+                The topk full (prev_hyp, new_token) ids
+                and partial (prev_hyp, new_token) ids.
+                Their shapes are all `(n_utt * self.beam_size,)`
+
+        """
+        n_hyps = weighted_scores.size(0) // n_utt
+        _, top_hyp_ids, new_token_ids = self.shortlist_topk(
+            weighted_scores, self.beam_size, n_utt
+        )
+        offsets = torch.arange(n_utt, device=top_hyp_ids.device).unsqueeze(1) * n_hyps
+        prev_hyp_ids = (top_hyp_ids + offsets).view(-1)
+        return prev_hyp_ids, new_token_ids.view(-1), prev_hyp_ids, new_token_ids.view(-1)
+
+    def batch_forward(
+        self,
+        xs: torch.Tensor,
+        xlens: torch.Tensor,
+        maxlenratio: float = 0.0,
+        prefix: torch.Tensor = None,
+    ) -> List[List[Hypothesis]]:
+        """Perform beam search on a batch of padded utterances.
+
+        Every utterance keeps its own beam of `self.beam_size` hypotheses.
+        Ended hypotheses, hypotheses pruned by `self.score_beam` or
+        `self.max_active` and finished utterances are masked with `-inf` scores
+        instead of being removed, so that all the scorers keep running on one
+        `(n_utt * beam_size)` batch.
+
+        Args:
+            xs (torch.Tensor): Padded encoded speech features (n_utt, T, D)
+            xlens (torch.Tensor): Lengths of the encoded speech features (n_utt,)
+            maxlenratio (float): Input length ratio to obtain max output length.
+                If maxlenratio=0.0 (default), it uses a end-detect function
+                to automatically find maximum hypothesis lengths
+                If maxlenratio<0.0, its absolute value is interpreted
+                as a constant max output length.
+            prefix (torch.Tensor): torch.int64 tokens without <sos> that start
+                the hypotheses of each utterance (n_utt, n_prefix)
+
+        Returns:
+            list[list[Hypothesis]]: N-best decoding results of each utterance
+
+        """
+        n_utt = xs.size(0)
+        xlens = torch.as_tensor(xlens, dtype=torch.int64).cpu()
+        # set length bounds
+        if maxlenratio == 0:
+            maxlens = xlens.tolist()
+        elif maxlenratio < 0:
+            maxlens = [-1 * int(maxlenratio)] * n_utt
+        else:
+            maxlens = [max(1, int(maxlenratio * l)) for l in xlens.tolist()]
+        logging.info("decoder input lengths: " + str(xlens.tolist()))
+        logging.info("max output lengths: " + str(maxlens))
+        xs_mask = ~make_pad_mask(xlens, maxlen=xs.size(1)).to(xs.device).unsqueeze(1)
+
+        if prefix is not None:
+            prefix = prefix[:, : min(maxlens) - 1]
+        if prefix is not None and prefix.size(1) > 0:
+            running_hyps = self.init_prefix_hyps(xs, xlens, prefix)
+            start = prefix.size(1)
+        else:
+            running_hyps = self.init_utterance_hyps(xs, xlens)
+            start = 0
+        ended_hyps = [[] for _ in range(n_utt)]
+        end_detectors = [EndDetector() for _ in range(n_utt)]
+        finished = [False] * n_utt
+        for i in range(start, max(maxlens)):
+            logging.debug("position " + str(i))
+            # one row of encoder output per utterance: the decoder projects it
+            # once and broadcasts it over the beam, the other scorers ignore it
+            weighted_scores, scores, states, part_scores, part_states = (
+                self.batch_score_hyps(running_hyps, xs, xs_mask, n_utt)
+            )
+            running_hyps = self.batch_update_hyps(
+                running_hyps,
+                weighted_scores,
+                scores,
+                states,
+                part_scores,
+                part_states,
+                self.utterance_beam(weighted_scores, n_utt),
+            )
+            running_hyps = self.batch_post_process(
+                i, maxlens, maxlenratio, running_hyps, ended_hyps, finished, end_detectors
+            )
+            if all(finished):
+                break
+
+        nbest_hyps = []
+        for b in range(n_utt):
+            nbest = sorted(ended_hyps[b], key=lambda x: x.score, reverse=True)
+            if len(nbest) == 0:
+                logging.warning(f"there is no N-best results for utterance {b}.")
+            else:
+                logging.info(f"total log probability of utterance {b}: {nbest[0].score:.2f}")
+            nbest_hyps.append(nbest)
+        return nbest_hyps
+
+    def batch_post_process(
+        self,
+        i: int,
+        maxlens: List[int],
+        maxlenratio: float,
+        running_hyps: BatchHypothesis,
+        ended_hyps: List[List[Hypothesis]],
+        finished: List[bool],
+        end_detectors: List[EndDetector],
+    ) -> BatchHypothesis:
+        """Perform post-processing of multi-utterance beam search iterations.
+
+        Args:
+            i (int): The length of hypothesis tokens.
+            maxlens (List[int]): The maximum length of tokens of each utterance.
+            maxlenratio (int): The maximum length ratio in beam search.
+            running_hyps (BatchHypothesis): The running hypotheses in beam search.
+            ended_hyps (List[List[Hypothesis]]):
+                The ended hypotheses of each utterance.
+            finished (List[bool]): Whether the search of each utterance is over.
+                It is updated in place.
+            end_detectors (List[EndDetector]): The end detectors of each utterance,
+                updated with the new ended hypotheses.
+
+        Returns:
+            BatchHypothesis: The running hypotheses with masked scores.
+
+        """
+        n_utt = len(ended_hyps)
+        n_hyps = len(running_hyps) // n_utt
+        length = int(running_hyps.length[0])
+        is_alive = torch.isfinite(running_hyps.score)
+        if self.score_beam is not None:
+            best = running_hyps.score.view(n_utt, n_hyps).max(dim=1)[0]
+            threshold = (best - self.score_beam).repeat_interleave(n_hyps)
+            is_alive &= running_hyps.score >= threshold
+        is_eos = (running_hyps.yseq[:, length - 1] == self.eos) & is_alive
+        # add eos in the final loop of each utterance to avoid no ended hyps
+        is_last = torch.tensor(
+            [i == maxlen - 1 and not done for maxlen, done in zip(maxlens, finished)],
+            device=is_alive.device,
+        ).repeat_interleave(n_hyps)
+        new_ended = []
+        for b in torch.nonzero(is_eos, as_tuple=False).view(-1).tolist():
+            if not finished[b // n_hyps]:
+                new_ended.append((b // n_hyps, self._select(running_hyps, b)))
+        for b in torch.nonzero(is_last & is_alive & ~is_eos, as_tuple=False).view(-1).tolist():
+            hyp = self._select(running_hyps, b)
+            new_ended.append(
+                (b // n_hyps, hyp._replace(yseq=self.append_token(hyp.yseq, self.eos)))
+            )
+        for u, hyp in new_ended:
+            ended_hyps[u].append(hyp)
+            end_detectors[u].add(len(hyp.yseq), hyp.score)
+
+        # keep at most `max_active` running hypotheses per utterance,
+        # they are sorted by score in `utterance_beam`
+        is_running = (is_alive & ~is_eos).view(n_utt, n_hyps)
+        if self.max_active is not None:
+            is_running &= is_running.cumsum(dim=1) <= self.max_active
+        is_running = is_running.view(-1)
+
+        # end detection
+        is_alive = (is_running & ~is_last).view(n_utt, n_hyps).any(1).tolist()
+        if self.exact_stop:
+            best_running = (
+                running_hyps.score.masked_fill(~is_running, float("-inf"))
+                .view(n_utt, n_hyps)
+                .max(dim=1)[0]
+                .tolist()
+            )
+        for u in range(n_utt):
+            if finished[u]:
+                continue
+            if not is_alive[u]:
+                finished[u] = True
+            elif maxlenratio == 0.0 and end_detectors[u](i):
+                logging.info(f"end detected at {i} for utterance {u}")
+                finished[u] = True
+            elif self.exact_stop and (
+                best_running[u] + self.max_future_score(maxlens[u] - 1 - i)
+                < end_detectors[u].best_score
+            ):
+                logging.info(f"no running hypothesis can win at {i} for utterance {u}")
+                finished[u] = True
+
+        # mask ended or pruned hypotheses and finished utterances
+        mask = ~is_running | torch.tensor(
+            finished, device=is_eos.device
+        ).repeat_interleave(n_hyps)
+        return running_hyps._replace(
+            score=running_hyps.score.masked_fill(mask, float("-inf"))
+        )
@@ -0,0 +1,168 @@
+"""Parallel beam search module for online decoding."""
+
+import copy
+import logging
+from typing import List
+
+import torch
+
+from espnet.nets.batch_beam_search import BatchBeamSearch
+from espnet.nets.beam_search import Hypothesis
+from espnet.nets.e2e_asr_common import EndDetector
+
+
+class BatchBeamSearchOnline(BatchBeamSearch):
+    """Online beam search over encoder output arriving block by block.
+
+    Every block is appended to a buffer of the encoder output of the
+    utterance, and the running hypotheses are extended to it: the scorers
+    with `extend_prob` (the CTC prefix scorer) extend their posteriors and the
+    state of the running hypotheses (Eq. (14) in
+    https://arxiv.org/abs/2006.14941), the scorers with `extend_memory`
+    (the transformer decoder) keep the cached prefixes and attend to the new
+    frames from the next step, and the states of the other scorers do not
+    depend on the encoder output. The search then continues from the running
+    hypotheses.
+
+    Before the final block, a step in which some hypothesis selects <eos> is
+    discarded and the search waits for the next block (block-boundary end
+    rule): the hypotheses only ran out of encoder output. The scorer states of
+    the last committed step are restored, since the discarded step may have
+    updated them in place (e.g. advanced a key/value cache). The tokens shared by
+    all the running hypotheses (:meth:`stable_prefix`) do not change anymore,
+    since every later hypothesis extends one of them.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Initialize online beam search, see :class:`BatchBeamSearch`."""
+        super().__init__(*args, **kwargs)
+        self.reset()
+
+    def reset(self):
+        """Prepare the search of a new utterance."""
+        self.encbuffer = None
+        self.running_hyps = None
+        self.ended_hyps = []
+        self.process_idx = 0
+        self.end_detector = EndDetector()
+
+    def forward_block(
+        self, x: torch.Tensor, is_final: bool = False, maxlenratio: float = 0.0
+    ) -> List[Hypothesis]:
+        """Decode the next block of encoder output of the utterance.
+
+        Args:
+            x (torch.Tensor): Encoded speech feature of the block (T_block, D)
+            is_final (bool): Whether it is the last block of the utterance
+            maxlenratio (float): Input length ratio to obtain max output length,
+                see :meth:`espnet.nets.beam_search.BeamSearch.forward`,
+                applied to the encoder output of the whole utterance
+
+        Returns:
+            list[Hypothesis]: N-best decoding results after the final block,
+                an empty list before it (see :meth:`stable_prefix`)
+
+        """
+        if self.encbuffer is None:
+            self.encbuffer = x
+        else:
+            self.encbuffer = torch.cat((self.encbuffer, x), dim=0)
+        x = self.encbuffer
+        if x.size(0) == 0:
+            return []
+        if self.running_hyps is None:
+            self.running_hyps = self.init_hyp(x)
+        else:
+            self.extend(x)
+
+        # at most one token per frame of the current buffer before the final block
+        if not is_final or maxlenratio == 0:
+            maxlen = x.size(0)
+        elif maxlenratio < 0:
+            maxlen = -1 * int(maxlenratio)
+        else:
+            maxlen = max(1, int(maxlenratio * x.size(0)))
+        self.process_block(x, is_final, maxlen, maxlenratio)
+        if not is_final:
+            return []
+
+        nbest_hyps = sorted(self.ended_hyps, key=lambda x: x.score, reverse=True)
+        if len(nbest_hyps) > 0:
+            logging.info(f"total log probability: {nbest_hyps[0].score:.2f}")
+        self.reset()
+        return nbest_hyps
+
+    def extend(self, x: torch.Tensor):
+        """Extend the scorer states of the running hypotheses to the encoder output.
+
+        Args:
+            x (torch.Tensor): Encoded speech feature of the utterance so far (T, D)
+
+        """
+        states = dict(self.running_hyps.states)
+        for k, d in self.scorers.items():
+            if hasattr(d, "extend_prob"):
+                d.extend_prob(x)
+                states[k] = d.extend_state(states[k])
+            elif hasattr(d, "extend_memory"):
+                states[k] = d.extend_memory(states[k], x.unsqueeze(0))
+        self.running_hyps = self.running_hyps._replace(states=states)
+
+    def process_block(
+        self, x: torch.Tensor, is_final: bool, maxlen: int, maxlenratio: float
+    ):
+        """Search until the end of the buffer, or of the utterance if `is_final`.
+
+        Args:
+            x (torch.Tensor): Encoded speech feature of the utterance so far (T, D)
+            is_final (bool): Whether the buffer holds the whole utterance
+            maxlen (int): The maximum length of tokens
+            maxlenratio (float): The maximum length ratio of the beam search
+
+        """
+        while self.process_idx < maxlen:
+            logging.debug("position " + str(self.process_idx))
+            # shallow copies keep the committed states, e.g. the length of a
+            # key/value cache that the step advances in place
+            committed_states = {
+                k: copy.copy(v) for k, v in self.running_hyps.states.items()
+            }
+            best = self.search(self.running_hyps, x)
+            length = int(best.length[0])
+            if not is_final and bool((best.yseq[:, length - 1] == self.eos).any()):
+                logging.debug(f"<eos> at {self.process_idx} before the final block")
+                self.running_hyps = self.running_hyps._replace(states=committed_states)
+                break
+            n_ended = len(self.ended_hyps)
+            # <eos> is only forced at the maximum length of the final block
+            self.running_hyps = self.post_process(
+                self.process_idx,
+                maxlen if is_final else maxlen + 1,
+                maxlenratio,
+                best,
+                self.ended_hyps,
+            )
+            for h in self.ended_hyps[n_ended:]:
+                self.end_detector.add(len(h.yseq), h.score)
+            self.process_idx += 1
+            if maxlenratio == 0.0 and self.end_detector(self.process_idx - 1):
+                logging.info(f"end detected at {self.process_idx - 1}")
+                break
+            if len(self.running_hyps) == 0:
+                logging.info("no hypothesis. Finish decoding.")
+                break
+
+    def stable_prefix(self) -> torch.Tensor:
+        """Get the tokens shared by all the running hypotheses.
+
+        Returns:
+            torch.Tensor: torch.int64 tokens without <sos> (n_stable,)
+
+        """
+        if self.running_hyps is None or len(self.running_hyps) == 0:
+            return torch.zeros(0, dtype=torch.int64)
+        length = int(self.running_hyps.length[0])
+        ys = self.running_hyps.yseq[:, 1:length]
+        n_stable = int((ys == ys[:1]).all(dim=0).long().cumprod(dim=0).sum())
+        return ys[0, :n_stable]
@@ -11,9 +11,10 @@ from typing import Union
 
 import torch
 
-from espnet.nets.e2e_asr_common import end_detect
+from espnet.nets.e2e_asr_common import EndDetector
 from espnet.nets.scorer_interface import PartialScorerInterface
 from espnet.nets.scorer_interface import ScorerInterface
+from espnet.nets.scorers.length_bonus import LengthBonus
 
 
 class Hypothesis(NamedTuple):
@@ -47,6 +48,10 @@ class BeamSearch(torch.nn.Module):
         token_list: List[str] = None,
         pre_beam_ratio: float = 1.5,
         pre_beam_score_key: str = None,
+        score_beam: float = None,
+        max_active: int = None,
+        pre_beam_threshold: float = None,
+        exact_stop: bool = False,
     ):
         """Initialize beam search.
 
@@ -64,6 +69,17 @@ class BeamSearch(torch.nn.Module):
             pre_beam_score_key (str): key of scores to perform pre-beam search
             pre_beam_ratio (float): beam size in the pre-beam search
                 will be `int(pre_beam_ratio * beam_size)`
+            score_beam (float): Prune the hypotheses whose score is more than
+                `score_beam` behind the best one (None means no pruning)
+            max_active (int): The maximum number of running hypotheses extended
+                in the next step (None means `beam_size`)
+            pre_beam_threshold (float): Adapt the pre-beam size to the number of
+                tokens whose pre-beam score is within `pre_beam_threshold`
+                of the best token, bounded by `int(pre_beam_ratio * beam_size)`
+                (None means a fixed pre-beam size)
+            exact_stop (bool): Stop as soon as no running hypothesis can beat
+                the best ended one. It requires non-negative weights,
+                all the scorers except LengthBonus giving log probabilities.
 
         """
         super().__init__()
@@ -96,6 +112,16 @@ class BeamSearch(torch.nn.Module):
         self.token_list = token_list
         self.pre_beam_size = int(pre_beam_ratio * beam_size)
         self.beam_size = beam_size
+        self.score_beam = score_beam
+        self.max_active = max_active
+        self.pre_beam_threshold = pre_beam_threshold
+        if exact_stop and any(
+            self.weights[k] < 0
+            for k, v in self.scorers.items()
+            if not isinstance(v, LengthBonus)
+        ):
+            raise ValueError("exact_stop requires non-negative scorer weights")
+        self.exact_stop = exact_stop
         self.n_vocab = vocab_size
         if (
             pre_beam_score_key is not None
@@ -134,6 +160,80 @@ class BeamSearch(torch.nn.Module):
             )
         ]
 
+    def init_prefix_hyp(self, x: torch.Tensor, prefix: torch.Tensor) -> Any:
+        """Get an initial hypothesis that already contains a prefix.
+
+        The scorers are fed the prefix one token at a time, as if the search
+        had selected it.
+
+        Args:
+            x (torch.Tensor): The encoder output feature
+            prefix (torch.Tensor): torch.int64 prefix tokens without <sos>
+
+        Returns:
+            The running hypotheses after the prefix.
+
+        """
+        hyp = self.init_hyp(x)[0]
+        for token in prefix.tolist():
+            scores, states = self.score_full(hyp, x)
+            part_ids = torch.tensor([token], device=x.device)
+            part_scores, part_states = self.score_partial(hyp, part_ids, x)
+            score = hyp.score
+            for k in self.full_scorers:
+                score += self.weights[k] * scores[k][token]
+            for k in self.part_scorers:
+                score += self.weights[k] * part_scores[k][0]
+            hyp = Hypothesis(
+                score=score,
+                yseq=self.append_token(hyp.yseq, token),
+                scores=self.merge_scores(hyp.scores, scores, token, part_scores, 0),
+                states=self.merge_states(states, part_states, 0),
+            )
+        return [hyp]
+
+    def get_pre_beam_size(self, pre_beam_scores: torch.Tensor, n_hyps: int = 1) -> int:
+        """Get the pre-beam size of the current step.
+
+        Args:
+            pre_beam_scores (torch.Tensor): The pre-beam scores of the running
+                hypotheses `(self.n_vocab,)` or `(n_batch, self.n_vocab)`
+            n_hyps (int): The smallest number of running hypotheses of an
+                utterance, which share the `beam_size` best candidates
+
+        Returns:
+            int: `self.pre_beam_size` if `self.pre_beam_threshold` is None,
+                otherwise the largest number of tokens within the threshold
+                over the hypotheses, so that the beam can still be filled.
+
+        """
+        if self.pre_beam_threshold is None:
+            return self.pre_beam_size
+        best = pre_beam_scores.max(dim=-1, keepdim=True)[0]
+        n_near = int(
+            (pre_beam_scores >= best - self.pre_beam_threshold).sum(dim=-1).max()
+        )
+        # enough candidates per hypothesis to select `beam_size` of them
+        min_size = -(-self.beam_size // max(n_hyps, 1))
+        return min(max(n_near, min_size), self.pre_beam_size)
+
+    def max_future_score(self, n_steps: int) -> float:
+        """Get an upper bound of the score gained by a hypothesis in `n_steps`.
+
+        Every scorer except LengthBonus adds log probabilities that are not
+        positive, so only a positive length bonus can increase the score.
+
+        """
+        bonus = sum(
+            self.weights[k] for k, v in self.scorers.items() if isinstance(v, LengthBonus)
+        )
+        return max(bonus, 0.0) * n_steps
+
+    @staticmethod
+    def best_running_score(running_hyps: List[Hypothesis]) -> float:
+        """Get the best score of the running hypotheses."""
+        return max(float(h.score) for h in running_hyps)
+
     @staticmethod
     def append_token(xs: torch.Tensor, x: int) -> torch.Tensor:
         """Append new token to prefix tokens.
@@ -306,7 +406,9 @@ class BeamSearch(torch.nn.Module):
                     if self.pre_beam_score_key == "full"
                     else scores[self.pre_beam_score_key]
                 )
-                part_ids = torch.topk(pre_beam_scores, self.pre_beam_size)[1]
+                part_ids = torch.topk(
+                    pre_beam_scores, self.get_pre_beam_size(pre_beam_scores)
+                )[1]
             part_scores, part_states = self.score_partial(hyp, part_ids, x)
             for k in self.part_scorers:
                 weighted_scores[part_ids] += self.weights[k] * part_scores[k]
@@ -331,10 +433,17 @@ class BeamSearch(torch.nn.Module):
             best_hyps = sorted(best_hyps, key=lambda x: x.score, reverse=True)[
                 : min(len(best_hyps), self.beam_size)
             ]
+        if self.score_beam is not None:
+            threshold = best_hyps[0].score - self.score_beam
+            best_hyps = [h for h in best_hyps if h.score >= threshold]
         return best_hyps
 
     def forward(
-        self, x: torch.Tensor, maxlenratio: float = 0.0, minlenratio: float = 0.0
+        self,
+        x: torch.Tensor,
+        maxlenratio: float = 0.0,
+        minlenratio: float = 0.0,
+        prefix: torch.Tensor = None,
     ) -> List[Hypothesis]:
         """Perform beam search.
 
@@ -346,6 +455,9 @@ class BeamSearch(torch.nn.Module):
                 If maxlenratio<0.0, its absolute value is interpreted
                 as a constant max output length.
             minlenratio (float): Input length ratio to obtain min output length.
+            prefix (torch.Tensor): torch.int64 tokens without <sos> that start
+                every hypothesis (e.g. the verified part of a CTC draft),
+                the search continues after them
 
         Returns:
             list[Hypothesis]: N-best decoding results
@@ -364,15 +476,26 @@ class BeamSearch(torch.nn.Module):
         logging.info("min output length: " + str(minlen))
 
         # main loop of prefix search
-        running_hyps = self.init_hyp(x)
+        if prefix is not None:
+            prefix = prefix[: maxlen - 1]
+        if prefix is not None and len(prefix) > 0:
+            running_hyps = self.init_prefix_hyp(x, prefix)
+            start = len(prefix)
+        else:
+            running_hyps = self.init_hyp(x)
+            start = 0
         ended_hyps = []
-        for i in range(maxlen):
+        end_detector = EndDetector()
+        for i in range(start, maxlen):
             logging.debug("position " + str(i))
             best = self.search(running_hyps, x)
             # post process of one iteration
+            n_ended = len(ended_hyps)
             running_hyps = self.post_process(i, maxlen, maxlenratio, best, ended_hyps)
+            for h in ended_hyps[n_ended:]:
+                end_detector.add(len(h.yseq), h.score)
             # end detection
-            if maxlenratio == 0.0 and end_detect([h.asdict() for h in ended_hyps], i):
+            if maxlenratio == 0.0 and end_detector(i):
                 logging.info(f"end detected at {i}")
                 break
             if len(running_hyps) == 0:
@@ -380,6 +503,14 @@ class BeamSearch(torch.nn.Module):
                 break
             else:
                 logging.debug(f"remained hypotheses: {len(running_hyps)}")
+            # the forced eos of the last step is not scored
+            if self.exact_stop and (
+                self.best_running_score(running_hyps)
+                + self.max_future_score(maxlen - 1 - i)
+                < end_detector.best_score
+            ):
+                logging.info(f"no running hypothesis can beat the best one at {i}")
+                break
 
         nbest_hyps = sorted(ended_hyps, key=lambda x: x.score, reverse=True)
         # check the number of hypotheses reaching to eos
@@ -391,7 +522,9 @@ class BeamSearch(torch.nn.Module):
             return (
                 []
                 if minlenratio < 0.1
-                else self.forward(x, maxlenratio, max(0.0, minlenratio - 0.1))
+                else self.forward(
+                    x, maxlenratio, max(0.0, minlenratio - 0.1), prefix
+                )
             )
 
         # report the best result
@@ -459,6 +592,9 @@ class BeamSearch(torch.nn.Module):
                 ended_hyps.append(hyp)
             else:
                 remained_hyps.append(hyp)
+        if self.max_active is not None:
+            # running hypotheses are sorted by score in `search`
+            remained_hyps = remained_hyps[: self.max_active]
         return remained_hyps
 
 
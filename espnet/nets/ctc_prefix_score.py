@@ -32,6 +32,10 @@ class CTCPrefixScoreTH(object):
         # In the comment lines,
         # we assume T: input_length, B: batch size, W: beam width, O: output dim.
         self.logzero = -10000000000.0
+        # the forward variables stay in fp32 when the network runs in reduced
+        # precision: logzero overflows float16 and bfloat16 sums lose the
+        # small score differences between hypotheses
+        x = x.float()
         self.blank = blank
         self.eos = eos
         self.batch = x.size(0)
@@ -53,7 +57,9 @@ class CTCPrefixScoreTH(object):
         xn = x.transpose(0, 1)  # (B, T, O) -> (T, B, O)
         xb = xn[:, :, self.blank].unsqueeze(2).expand(-1, -1, self.odim)
         self.x = torch.stack([xn, xb])  # (2, T, B, O)
-        self.end_frames = torch.as_tensor(xlens) - 1
+        self.end_frames = (
+            torch.as_tensor(xlens, dtype=torch.int64, device=self.device) - 1
+        )
 
         # Setup CTC windowing
         self.margin = margin
@@ -69,15 +75,20 @@ class CTCPrefixScoreTH(object):
     def __call__(self, y, state, scoring_ids=None, att_w=None):
         """Compute CTC prefix scores for next labels
 
-        :param list y: prefix label sequences
+        :param list y: prefix label sequences, or a (BW, L) tensor of them
         :param tuple state: previous CTC state
         :param torch.Tensor pre_scores: scores for pre-selection of hypotheses (BW, O)
         :param torch.Tensor att_w: attention weights to decide CTC window
         :return new_state, ctc_local_scores (BW, O)
         """
         output_length = len(y[0]) - 1  # ignore sos
-        last_ids = [yi[-1] for yi in y]  # last output label ids
-        n_bh = len(last_ids)  # batch * hyps
+        # last output label ids (BW,)
+        if isinstance(y, torch.Tensor):
+            last_ids = y[:, -1]
+        else:
+            last_ids = torch.stack([torch.as_tensor(yi[-1]) for yi in y])
+        last_ids = last_ids.to(self.device)
+        n_bh = last_ids.size(0)  # batch * hyps
         n_hyps = n_bh // self.batch  # assuming each utterance has the same # of hyps
         self.scoring_num = scoring_ids.size(-1) if scoring_ids is not None else 0
         # prepare state info
@@ -132,14 +143,18 @@ class CTCPrefixScoreTH(object):
 
         r_sum = torch.logsumexp(r_prev, 1)
         log_phi = r_sum.unsqueeze(2).repeat(1, 1, snum)
+        # phi of the last label only counts the paths ending with blank
         if scoring_ids is not None:
-            for idx in range(n_bh):
-                pos = scoring_idmap[idx, last_ids[idx]]
-                if pos >= 0:
-                    log_phi[:, idx, pos] = r_prev[:, 1, idx]
+            pos = scoring_idmap[self.idx_bh[:n_bh, 0], last_ids]
+            # hypotheses whose last label is not scored write back r_sum at 0
+            r_last = torch.where(pos >= 0, r_prev[:, 1], r_sum)
+            pos = pos.clamp(min=0)
         else:
-            for idx in range(n_bh):
-                log_phi[:, idx, last_ids[idx]] = r_prev[:, 1, idx]
+            r_last = r_prev[:, 1]
+            pos = last_ids
+        log_phi.scatter_(
+            2, pos.view(1, -1, 1).expand(log_phi.size(0), -1, 1), r_last.unsqueeze(2)
+        )
 
         # decide start and end frames based on attention weights
         if att_w is not None and self.margin > 0:
@@ -171,22 +186,66 @@ class CTCPrefixScoreTH(object):
                 torch.cat((log_phi_x[start:end], r[start - 1, 0].unsqueeze(0)), dim=0),
                 dim=0,
             )
-            for si in range(n_bh):
-                log_psi[si, scoring_ids[si]] = log_psi_[si]
+            log_psi.scatter_(1, scoring_ids, log_psi_)
         else:
             log_psi = torch.logsumexp(
                 torch.cat((log_phi_x[start:end], r[start - 1, 0].unsqueeze(0)), dim=0),
                 dim=0,
             )
 
-        for si in range(n_bh):
-            log_psi[si, self.eos] = r_sum[self.end_frames[si // n_hyps], si]
+        # eos score is the prefix probability at the last frame of each utterance
+        end_frames = self.end_frames.repeat_interleave(n_hyps).view(1, -1)
+        log_psi[:, self.eos] = r_sum.gather(0, end_frames).view(-1)
 
         # exclude blank probs
         log_psi[:, self.blank] = self.logzero
 
         return (log_psi - s_prev), (r, log_psi, f_min, f_max, scoring_idmap)
 
+    def prefix_state(self, y):
+        """Compute the CTC state of whole label prefixes at once
+
+        The forward probabilities are computed on the extended label sequences
+        of the prefixes (with blanks in between), so that a prefix of any length
+        takes one pass over the frames instead of one pass per label.
+
+        :param torch.Tensor y: prefix label ids without sos (B, L), L > 0
+        :return log_psi, state: log prefix probabilities (B,) and the CTC state
+            of the prefixes in the format returned by :meth:`index_select_state`
+        """
+        assert y.size(0) == self.batch, "one prefix per utterance is expected"
+        y = y.to(self.device)
+        n_b, n_s = y.size(0), 2 * y.size(1) + 1
+        ext = torch.full((n_b, n_s), self.blank, dtype=torch.long, device=self.device)
+        ext[:, 1::2] = y
+        # (T, B, S) log posteriors of the extended labels
+        x_ext = self.x[0].gather(2, ext.unsqueeze(0).expand(self.input_length, -1, -1))
+        # a label can be reached from the previous one unless they are repeated
+        no_skip = torch.ones((n_b, n_s), dtype=torch.bool, device=self.device)
+        no_skip[:, 3::2] = y[:, 1:] == y[:, :-1]
+        pad = torch.full((n_b, 2), self.logzero, dtype=self.dtype, device=self.device)
+
+        r = torch.full(
+            (self.input_length, 2, n_b), self.logzero, dtype=self.dtype, device=self.device
+        )
+        alpha = pad.new_full((n_b, n_s), self.logzero)
+        alpha[:, :2] = x_ext[0, :, :2]
+        r[0] = alpha[:, -2:].t()
+        # log probabilities of emitting the last label first at each frame
+        log_enter = [alpha[:, -2]]
+        for t in range(1, self.input_length):
+            prev1 = torch.cat((pad[:, :1], alpha[:, :-1]), dim=1)
+            prev2 = torch.cat((pad, alpha[:, :-2]), dim=1).masked_fill(no_skip, self.logzero)
+            log_enter.append(
+                torch.logaddexp(prev1[:, -2], prev2[:, -2]) + x_ext[t, :, -2]
+            )
+            alpha = torch.logsumexp(torch.stack([alpha, prev1, prev2]), 0) + x_ext[t]
+            r[t] = alpha[:, -2:].t()
+        log_psi = torch.logsumexp(torch.stack(log_enter), 0)
+
+        s = log_psi.view(-1, 1).expand(n_b, self.odim)
+        return log_psi, (r, s, 0, 1)
+
     def index_select_state(self, state, best_ids):
         """Select CTC states according to best ids
 
@@ -199,9 +258,12 @@ class CTCPrefixScoreTH(object):
         n_bh = len(s)
         n_hyps = n_bh // self.batch
         vidx = (best_ids + (self.idx_b * (n_hyps * self.odim)).view(-1, 1)).view(-1)
+        # the number of selected hypotheses may differ from n_bh,
+        # e.g. when the beam grows from the initial hypothesis
+        n_sel = vidx.size(0)
         # select hypothesis scores
         s_new = torch.index_select(s.view(-1), 0, vidx)
-        s_new = s_new.view(-1, 1).repeat(1, self.odim).view(n_bh, self.odim)
+        s_new = s_new.view(-1, 1).expand(n_sel, self.odim)
         # convert ids to BHS space (S: scoring_num)
         if scoring_idmap is not None:
             snum = self.scoring_num
@@ -216,7 +278,7 @@ class CTCPrefixScoreTH(object):
             snum = self.odim
         # select forward probabilities
         r_new = torch.index_select(r.view(-1, 2, n_bh * snum), 2, vidx).view(
-            -1, 2, n_bh
+            -1, 2, n_sel
         )
         return r_new, s_new, f_min, f_max
 
@@ -226,6 +288,7 @@ class CTCPrefixScoreTH(object):
         :param torch.Tensor x: input label posterior sequences (B, T, O)
         """
 
+        x = x.float()
         if self.x.shape[1] < x.shape[1]:  # self.x (2,T,B,O); x (B,T,O)
             # Pad the rest of posteriors in the batch
             # TODO(takaaki-hori): need a better way without for-loops
@@ -240,14 +303,23 @@ class CTCPrefixScoreTH(object):
             self.x = torch.stack([xn, xb])  # (2, T, B, O)
             self.x[:, : tmp_x.shape[1], :, :] = tmp_x
             self.input_length = x.size(1)
-            self.end_frames = torch.as_tensor(xlens) - 1
+            self.end_frames = (
+                torch.as_tensor(xlens, dtype=torch.int64, device=self.device) - 1
+            )
+            if self.margin > 0:
+                self.frame_ids = torch.arange(
+                    self.input_length, dtype=self.dtype, device=self.device
+                )
 
     def extend_state(self, state):
-        """Compute CTC prefix state.
+        """Extend the CTC state of the hypotheses to the frames of `extend_prob`.
 
+        The prefixes are complete before the new frames, which only extend
+        their paths ending with blank.
 
-        :param state    : CTC state
-        :return ctc_state
+        :param tuple state: batched CTC state `(r, s, f_min, f_max)`,
+            r is (T_prev, 2, BW)
+        :return: the CTC state with r of (T, 2, BW)
         """
 
         if state is None:
@@ -255,17 +327,20 @@ class CTCPrefixScoreTH(object):
             return state
         else:
             r_prev, s_prev, f_min_prev, f_max_prev = state
+            n_bh = r_prev.size(2)
+            n_hyps = n_bh // self.batch
 
             r_prev_new = torch.full(
-                (self.input_length, 2),
+                (self.input_length, 2, n_bh),
                 self.logzero,
                 dtype=self.dtype,
                 device=self.device,
             )
             start = max(r_prev.shape[0], 1)
             r_prev_new[0:start] = r_prev
-            for t in six.moves.range(start, self.input_length):
-                r_prev_new[t, 1] = r_prev_new[t - 1, 1] + self.x[0, t, :, self.blank]
+            # blank posteriors of each hypothesis (T, BW)
+            x_blank = self.x[0, start:, :, self.blank].repeat_interleave(n_hyps, dim=1)
+            r_prev_new[start:, 1] = r_prev_new[start - 1, 1] + torch.cumsum(x_blank, 0)
 
             return (r_prev_new, s_prev, f_min_prev, f_max_prev)
 
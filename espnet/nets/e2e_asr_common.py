@@ -48,6 +48,45 @@ def end_detect(ended_hyps, i, M=3, D_end=np.log(1 * np.exp(-10))):
         return False
 
 
+class EndDetector(object):
+    """Incremental version of :func:`end_detect`.
+
+    The best score of the ended hypotheses is kept for each length as they end,
+    so that a detection costs O(M) instead of sorting all the ended hypotheses.
+
+    :param int M: the number of consecutive lengths to check
+    :param float D_end: the score margin to the best ended hypothesis
+    """
+
+    def __init__(self, M=3, D_end=np.log(1 * np.exp(-10))):
+        """Construct an EndDetector object."""
+        self.M = M
+        self.D_end = D_end
+        self.best_scores = {}
+        self.best_score = float("-inf")
+
+    def add(self, length, score):
+        """Register an ended hypothesis.
+
+        :param int length: the length of the hypothesis including sos and eos
+        :param float score: the score of the hypothesis
+        """
+        score = float(score)
+        if score > self.best_scores.get(length, float("-inf")):
+            self.best_scores[length] = score
+        self.best_score = max(self.best_score, score)
+
+    def __call__(self, i):
+        """Return the same result as `end_detect(ended_hyps, i, M, D_end)`."""
+        if len(self.best_scores) == 0:
+            return False
+        for m in six.moves.range(self.M):
+            score = self.best_scores.get(i - m)
+            if score is None or score - self.best_score >= self.D_end:
+                return False
+        return True
+
+
 # TODO(takaaki-hori): add different smoothing methods
 def label_smoothing_dist(odim, lsm_type, transcript=None, blank=0):
     """Obtain label distribution for loss smoothing.
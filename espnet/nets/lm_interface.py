@@ -57,6 +57,20 @@ class LMInterface(ScorerInterface):
         """
         raise NotImplementedError("forward method is not implemented")
 
+    def score_sequences(self, ys, ylens):
+        """Compute log probabilities of whole sequences with teacher forcing.
+
+        Args:
+            ys (torch.Tensor): torch.int64 sequences starting with sos and ending
+                with eos, padded with 0 (batch, len)
+            ylens (torch.Tensor): Lengths of the sequences including sos and eos
+
+        Returns:
+            torch.Tensor: log p(ys[1:ylen] | sos) of each sequence (batch,)
+
+        """
+        raise NotImplementedError("score_sequences method is not implemented")
+
 
 predefined_lms = {
     "pytorch": {
@@ -38,10 +38,85 @@ class Conv3dResNet(torch.nn.Module):
         )
 
 
-    def forward(self, xs_pad):
+    def forward(self, xs_pad, temporal_padding=True):
+        """forward.
+
+        :param xs_pad: torch.Tensor, input frames (B, C, T, H, W)
+        :param temporal_padding: bool, whether to zero pad the time axis of the
+            stem convolution, else the first and last 2 frames are context only
+        """
         B, C, T, H, W = xs_pad.size()
-        xs_pad = self.frontend3D(xs_pad)
+        if temporal_padding:
+            xs_pad = self.frontend3D(xs_pad)
+        else:
+            conv = self.frontend3D[0]
+            xs_pad = nn.functional.conv3d(
+                xs_pad, conv.weight, conv.bias, conv.stride, (0,) + conv.padding[1:]
+            )
+            xs_pad = self.frontend3D[1:](xs_pad)
         Tnew = xs_pad.shape[2]
         xs_pad = threeD_to_2D_tensor(xs_pad)
         xs_pad = self.trunk(xs_pad)
         return xs_pad.view(B, Tnew, xs_pad.size(1))
+
+
+class Conv3dResNetStream:
+    """Incremental Conv3dResNet over the frames of a stream.
+
+    The (5, 7, 7) stem convolution of a frame sees the 2 previous and the 2 next
+    frames, the rest of the frontend is per frame. The last 4 frames are kept in
+    a ring buffer, and the features of a frame are computed as soon as its 2
+    lookahead frames arrived, or at the end of the stream, where the missing
+    frames are zero as in the temporal padding of `Conv3dResNet.forward`.
+    The features are thus identical to the offline ones.
+
+    :param frontend: Conv3dResNet, the frontend module
+    """
+
+    def __init__(self, frontend):
+        self.frontend = frontend
+        conv = frontend.frontend3D[0]
+        self.context = conv.kernel_size[0] - 1
+        self.lookahead = conv.padding[0]
+        self.reset()
+
+    def reset(self):
+        """Prepare a new stream."""
+        self.ring = None
+        self.head = 0  # ring position of the oldest buffered frame
+        self.n_buffered = 0
+
+    def forward_frames(self, xs, is_final=False):
+        """Feed the next frames and compute the features of the completed ones.
+
+        :param xs: torch.Tensor, next frames (B, C, T, H, W), T may be 0
+        :param is_final: bool, whether the stream ends after `xs`
+        :return: torch.Tensor, features (B, T_out, 512) of the frames whose
+            lookahead is complete, all the remaining ones if `is_final`
+        """
+        if self.ring is None:
+            B, C, _, H, W = xs.shape
+            self.ring = xs.new_zeros(B, C, self.context, H, W)
+            # the zero padding before the first frame
+            self.n_buffered = self.context - self.lookahead
+        order = (self.head + torch.arange(self.n_buffered, device=xs.device)) % self.context
+        window = torch.cat([self.ring.index_select(2, order), xs], dim=2)
+        if is_final:
+            pad = xs.new_zeros(xs.shape[:2] + (self.lookahead,) + xs.shape[3:])
+            window = torch.cat([window, pad], dim=2)
+            self.reset()
+        else:
+            self._push(xs)
+        if window.size(2) <= self.context:
+            return xs.new_zeros(xs.size(0), 0, self.frontend.trunk.inplanes)
+        return self.frontend(window, temporal_padding=False)
+
+    def _push(self, xs):
+        """Write the last frames of `xs` over the oldest ones of the ring buffer."""
+        n_new = xs.size(2)
+        end = self.head + self.n_buffered + n_new
+        xs = xs[:, :, max(n_new - self.context, 0) :]
+        pos = (end - xs.size(2) + torch.arange(xs.size(2), device=xs.device)) % self.context
+        self.ring.index_copy_(2, pos, xs)
+        self.n_buffered = min(self.n_buffered + n_new, self.context)
+        self.head = (end - self.n_buffered) % self.context
@@ -163,7 +163,8 @@ class CTC(torch.nn.Module):
         :return: log softmax applied 3d tensor (B, Tmax, odim)
         :rtype: torch.Tensor
         """
-        return F.log_softmax(self.ctc_lo(hs_pad), dim=2)
+        # normalized in fp32 for the prefix scoring, also under bf16 autocast
+        return F.log_softmax(self.ctc_lo(hs_pad).float(), dim=2)
 
     def argmax(self, hs_pad):
         """argmax of frame activations
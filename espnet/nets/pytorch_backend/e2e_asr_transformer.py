@@ -318,3 +318,13 @@ class E2E(torch.nn.Module):
         else:
             enc_output, _ = self.encoder(x, None)
             return enc_output.squeeze(0)
+
+    def encode_batch(self, xs):
+        """Encode a batch of features of different lengths in one forward pass.
+
+        :param list xs: source features of each utterance, as for :meth:`encode`
+        :return: encoder outputs of each utterance, equal to :meth:`encode`
+        :rtype: List[torch.Tensor]
+        """
+        self.eval()
+        return self.encoder.forward_list([torch.as_tensor(x) for x in xs])
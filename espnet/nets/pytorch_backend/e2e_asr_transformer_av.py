@@ -350,3 +350,19 @@ class E2E(torch.nn.Module):
             aux_feat, _ = self.aux_encoder(aux_x, None)
             fus_output = self.fusion(torch.cat((feat, aux_feat), dim=-1))
             return fus_output.squeeze(0)
+
+    def encode_batch(self, xs, aux_xs):
+        """Encode a batch of features of different lengths in one forward pass.
+
+        :param list xs: source features of each utterance, as for :meth:`encode`
+        :param list aux_xs: auxiliary source features of each utterance
+        :return: encoder outputs of each utterance, equal to :meth:`encode`
+        :rtype: List[torch.Tensor]
+        """
+        self.eval()
+        feats = self.encoder.forward_list([torch.as_tensor(x) for x in xs])
+        aux_feats = self.aux_encoder.forward_list([torch.as_tensor(x) for x in aux_xs])
+        # the fusion is per frame, it runs once on the frames of all the utterances
+        fus_input = torch.cat([torch.cat(pair, dim=-1) for pair in zip(feats, aux_feats)])
+        fus_output = self.fusion(fus_input.unsqueeze(0)).squeeze(0)
+        return list(fus_output.split([len(feat) for feat in feats]))
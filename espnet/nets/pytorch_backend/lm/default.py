@@ -1,7 +1,6 @@
 """Default Recurrent Neural Network Languge Model in `lm_train.py`."""
 
 from typing import Any
-from typing import List
 from typing import Tuple
 
 import logging
@@ -11,11 +10,13 @@ import torch.nn.functional as F
 
 from espnet.nets.lm_interface import LMInterface
 from espnet.nets.pytorch_backend.e2e_asr import to_device
-from espnet.nets.scorer_interface import BatchScorerInterface
+from espnet.nets.pytorch_backend.nets_utils import make_output_shortlist
+from espnet.nets.pytorch_backend.nets_utils import shortlist_linear
+from espnet.nets.scorer_interface import BatchStateScorerInterface
 from espnet.utils.cli_utils import strtobool
 
 
-class DefaultRNNLM(BatchScorerInterface, LMInterface, nn.Module):
+class DefaultRNNLM(BatchStateScorerInterface, LMInterface, nn.Module):
     """Default RNNLM for `LMInterface` Implementation.
 
     Note:
@@ -96,6 +97,8 @@ class DefaultRNNLM(BatchScorerInterface, LMInterface, nn.Module):
                 tie_weights,
             )
         )
+        # shortlisted output units of the beam search (see batch_set_shortlist)
+        self.shortlist = None
 
     def state_dict(self):
         """Dump state dict."""
@@ -137,6 +140,29 @@ class DefaultRNNLM(BatchScorerInterface, LMInterface, nn.Module):
             count += int(non_zeros)
         return loss / batch_size, loss, count.to(loss.device)
 
+    def score_sequences(self, ys, ylens):
+        """Compute log probabilities of whole sequences with teacher forcing.
+
+        All the sequences are fed to the RNN at once, one time step at a time.
+
+        Args:
+            ys (torch.Tensor): torch.int64 sequences starting with sos and ending
+                with eos, padded with 0 (batch, len)
+            ylens (torch.Tensor): Lengths of the sequences including sos and eos
+
+        Returns:
+            torch.Tensor: log p(ys[1:ylen] | sos) of each sequence (batch,)
+
+        """
+        ylens = ylens.to(ys.device)
+        state = None
+        logp = ys.new_zeros(ys.size(0), dtype=torch.float)
+        for i in range(ys.size(1) - 1):
+            state, logp_i = self.model.predict(state, ys[:, i])
+            logp_i = logp_i.gather(1, ys[:, i + 1].unsqueeze(1)).squeeze(1)
+            logp = logp + logp_i.float() * (i < ylens - 1)
+        return logp
+
     def score(self, y, state, x):
         """Score new token.
 
@@ -166,53 +192,46 @@ class DefaultRNNLM(BatchScorerInterface, LMInterface, nn.Module):
         """
         return self.model.final(state)
 
-    # batch beam search API (see BatchScorerInterface)
+    # batch beam search API (see BatchStateScorerInterface)
     def batch_score(
-        self, ys: torch.Tensor, states: List[Any], xs: torch.Tensor
-    ) -> Tuple[torch.Tensor, List[Any]]:
+        self,
+        ys: torch.Tensor,
+        states: Any,
+        xs: torch.Tensor,
+        xs_mask: torch.Tensor = None,
+    ) -> Tuple[torch.Tensor, Any]:
         """Score new token batch.
 
         Args:
             ys (torch.Tensor): torch.int64 prefix tokens (n_batch, ylen).
-            states (List[Any]): Scorer states for prefix tokens.
+            states: Batched RNN state `{"c": [layer], "h": [layer]}` of
+                `(n_batch, n_units)` tensors, None at the first step.
             xs (torch.Tensor):
                 The encoder feature that generates ys (n_batch, xlen, n_feat).
+            xs_mask (torch.Tensor): Mask of the valid frames in xs, unused.
 
         Returns:
-            tuple[torch.Tensor, List[Any]]: Tuple of
+            tuple[torch.Tensor, Any]: Tuple of
                 batchfied scores for next token with shape of `(n_batch, n_vocab)`
-                and next state list for ys.
+                and batched RNN state for ys.
 
         """
-        # merge states
-        n_batch = len(ys)
-        n_layers = self.model.predictor.n_layers
-        if self.model.predictor.typ == "lstm":
-            keys = ("c", "h")
-        else:
-            keys = ("h",)
+        states, logp = self.model.predict(states, ys[:, -1], self.shortlist)
+        return logp, states
 
-        if states[0] is None:
-            states = None
-        else:
-            # transpose state of [batch, key, layer] into [key, layer, batch]
-            states = {
-                k: [
-                    torch.stack([states[b][k][i] for b in range(n_batch)])
-                    for i in range(n_layers)
-                ]
-                for k in keys
-            }
-        states, logp = self.model.predict(states, ys[:, -1])
-
-        # transpose state of [key, layer, batch] into [batch, key, layer]
-        return (
-            logp,
-            [
-                {k: [states[k][i][b] for i in range(n_layers)] for k in keys}
-                for b in range(n_batch)
-            ],
-        )
+    def batch_set_shortlist(
+        self, ids: torch.Tensor = None, mask: torch.Tensor = None
+    ) -> None:
+        """Restrict the output layer of the beam search to a shortlist.
+
+        Args:
+            ids (torch.Tensor): Sorted torch.int64 ids of the shortlisted tokens,
+                None to score all the tokens again
+            mask (torch.Tensor): Tokens of `ids` in the shortlist of each
+                utterance (n_utt, len(ids)), None if all the utterances share `ids`
+
+        """
+        self.shortlist = make_output_shortlist(self.model.predictor.lo, ids, mask)
 
 
 class ClassifierWithState(nn.Module):
@@ -279,18 +298,21 @@ class ClassifierWithState(nn.Module):
         self.loss = self.lossfun(self.y, t)
         return state, self.loss
 
-    def predict(self, state, x):
+    def predict(self, state, x, shortlist=None):
         """Predict log probabilities for given state and input x using the predictor.
 
         :param torch.Tensor state : The current state
         :param torch.Tensor x : The input
+        :param tuple shortlist : The shortlisted output units of the predictor
+            (see :func:`make_output_shortlist`), None for all the units
         :return a tuple (new state, log prob vector)
         :rtype (torch.Tensor, torch.Tensor)
         """
+        args = (state, x) if shortlist is None else (state, x, shortlist)
         if hasattr(self.predictor, "normalized") and self.predictor.normalized:
-            return self.predictor(state, x)
+            return self.predictor(*args)
         else:
-            state, z = self.predictor(state, x)
+            state, z = self.predictor(*args)
             return state, F.log_softmax(z, dim=1)
 
     def buff_predict(self, state, x, n):
@@ -395,8 +417,12 @@ class RNNLM(nn.Module):
         p = next(self.parameters())
         return torch.zeros(batchsize, self.n_units).to(device=p.device, dtype=p.dtype)
 
-    def forward(self, state, x):
-        """Forward neural networks."""
+    def forward(self, state, x, shortlist=None):
+        """Forward neural networks.
+
+        :param tuple shortlist : The shortlisted output units
+            (see :func:`make_output_shortlist`), the other outputs are `-inf`
+        """
         if state is None:
             h = [to_device(x, self.zero_state(x.size(0))) for n in range(self.n_layers)]
             state = {"h": h}
@@ -427,5 +453,5 @@ class RNNLM(nn.Module):
             for n in range(1, self.n_layers):
                 h[n] = self.rnn[n](self.dropout[n](h[n - 1]), state["h"][n])
             state = {"h": h}
-        y = self.lo(self.dropout[-1](h[-1]))
+        y = shortlist_linear(self.dropout[-1](h[-1]), self.lo, shortlist)
         return state, y
@@ -1,7 +1,6 @@
 """Transformer language model."""
 
 from typing import Any
-from typing import List
 from typing import Tuple
 
 import logging
@@ -10,14 +9,17 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from espnet.nets.lm_interface import LMInterface
+from espnet.nets.pytorch_backend.nets_utils import make_output_shortlist
+from espnet.nets.pytorch_backend.nets_utils import shortlist_linear
 from espnet.nets.pytorch_backend.transformer.embedding import PositionalEncoding
 from espnet.nets.pytorch_backend.transformer.encoder import Encoder
+from espnet.nets.pytorch_backend.transformer.kv_cache import KVCache
 from espnet.nets.pytorch_backend.transformer.mask import subsequent_mask
-from espnet.nets.scorer_interface import BatchScorerInterface
+from espnet.nets.scorer_interface import BatchStateScorerInterface
 from espnet.utils.cli_utils import strtobool
 
 
-class TransformerLM(nn.Module, LMInterface, BatchScorerInterface):
+class TransformerLM(nn.Module, LMInterface, BatchStateScorerInterface):
     """Transformer language model."""
 
     @staticmethod
@@ -122,6 +124,8 @@ class TransformerLM(nn.Module, LMInterface, BatchScorerInterface):
             pos_enc_class=pos_enc_class,
         )
         self.decoder = nn.Linear(args.att_unit, n_vocab)
+        # shortlisted output units of the beam search (see batch_set_shortlist)
+        self.shortlist = None
 
         logging.info("Tie weights set to {}".format(tie_weights))
         logging.info("Dropout set to {}".format(args.dropout_rate))
@@ -175,6 +179,31 @@ class TransformerLM(nn.Module, LMInterface, BatchScorerInterface):
         count = mask.sum()
         return logp / count, logp, count
 
+    def score_sequences(self, ys: torch.Tensor, ylens: torch.Tensor) -> torch.Tensor:
+        """Compute log probabilities of whole sequences with teacher forcing.
+
+        Args:
+            ys (torch.Tensor): torch.int64 sequences starting with sos and ending
+                with eos, padded with 0 (batch, len)
+            ylens (torch.Tensor): Lengths of the sequences including sos and eos
+
+        Returns:
+            torch.Tensor: log p(ys[1:ylen] | sos) of each sequence (batch,)
+
+        """
+        x, t = ys[:, :-1], ys[:, 1:]
+        if self.embed_drop is not None:
+            emb = self.embed_drop(self.embed(x))
+        else:
+            emb = self.embed(x)
+        h, _ = self.encoder(emb, self._target_mask(x))
+        logp = self.decoder(h).log_softmax(dim=-1)
+        logp = logp.gather(2, t.unsqueeze(2)).squeeze(2)
+        mask = torch.arange(t.size(1), device=t.device) < (
+            ylens.to(t.device).unsqueeze(1) - 1
+        )
+        return (logp * mask).sum(dim=1)
+
     def score(
         self, y: torch.Tensor, state: Any, x: torch.Tensor
     ) -> Tuple[torch.Tensor, Any]:
@@ -205,48 +234,81 @@ class TransformerLM(nn.Module, LMInterface, BatchScorerInterface):
         logp = h.log_softmax(dim=-1).squeeze(0)
         return logp, cache
 
-    # batch beam search API (see BatchScorerInterface)
+    # batch beam search API (see BatchStateScorerInterface)
     def batch_score(
-        self, ys: torch.Tensor, states: List[Any], xs: torch.Tensor
-    ) -> Tuple[torch.Tensor, List[Any]]:
+        self,
+        ys: torch.Tensor,
+        states: KVCache,
+        xs: torch.Tensor,
+        xs_mask: torch.Tensor = None,
+    ) -> Tuple[torch.Tensor, KVCache]:
         """Score new token batch (required).
 
+        Only the last token of ys is fed to the encoder, the keys and values
+        of the previous tokens are read from the cache.
+
         Args:
             ys (torch.Tensor): torch.int64 prefix tokens (n_batch, ylen).
-            states (List[Any]): Scorer states for prefix tokens.
+            states (KVCache): The key/value cache of the prefix tokens,
+                None at the first step.
             xs (torch.Tensor):
                 The encoder feature that generates ys (n_batch, xlen, n_feat).
+            xs_mask (torch.Tensor): Mask of the valid frames in xs, unused.
 
         Returns:
-            tuple[torch.Tensor, List[Any]]: Tuple of
+            tuple[torch.Tensor, KVCache]: Tuple of
                 batchfied scores for next token with shape of `(n_batch, n_vocab)`
-                and next state list for ys.
+                and the key/value cache of ys.
 
         """
-        # merge states
-        n_batch = len(ys)
-        n_layers = len(self.encoder.encoders)
-        if states[0] is None:
-            batch_state = None
+        y = ys[:, -1:]
+        if self.embed_drop is not None:
+            emb = self.embed_drop(self.embed(y))
         else:
-            # transpose state of [batch, layer] into [layer, batch]
-            batch_state = [
-                torch.stack([states[b][i] for b in range(n_batch)])
-                for i in range(n_layers)
-            ]
+            emb = self.embed(y)
+
+        h, cache = self.encoder.forward_incremental(emb, states)
+        h = shortlist_linear(h[:, -1], self.decoder, self.shortlist)
+        logp = h.log_softmax(dim=-1)
+        return logp, cache
+
+    def batch_set_shortlist(
+        self, ids: torch.Tensor = None, mask: torch.Tensor = None
+    ) -> None:
+        """Restrict the output layer of the beam search to a shortlist.
+
+        Args:
+            ids (torch.Tensor): Sorted torch.int64 ids of the shortlisted tokens,
+                None to score all the tokens again
+            mask (torch.Tensor): Tokens of `ids` in the shortlist of each
+                utterance (n_utt, len(ids)), None if all the utterances share `ids`
+
+        """
+        self.shortlist = make_output_shortlist(self.decoder, ids, mask)
+
+    def batch_score_prefix(
+        self, ys: torch.Tensor, xs: torch.Tensor, xs_mask: torch.Tensor = None
+    ) -> Tuple[torch.Tensor, KVCache]:
+        """Score every position of whole prefixes with one causal forward.
 
+        Args:
+            ys (torch.Tensor): torch.int64 prefix tokens starting with <sos>
+                (n_batch, ylen).
+            xs (torch.Tensor):
+                The encoder feature that generates ys (n_batch, xlen, n_feat).
+            xs_mask (torch.Tensor): Mask of the valid frames in xs, unused.
+
+        Returns:
+            tuple[torch.Tensor, KVCache]: Tuple of
+                scores for the token following each prefix position
+                with shape of `(n_batch, ylen, n_vocab)` and the key/value cache of ys.
+
+        """
         if self.embed_drop is not None:
             emb = self.embed_drop(self.embed(ys))
         else:
             emb = self.embed(ys)
 
-        # batch decoding
-        h, _, states = self.encoder.forward_one_step(
-            emb, self._target_mask(ys), cache=batch_state
-        )
-        h = self.decoder(h[:, -1])
-        logp = h.log_softmax(dim=-1)
-
-        # transpose state of [layer, batch] into [batch, layer]
-        state_list = [[states[i][b] for i in range(n_layers)] for b in range(n_batch)]
-        return logp, state_list
+        h, cache = self.encoder.forward_incremental(emb)
+        logp = shortlist_linear(h, self.decoder, self.shortlist).log_softmax(dim=-1)
+        return logp, cache
@@ -300,6 +300,62 @@ def mask_by_length(xs, lengths, fill=0):
     return ret
 
 
+def make_output_shortlist(linear, ids, mask=None):
+    """Gather the parameters of the shortlisted units of an output layer.
+
+    Args:
+        linear (torch.nn.Linear): Output layer.
+        ids (LongTensor): Ids of the shortlisted output units (K,), or None.
+        mask (BoolTensor): Units of `ids` kept for each group of rows (G, K),
+            e.g. the shortlist of each utterance, or None to keep all of them.
+
+    Returns:
+        Tuple: The ids, the weight (K, idim) and bias (K,) of their units and
+            the mask, to be passed to :func:`shortlist_linear`,
+            or None if ids is None.
+
+    """
+    if ids is None:
+        return None
+    weight, bias = linear.weight, linear.bias
+    if callable(weight):
+        # dynamically quantized layer, the shortlisted rows are dequantized
+        weight, bias = weight().dequantize(), bias()
+    bias = None if bias is None else bias[ids]
+    return ids, weight[ids], bias, mask
+
+
+def shortlist_linear(xs, linear, shortlist=None):
+    """Apply an output layer to its shortlisted units only.
+
+    The other units are set to `-inf`, so that a softmax over the output
+    is normalized over the shortlist. With a shortlist mask, the batch is made
+    of as many contiguous groups of rows as the mask has rows, and each group
+    only keeps the units of its own row.
+
+    Args:
+        xs (Tensor): Batch of input features (B, `*`, idim).
+        linear (torch.nn.Linear): Output layer.
+        shortlist (Tuple): Shortlisted units from :func:`make_output_shortlist`,
+            None computes all the units.
+
+    Returns:
+        Tensor: Batch of outputs (B, `*`, odim).
+
+    """
+    if shortlist is None:
+        return linear(xs)
+    ids, weight, bias, mask = shortlist
+    ys = torch.nn.functional.linear(xs, weight, bias)
+    if mask is not None:
+        mask = mask.repeat_interleave(ys.size(0) // mask.size(0), dim=0)
+        mask = mask.view(mask.shape[:1] + (1,) * (ys.dim() - 2) + mask.shape[1:])
+        ys = ys.masked_fill(~mask, float("-inf"))
+    out = ys.new_full(ys.shape[:-1] + (linear.out_features,), float("-inf"))
+    out[..., ids] = ys
+    return out
+
+
 def th_accuracy(pad_outputs, pad_targets, ignore_label):
     """Calculate accuracy.
 
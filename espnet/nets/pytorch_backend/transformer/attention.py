@@ -8,7 +8,6 @@
 
 import math
 
-import numpy
 import torch
 from torch import nn
 
@@ -33,6 +32,11 @@ class MultiHeadedAttention(nn.Module):
         self.linear_v = nn.Linear(n_feat, n_feat)
         self.linear_out = nn.Linear(n_feat, n_feat)
         self.attn = None
+        # the attention weights are only kept in `attn` on request
+        self.store_attn = False
+        # longer queries are attended by chunks, None to always attend at once
+        # (see Encoder.set_query_chunk_size)
+        self.query_chunk_size = None
         self.dropout = nn.Dropout(p=dropout_rate)
 
     def forward_qkv(self, query, key, value):
@@ -68,25 +72,72 @@ class MultiHeadedAttention(nn.Module):
                 weighted by the attention score (#batch, time1, time2).
         """
         n_batch = value.size(0)
+        x, attn = self.attention_context(value, scores, mask)
+        if self.store_attn:
+            self.attn = attn
+        x = (
+            x.transpose(1, 2).contiguous().view(n_batch, -1, self.h * self.d_k)
+        )  # (batch, time1, d_model)
+        if rtn_attn:
+            return self.linear_out(x), attn
+        return self.linear_out(x)  # (batch, time1, d_model)
+
+    def attention_context(self, value, scores, mask):
+        """Compute attention weights and the weighted values of each head.
+        Args:
+            value (torch.Tensor): Transformed value (#batch, n_head, time2, d_k).
+            scores (torch.Tensor): Attention score (#batch, n_head, time1, time2).
+            mask (torch.Tensor): Mask (#batch, 1, time2) or (#batch, time1, time2).
+        Returns:
+            torch.Tensor: Weighted value (#batch, n_head, time1, d_k).
+            torch.Tensor: Attention weights (#batch, n_head, time1, time2).
+        """
         if mask is not None:
             mask = mask.unsqueeze(1).eq(0)  # (batch, 1, *, time2)
-            min_value = float(
-                numpy.finfo(torch.tensor(0, dtype=scores.dtype).numpy().dtype).min
-            )
+            # torch.finfo also covers bfloat16, which numpy has no dtype for
+            min_value = torch.finfo(scores.dtype).min
             scores = scores.masked_fill(mask, min_value)
-            self.attn = torch.softmax(scores, dim=-1).masked_fill(
+            attn = torch.softmax(scores, dim=-1).masked_fill(
                 mask, 0.0
             )  # (batch, head, time1, time2)
         else:
-            self.attn = torch.softmax(scores, dim=-1)  # (batch, head, time1, time2)
-
-        p_attn = self.dropout(self.attn)
-        x = torch.matmul(p_attn, value)  # (batch, head, time1, d_k)
-        x = (
-            x.transpose(1, 2).contiguous().view(n_batch, -1, self.h * self.d_k)
-        )  # (batch, time1, d_model)
-        if rtn_attn:
-            return self.linear_out(x), self.attn
+            attn = torch.softmax(scores, dim=-1)  # (batch, head, time1, time2)
+
+        p_attn = self.dropout(attn)
+        return torch.matmul(p_attn, value), attn  # (batch, head, time1, d_k)
+
+    def chunk_queries(self, time1):
+        """Whether to attend `time1` queries by chunks, see :meth:`forward_chunked`."""
+        return (
+            not self.store_attn
+            and self.query_chunk_size is not None
+            and time1 > self.query_chunk_size
+        )
+
+    def forward_chunked(self, value, mask, score_fn, time1):
+        """Compute attention context by chunks of `query_chunk_size` queries.
+        Only the scores and weights of one chunk of queries are materialized,
+        so that the memory grows as time2 * query_chunk_size instead of
+        time2 * time1 for long inputs.
+        Args:
+            value (torch.Tensor): Transformed value (#batch, n_head, time2, d_k).
+            mask (torch.Tensor): Mask (#batch, 1, time2) or (#batch, time1, time2).
+            score_fn (Callable[[int, int], torch.Tensor]): Returns the attention
+                scores (#batch, n_head, end - start, time2) of queries start:end.
+            time1 (int): The number of queries.
+        Returns:
+            torch.Tensor: Transformed value (#batch, time1, d_model).
+        """
+        n_batch = value.size(0)
+        contexts = []
+        for start in range(0, time1, self.query_chunk_size):
+            end = min(start + self.query_chunk_size, time1)
+            chunk_mask = mask
+            if mask is not None and mask.size(1) > 1:
+                chunk_mask = mask[:, start:end]
+            contexts.append(self.attention_context(value, score_fn(start, end), chunk_mask)[0])
+        x = torch.cat(contexts, dim=2)  # (batch, head, time1, d_k)
+        x = x.transpose(1, 2).contiguous().view(n_batch, -1, self.h * self.d_k)
         return self.linear_out(x)  # (batch, time1, d_model)
 
     def forward(self, query, key, value, mask, rtn_attn=False):
@@ -102,8 +153,89 @@ class MultiHeadedAttention(nn.Module):
             torch.Tensor: Output tensor (#batch, time1, d_model).
         """
         q, k, v = self.forward_qkv(query, key, value)
+
+        def scores(start, end):
+            return torch.matmul(q[:, :, start:end], k.transpose(-2, -1)) / math.sqrt(self.d_k)
+
+        time1 = q.size(2)
+        if not rtn_attn and self.chunk_queries(time1):
+            return self.forward_chunked(v, mask, scores, time1)
+        return self.forward_attention(v, scores(0, time1), mask, rtn_attn)
+
+    def forward_cached(self, query, cache, layer, mask=None):
+        """Compute self-attention of new frames with a key/value cache.
+        Args:
+            query (torch.Tensor): New frames (#batch, time1, size).
+                Only these frames are projected, the keys and values
+                of the previous frames are read from the cache.
+            cache (KVCache): Projected keys/values of the previous frames.
+            layer (int): Layer index in the cache.
+            mask (torch.Tensor): Mask tensor (#batch, time1, time2) or None
+                to attend to all the cached frames.
+        Returns:
+            torch.Tensor: Output tensor (#batch, time1, d_model).
+        """
+        q, k, v = self.forward_qkv(query, query, query)
+        k, v = cache.update(layer, k, v)
         scores = torch.matmul(q, k.transpose(-2, -1)) / math.sqrt(self.d_k)
-        return self.forward_attention(v, scores, mask, rtn_attn)
+        return self.forward_attention(v, scores, mask)
+
+    def forward_static(self, query, k_cache, v_cache, pos, mask):
+        """Compute self-attention of a new frame over fixed-size cache buffers.
+        Unlike :meth:`forward_cached`, the whole buffers are attended with a mask
+        and the frame is written at a tensor position, so that the shapes only
+        change with the cache capacity (e.g. for `torch.compile`).
+        Args:
+            query (torch.Tensor): New frame (#batch, 1, size).
+            k_cache (torch.Tensor): Key buffer (#batch, n_head, capacity, d_k),
+                updated in place.
+            v_cache (torch.Tensor): Value buffer (#batch, n_head, capacity, d_k),
+                updated in place.
+            pos (torch.Tensor): Position of the new frame in the buffers (1,).
+            mask (torch.Tensor): Mask of the filled positions (1, 1, capacity).
+        Returns:
+            torch.Tensor: Output tensor (#batch, 1, d_model).
+        """
+        q, k, v = self.forward_qkv(query, query, query)
+        k_cache.index_copy_(2, pos, k)
+        v_cache.index_copy_(2, pos, v)
+        scores = torch.matmul(q, k_cache.transpose(-2, -1)) / math.sqrt(self.d_k)
+        return self.forward_attention(v_cache, scores, mask)
+
+    def project_memory(self, memory):
+        """Project keys and values of a memory attended by many queries.
+        Args:
+            memory (torch.Tensor): Memory tensor (#batch, time2, size).
+        Returns:
+            torch.Tensor: Transformed key tensor (#batch, n_head, time2, d_k).
+            torch.Tensor: Transformed value tensor (#batch, n_head, time2, d_k).
+        """
+        n_batch = memory.size(0)
+        k = self.linear_k(memory).view(n_batch, -1, self.h, self.d_k)
+        v = self.linear_v(memory).view(n_batch, -1, self.h, self.d_k)
+        return k.transpose(1, 2), v.transpose(1, 2)
+
+    def forward_projected(self, query, k, v, mask):
+        """Compute attention over keys and values from :meth:`project_memory`.
+        The queries are grouped by memory: the first `#batch // #mem` queries
+        attend to the first memory and so on, so that one projected memory is
+        broadcast to all the hypotheses of a beam without being copied.
+        Args:
+            query (torch.Tensor): Query tensor (#batch, time1, size).
+            k (torch.Tensor): Projected key tensor (#mem, n_head, time2, d_k).
+            v (torch.Tensor): Projected value tensor (#mem, n_head, time2, d_k).
+            mask (torch.Tensor): Mask tensor (#mem, 1, time2) or None.
+        Returns:
+            torch.Tensor: Output tensor (#batch, time1, d_model).
+        """
+        n_batch, time1 = query.size(0), query.size(1)
+        n_mem = k.size(0)
+        q = self.linear_q(query).view(n_mem, -1, time1, self.h, self.d_k)
+        # (mem, group, time1, head, d_k) -> (mem, head, group * time1, d_k)
+        q = q.permute(0, 3, 1, 2, 4).reshape(n_mem, self.h, -1, self.d_k)
+        scores = torch.matmul(q, k.transpose(-2, -1)) / math.sqrt(self.d_k)
+        x = self.forward_attention(v, scores, mask)  # (mem, group * time1, d_model)
+        return x.reshape(n_batch, time1, -1)
 
 
 class LegacyRelPositionMultiHeadedAttention(MultiHeadedAttention):
@@ -218,17 +350,18 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
     def rel_shift(self, x):
         """Compute relative positional encoding.
         Args:
-            x (torch.Tensor): Input tensor (batch, head, time1, 2*time1-1).
-            time1 means the length of query vector.
+            x (torch.Tensor): Input tensor (batch, head, time1, time2+time1-1).
+            time1 means the length of query vector and time2 the one of key
+            vector, the queries being the last time1 keys.
         Returns:
-            torch.Tensor: Output tensor.
+            torch.Tensor: Output tensor (batch, head, time1, time2).
         """
         zero_pad = torch.zeros((*x.size()[:3], 1), device=x.device, dtype=x.dtype)
         x_padded = torch.cat([zero_pad, x], dim=-1)
 
         x_padded = x_padded.view(*x.size()[:2], x.size(3) + 1, x.size(2))
         x = x_padded[:, :, 1:].view_as(x)[
-            :, :, :, : x.size(-1) // 2 + 1
+            :, :, :, : x.size(-1) - x.size(-2) + 1
         ]  # only keep the positions from 0 to time2
 
         if self.zero_triu:
@@ -251,30 +384,73 @@ class RelPositionMultiHeadedAttention(MultiHeadedAttention):
             torch.Tensor: Output tensor (#batch, time1, d_model).
         """
         q, k, v = self.forward_qkv(query, key, value)
+        return self.forward_rel(q, k, v, pos_emb, mask)
+
+    def forward_chunk(self, query, pos_emb, cache=None):
+        """Compute self-attention of the next chunk of a stream with cached keys/values.
+        Args:
+            query (torch.Tensor): Frames of the chunk (#batch, time1, size).
+                Only these frames are projected, the keys and values
+                of the previous frames are read from the cache.
+            pos_emb (torch.Tensor): Positional embedding tensor
+                (#batch, time2+time1-1, size).
+            cache (Tuple[torch.Tensor, torch.Tensor]): Projected keys and values
+                of the previous frames attended by the chunk
+                (#batch, n_head, time2-time1, d_k) or None.
+        Returns:
+            torch.Tensor: Output tensor (#batch, time1, d_model).
+            Tuple[torch.Tensor, torch.Tensor]: Projected keys and values
+                of the previous and new frames (#batch, n_head, time2, d_k).
+        """
+        q, k, v = self.forward_qkv(query, query, query)
+        if cache is not None:
+            k = torch.cat([cache[0], k], dim=2)
+            v = torch.cat([cache[1], v], dim=2)
+        return self.forward_rel(q, k, v, pos_emb, None), (k, v)
+
+    def forward_rel(self, q, k, v, pos_emb, mask):
+        """Compute attention of projected queries, keys and values with rel. positions.
+        Args:
+            q (torch.Tensor): Transformed query tensor (#batch, n_head, time1, d_k).
+            k (torch.Tensor): Transformed key tensor (#batch, n_head, time2, d_k).
+            v (torch.Tensor): Transformed value tensor (#batch, n_head, time2, d_k).
+            pos_emb (torch.Tensor): Positional embedding tensor
+                (#batch, time2+time1-1, size).
+            mask (torch.Tensor): Mask tensor (#batch, 1, time2) or
+                (#batch, time1, time2) or None.
+        Returns:
+            torch.Tensor: Output tensor (#batch, time1, d_model).
+        """
         q = q.transpose(1, 2)  # (batch, time1, head, d_k)
 
         n_batch_pos = pos_emb.size(0)
         p = self.linear_pos(pos_emb).view(n_batch_pos, -1, self.h, self.d_k)
-        p = p.transpose(1, 2)  # (batch, head, 2*time1-1, d_k)
+        p = p.transpose(1, 2)  # (batch, head, time2+time1-1, d_k)
 
         # (batch, head, time1, d_k)
         q_with_bias_u = (q + self.pos_bias_u).transpose(1, 2)
         # (batch, head, time1, d_k)
         q_with_bias_v = (q + self.pos_bias_v).transpose(1, 2)
-
-        # compute attention score
-        # first compute matrix a and matrix c
-        # as described in https://arxiv.org/abs/1901.02860 Section 3.3
-        # (batch, head, time1, time2)
-        matrix_ac = torch.matmul(q_with_bias_u, k.transpose(-2, -1))
-
-        # compute matrix b and matrix d
-        # (batch, head, time1, 2*time1-1)
-        matrix_bd = torch.matmul(q_with_bias_v, p.transpose(-2, -1))
-        matrix_bd = self.rel_shift(matrix_bd)
-
-        scores = (matrix_ac + matrix_bd) / math.sqrt(
-            self.d_k
-        )  # (batch, head, time1, time2)
-
-        return self.forward_attention(v, scores, mask)
+        time1, time2 = q_with_bias_u.size(2), k.size(2)
+
+        def scores(start, end):
+            # compute attention score of the queries start:end
+            # first compute matrix a and matrix c
+            # as described in https://arxiv.org/abs/1901.02860 Section 3.3
+            # (batch, head, end-start, time2)
+            matrix_ac = torch.matmul(q_with_bias_u[:, :, start:end], k.transpose(-2, -1))
+
+            # compute matrix b and matrix d with the positions these queries see
+            # (batch, head, end-start, time2+end-start-1)
+            p_chunk = p[:, :, time1 - end : time1 + time2 - 1 - start]
+            matrix_bd = torch.matmul(q_with_bias_v[:, :, start:end], p_chunk.transpose(-2, -1))
+            matrix_bd = self.rel_shift(matrix_bd)
+
+            return (matrix_ac + matrix_bd) / math.sqrt(
+                self.d_k
+            )  # (batch, head, end-start, time2)
+
+        # zero_triu masks the positions of the whole query
+        if not self.zero_triu and self.chunk_queries(time1):
+            return self.forward_chunked(v, mask, scores, time1)
+        return self.forward_attention(v, scores(0, time1), mask)
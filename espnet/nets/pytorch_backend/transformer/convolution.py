@@ -43,10 +43,15 @@ class ConvolutionModule(nn.Module):
         )
         self.activation = Swish()
 
-    def forward(self, x):
+    def forward(self, x, chunk_size=None, mask_pad=None):
         """Compute covolution module.
 
         :param torch.Tensor x: (batch, time, size)
+        :param int chunk_size: if set, the depthwise convolution of a frame does
+            not see the frames after the end of its chunk of `chunk_size` frames,
+            as in :meth:`forward_chunk`
+        :param torch.Tensor mask_pad: mask of the non-padded frames (batch, 1, time),
+            the padded frames are zeroed before the depthwise convolution
         :return torch.Tensor: convoluted `value` (batch, time, d_model)
         """
         # exchange the temporal dimension and the feature dimension
@@ -55,15 +60,76 @@ class ConvolutionModule(nn.Module):
         # GLU mechanism
         x = self.pointwise_cov1(x)  # (batch, 2*channel, dim)
         x = nn.functional.glu(x, dim=1)  # (batch, channel, dim)
+        if mask_pad is not None:
+            # as the zero padding of a sequence alone
+            x = x.masked_fill(mask_pad.eq(0), 0.0)
 
         # 1D Depthwise Conv
-        x = self.depthwise_conv(x)
+        if chunk_size is None:
+            x = self.depthwise_conv(x)
+        else:
+            x = self.chunk_depthwise_conv(x, chunk_size)
         x = self.activation(self.norm(x))
 
         x = self.pointwise_cov2(x)
 
         return x.transpose(1, 2)
 
+    def chunk_depthwise_conv(self, x, chunk_size):
+        """Compute the depthwise convolution with the right context cut at chunk ends.
+
+        :param torch.Tensor x: (batch, channel, time)
+        :param int chunk_size: the number of frames of a chunk
+        :return torch.Tensor: (batch, channel, time)
+        """
+        pad = self.depthwise_conv.padding[0]
+        kernel_size = 2 * pad + 1
+        # (batch, channel, time, kernel_size) windows of the zero padded input
+        windows = nn.functional.pad(x, (pad, pad)).unfold(2, kernel_size, 1)
+        t = torch.arange(x.size(2), device=x.device)
+        taps = t.unsqueeze(1) - pad + torch.arange(kernel_size, device=x.device)
+        chunk_end = (t // chunk_size + 1) * chunk_size
+        windows = windows.masked_fill(taps >= chunk_end.unsqueeze(1), 0.0)
+        x = torch.einsum("bctk,ck->bct", windows, self.depthwise_conv.weight[:, 0])
+        if self.depthwise_conv.bias is not None:
+            x = x + self.depthwise_conv.bias.unsqueeze(1)
+        return x
+
+    def forward_chunk(self, x, cache=None):
+        """Compute convolution module of the next chunk of a stream.
+
+        The left context of the depthwise convolution is read from `cache`,
+        the right context is zero after the end of the chunk.
+
+        :param torch.Tensor x: frames of the chunk (batch, time, size)
+        :param torch.Tensor cache: the last `(kernel_size - 1) // 2` GLU outputs
+            of the previous chunks (batch, channel, (kernel_size - 1) // 2)
+            or None at the start of the stream
+        :return: convoluted chunk (batch, time, d_model) and the updated cache
+        :rtype: Tuple[torch.Tensor, torch.Tensor]
+        """
+        x = x.transpose(1, 2)
+        x = self.pointwise_cov1(x)
+        x = nn.functional.glu(x, dim=1)
+
+        pad = self.depthwise_conv.padding[0]
+        if cache is None:
+            # same as the zero padding before the first frame
+            cache = x.new_zeros(x.size(0), x.size(1), pad)
+        x = torch.cat([cache, x], dim=2)
+        new_cache = x[:, :, x.size(2) - pad :]
+        x = nn.functional.conv1d(
+            nn.functional.pad(x, (0, pad)),
+            self.depthwise_conv.weight,
+            self.depthwise_conv.bias,
+            groups=self.depthwise_conv.groups,
+        )
+        x = self.activation(self.norm(x))
+
+        x = self.pointwise_cov2(x)
+
+        return x.transpose(1, 2), new_cache
+
 
 class Swish(nn.Module):
     """Construct an Swish object."""
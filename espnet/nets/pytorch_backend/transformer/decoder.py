@@ -6,23 +6,25 @@
 
 """Decoder definition."""
 
-from typing import Any
-from typing import List
+import copy
 from typing import Tuple
 
 import torch
 
+from espnet.nets.pytorch_backend.nets_utils import make_output_shortlist
 from espnet.nets.pytorch_backend.nets_utils import rename_state_dict
+from espnet.nets.pytorch_backend.nets_utils import shortlist_linear
 from espnet.nets.pytorch_backend.transformer.attention import MultiHeadedAttention
 from espnet.nets.pytorch_backend.transformer.decoder_layer import DecoderLayer
 from espnet.nets.pytorch_backend.transformer.embedding import PositionalEncoding
+from espnet.nets.pytorch_backend.transformer.kv_cache import KVCache
 from espnet.nets.pytorch_backend.transformer.layer_norm import LayerNorm
 from espnet.nets.pytorch_backend.transformer.mask import subsequent_mask
 from espnet.nets.pytorch_backend.transformer.positionwise_feed_forward import (
     PositionwiseFeedForward,  # noqa: H301
 )
 from espnet.nets.pytorch_backend.transformer.repeat import repeat
-from espnet.nets.scorer_interface import BatchScorerInterface
+from espnet.nets.scorer_interface import BatchStateScorerInterface
 
 
 def _pre_hook(
@@ -38,7 +40,7 @@ def _pre_hook(
     rename_state_dict(prefix + "output_norm.", prefix + "after_norm.", state_dict)
 
 
-class Decoder(BatchScorerInterface, torch.nn.Module):
+class Decoder(BatchStateScorerInterface, torch.nn.Module):
     """Transfomer decoder module.
 
     :param int odim: output dim
@@ -120,6 +122,10 @@ class Decoder(BatchScorerInterface, torch.nn.Module):
             self.output_layer = torch.nn.Linear(attention_dim, odim)
         else:
             self.output_layer = None
+        # shortlisted output units of the beam search (see batch_set_shortlist)
+        self.shortlist = None
+        # static-shape layers of forward_incremental (see enable_static_step)
+        self.static_step = None
 
     def forward(self, tgt, tgt_mask, memory, memory_mask):
         """Forward decoder.
@@ -184,6 +190,175 @@ class Decoder(BatchScorerInterface, torch.nn.Module):
 
         return y, new_cache
 
+    def forward_incremental(self, tgt, memory, memory_mask=None, cache=None):
+        """Forward the newest token with a key/value cache.
+
+        Only the last token of `tgt` is embedded and projected, the
+        self-attention keys and values of the previous tokens are read from
+        `cache`, which is updated in place. The source-attention keys and
+        values of `memory` are projected once when the cache is created and
+        then broadcast to the rows of `tgt`, which must be grouped by utterance
+        (e.g. `beam_size` hypotheses per utterance) in the same order as
+        the rows of `memory` at that first step.
+
+        :param torch.Tensor tgt: input token ids, int64 (batch, maxlen_out)
+        :param torch.Tensor memory: encoded memory, float32  (batch, maxlen_in, feat)
+        :param torch.Tensor memory_mask: encoded memory mask (batch, 1, maxlen_in)
+        :param KVCache cache: cache of the previous tokens or None
+        :return y, cache: log probabilities of the next token (batch, token)
+            and the updated cache
+        :rtype: Tuple[torch.Tensor, KVCache]
+        """
+        if cache is None:
+            cache = self._init_cache(tgt, memory, memory_mask)
+        assert cache.length == tgt.size(1) - 1, "cache does not match the prefix"
+        pos_enc = self.embed[-1]
+        x = self.embed[:-1](tgt[:, -1:])
+        if isinstance(pos_enc, PositionalEncoding):
+            x = pos_enc(x, cache.length)
+        else:
+            x = pos_enc(x)
+        if self.static_step is not None:
+            cache.reserve(cache.length + 1)
+            pos = torch.tensor([cache.length], device=x.device)
+            mask = torch.arange(cache.capacity, device=x.device) <= cache.length
+            x = self.static_step(
+                x, cache.k, cache.v, pos, mask.view(1, 1, -1), cache.memory, cache.memory_mask
+            )
+        else:
+            for layer, decoder in enumerate(self.decoders):
+                x = decoder.forward_incremental(
+                    x, memory, cache.memory_mask, cache, layer
+                )
+        cache.advance()
+
+        y = x[:, -1]
+        if self.normalize_before:
+            y = self.after_norm(y)
+        if self.output_layer is not None:
+            y = torch.log_softmax(shortlist_linear(y, self.output_layer, self.shortlist), dim=-1)
+        return y, cache
+
+    def enable_static_step(self, compile=True, **compile_kwargs):
+        """Run the layers of :meth:`forward_incremental` with static shapes.
+
+        The new token attends to the whole key/value buffers under a mask, so
+        that the shapes of a step only change when the cache capacity doubles.
+        With `compile`, the layers are compiled by `torch.compile` once per
+        batch size and capacity (i.e. per length bucket); the embedding, which
+        depends on the position, and the output layer, which depends on the
+        shortlist, stay eager.
+
+        :param bool compile: compile the static-shape layers, requires torch >= 2.0
+        :param compile_kwargs: keyword arguments of `torch.compile`
+        """
+        step = self._forward_static_layers
+        if compile:
+            if not hasattr(torch, "compile"):
+                raise RuntimeError(
+                    "compiling the static step requires torch >= 2.0 (torch.compile), "
+                    f"found {torch.__version__}; run it eagerly with compile=False"
+                )
+            step = torch.compile(step, dynamic=False, **compile_kwargs)
+        self.static_step = step
+
+    def _forward_static_layers(self, x, k, v, pos, mask, memory_kv, memory_mask):
+        for layer, decoder in enumerate(self.decoders):
+            x = decoder.forward_static(
+                x, k[layer], v[layer], pos, mask, memory_kv[layer], memory_mask
+            )
+        return x
+
+    def forward_prefix(self, tgt, memory, memory_mask=None):
+        """Forward whole prefixes at once and cache their keys and values.
+
+        This is the teacher-forced counterpart of :meth:`forward_incremental`,
+        which can extend the returned cache token by token.
+
+        :param torch.Tensor tgt: input token ids, int64 (batch, maxlen_out)
+        :param torch.Tensor memory: encoded memory, float32  (batch, maxlen_in, feat)
+        :param torch.Tensor memory_mask: encoded memory mask (batch, 1, maxlen_in)
+        :return y, cache: log probabilities of the token following every
+            position (batch, maxlen_out, token) and the cache of `tgt`
+        :rtype: Tuple[torch.Tensor, KVCache]
+        """
+        cache = self._init_cache(tgt, memory, memory_mask)
+        tgt_mask = subsequent_mask(tgt.size(1), device=tgt.device).unsqueeze(0)
+        x = self.embed(tgt)
+        for layer, decoder in enumerate(self.decoders):
+            x = decoder.forward_incremental(
+                x, memory, cache.memory_mask, cache, layer, tgt_mask
+            )
+        cache.advance(tgt.size(1))
+
+        if self.normalize_before:
+            x = self.after_norm(x)
+        if self.output_layer is not None:
+            x = torch.log_softmax(
+                shortlist_linear(x, self.output_layer, self.shortlist), dim=-1
+            )
+        return x, cache
+
+    def _init_cache(self, tgt, memory, memory_mask):
+        self_attn = self.decoders[0].self_attn
+        memory_kv = [d.src_attn.project_memory(memory) for d in self.decoders]
+        # cache in the dtype of the projections, e.g. bfloat16 under autocast
+        cache = KVCache(
+            len(self.decoders),
+            tgt.size(0),
+            self_attn.h,
+            self_attn.d_k,
+            dtype=memory_kv[0][0].dtype,
+            device=memory.device,
+            zero_tail=self.static_step is not None,
+        )
+        cache.memory = memory_kv
+        cache.memory_mask = memory_mask
+        return cache
+
+    def extend_memory(self, cache, memory, memory_mask=None):
+        """Attend to a longer encoder memory after the cached prefixes.
+
+        The self-attention keys and values of the prefixes are kept, only the
+        source-attention keys and values are projected again, e.g. when the
+        encoder output of online decoding grows by a block.
+
+        :param KVCache cache: cache of the prefixes or None
+        :param torch.Tensor memory: encoded memory of each utterance (n_utt, maxlen_in, feat)
+        :param torch.Tensor memory_mask: encoded memory mask (n_utt, 1, maxlen_in)
+        :return: a cache sharing the prefix buffers of `cache` that attends to `memory`
+        :rtype: KVCache
+        """
+        if cache is None:
+            return None
+        cache = copy.copy(cache)
+        cache.memory = [d.src_attn.project_memory(memory) for d in self.decoders]
+        cache.memory_mask = memory_mask
+        return cache
+
+    def store_src_attention_weights(self, store=True):
+        """Keep the source attention weights of the last layer after each forward.
+
+        They are not kept by default, see :meth:`src_attention_weights`.
+
+        :param bool store: whether to keep the weights
+        """
+        self.decoders[-1].src_attn.store_attn = store
+
+    def src_attention_weights(self):
+        """Get the source attention weights of the last forwarded token.
+
+        :return: attention weights of the last layer averaged over heads
+            (batch, maxlen_in), or None before the first forward or unless
+            enabled by :meth:`store_src_attention_weights`
+        :rtype: torch.Tensor
+        """
+        attn = self.decoders[-1].src_attn.attn
+        if attn is None:
+            return None
+        # (batch or #mem, head, queries, maxlen_in) -> (queries, maxlen_in)
+        return attn.mean(dim=1).reshape(-1, attn.size(-1))
+
     # beam search API (see ScorerInterface)
     def score(self, ys, state, x):
         """Score."""
@@ -193,37 +368,57 @@ class Decoder(BatchScorerInterface, torch.nn.Module):
         )
         return logp.squeeze(0), state
 
-    # batch beam search API (see BatchScorerInterface)
+    # batch beam search API (see BatchStateScorerInterface)
     def batch_score(
-        self, ys: torch.Tensor, states: List[Any], xs: torch.Tensor
-    ) -> Tuple[torch.Tensor, List[Any]]:
+        self,
+        ys: torch.Tensor,
+        states: KVCache,
+        xs: torch.Tensor,
+        xs_mask: torch.Tensor = None,
+    ) -> Tuple[torch.Tensor, KVCache]:
         """Score new token batch (required).
         Args:
             ys (torch.Tensor): torch.int64 prefix tokens (n_batch, ylen).
-            states (List[Any]): Scorer states for prefix tokens.
+            states (KVCache): The key/value cache of the prefix tokens,
+                None at the first step.
             xs (torch.Tensor):
                 The encoder feature that generates ys (n_batch, xlen, n_feat).
+            xs_mask (torch.Tensor): Mask of the valid frames in xs (n_batch, 1, xlen).
         Returns:
-            tuple[torch.Tensor, List[Any]]: Tuple of
+            tuple[torch.Tensor, KVCache]: Tuple of
                 batchfied scores for next token with shape of `(n_batch, n_vocab)`
-                and next state list for ys.
+                and the key/value cache of ys.
         """
-        # merge states
-        n_batch = len(ys)
-        n_layers = len(self.decoders)
-        if states[0] is None:
-            batch_state = None
-        else:
-            # transpose state of [batch, layer] into [layer, batch]
-            batch_state = [
-                torch.stack([states[b][l] for b in range(n_batch)])
-                for l in range(n_layers)
-            ]
-
-        # batch decoding
-        ys_mask = subsequent_mask(ys.size(-1), device=xs.device).unsqueeze(0)
-        logp, states = self.forward_one_step(ys, ys_mask, xs, cache=batch_state)
-
-        # transpose state of [layer, batch] into [batch, layer]
-        state_list = [[states[l][b] for l in range(n_layers)] for b in range(n_batch)]
-        return logp, state_list
+        return self.forward_incremental(ys, xs, memory_mask=xs_mask, cache=states)
+
+    def batch_set_shortlist(
+        self, ids: torch.Tensor = None, mask: torch.Tensor = None
+    ) -> None:
+        """Restrict the output layer of the beam search to a shortlist.
+
+        Args:
+            ids (torch.Tensor): Sorted torch.int64 ids of the shortlisted tokens,
+                None to score all the tokens again
+            mask (torch.Tensor): Tokens of `ids` in the shortlist of each
+                utterance (n_utt, len(ids)), None if all the utterances share `ids`
+        """
+        if self.output_layer is not None:
+            self.shortlist = make_output_shortlist(self.output_layer, ids, mask)
+
+    def batch_score_prefix(
+        self, ys: torch.Tensor, xs: torch.Tensor, xs_mask: torch.Tensor = None
+    ) -> Tuple[torch.Tensor, KVCache]:
+        """Score every position of whole prefixes with one teacher-forced forward.
+
+        Args:
+            ys (torch.Tensor): torch.int64 prefix tokens starting with <sos>
+                (n_batch, ylen).
+            xs (torch.Tensor):
+                The encoder feature that generates ys (n_batch, xlen, n_feat).
+            xs_mask (torch.Tensor): Mask of the valid frames in xs (n_batch, 1, xlen).
+        Returns:
+            tuple[torch.Tensor, KVCache]: Tuple of
+                scores for the token following each prefix position
+                with shape of `(n_batch, ylen, n_vocab)` and the key/value cache of ys.
+        """
+        return self.forward_prefix(ys, xs, memory_mask=xs_mask)
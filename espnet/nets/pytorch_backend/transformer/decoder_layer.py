@@ -95,16 +95,97 @@ class DecoderLayer(nn.Module):
         if not self.normalize_before:
             x = self.norm1(x)
 
+        x = self._forward_src_attn_ff(x, memory, memory_mask)
+
+        if cache is not None:
+            x = torch.cat([cache, x], dim=1)
+
+        return x, tgt_mask, memory, memory_mask
+
+    def forward_incremental(
+        self, tgt, memory, memory_mask, kv_cache, layer, tgt_mask=None
+    ):
+        """Compute decoded features of the newest tokens.
+
+        The keys and values of the previous tokens are read from `kv_cache`
+        instead of being recomputed from the whole prefix. When
+        `kv_cache.memory` is set, the source attention uses its projected
+        memory instead of `memory`.
+
+        Args:
+            tgt (torch.Tensor): newest target features (batch, n_new, size)
+            memory (torch.Tensor): encoded source features (batch, max_time_in, size)
+            memory_mask (torch.Tensor): mask for memory (batch, 1, max_time_in)
+            kv_cache (KVCache): cached self-attention keys and values
+            layer (int): index of this layer in `kv_cache`
+            tgt_mask (torch.Tensor): mask of the newest tokens over the cached
+                and newest ones (batch, n_new, length), None for a single token
+        Returns:
+            torch.Tensor: decoded features of the newest tokens (batch, n_new, size)
+        """
+        residual = tgt
+        if self.normalize_before:
+            tgt = self.norm1(tgt)
+        if self.concat_after:
+            tgt_concat = torch.cat(
+                (tgt, self.self_attn.forward_cached(tgt, kv_cache, layer, tgt_mask)),
+                dim=-1,
+            )
+            x = residual + self.concat_linear1(tgt_concat)
+        else:
+            x = residual + self.dropout(
+                self.self_attn.forward_cached(tgt, kv_cache, layer, tgt_mask)
+            )
+        if not self.normalize_before:
+            x = self.norm1(x)
+
+        memory_kv = None if kv_cache.memory is None else kv_cache.memory[layer]
+        return self._forward_src_attn_ff(x, memory, memory_mask, memory_kv)
+
+    def forward_static(self, tgt, k_cache, v_cache, pos, mask, memory_kv, memory_mask):
+        """Compute decoded features of the newest token on fixed-size buffers.
+
+        See :meth:`MultiHeadedAttention.forward_static`.
+
+        Args:
+            tgt (torch.Tensor): newest target features (batch, 1, size)
+            k_cache (torch.Tensor): self-attention keys of this layer
+                (batch, head, capacity, d_k), updated in place
+            v_cache (torch.Tensor): self-attention values of this layer
+                (batch, head, capacity, d_k), updated in place
+            pos (torch.Tensor): position of the newest token (1,)
+            mask (torch.Tensor): mask of the filled positions (1, 1, capacity)
+            memory_kv (Tuple[torch.Tensor, torch.Tensor]): projected source
+                keys and values of this layer
+            memory_mask (torch.Tensor): mask for memory (batch, 1, max_time_in)
+        Returns:
+            torch.Tensor: decoded features of the newest token (batch, 1, size)
+        """
+        residual = tgt
+        if self.normalize_before:
+            tgt = self.norm1(tgt)
+        x_att = self.self_attn.forward_static(tgt, k_cache, v_cache, pos, mask)
+        if self.concat_after:
+            x = residual + self.concat_linear1(torch.cat((tgt, x_att), dim=-1))
+        else:
+            x = residual + self.dropout(x_att)
+        if not self.normalize_before:
+            x = self.norm1(x)
+        return self._forward_src_attn_ff(x, None, memory_mask, memory_kv)
+
+    def _forward_src_attn_ff(self, x, memory, memory_mask, memory_kv=None):
         residual = x
         if self.normalize_before:
             x = self.norm2(x)
+        if memory_kv is None:
+            x_src = self.src_attn(x, memory, memory, memory_mask)
+        else:
+            x_src = self.src_attn.forward_projected(x, *memory_kv, memory_mask)
         if self.concat_after:
-            x_concat = torch.cat(
-                (x, self.src_attn(x, memory, memory, memory_mask)), dim=-1
-            )
+            x_concat = torch.cat((x, x_src), dim=-1)
             x = residual + self.concat_linear2(x_concat)
         else:
-            x = residual + self.dropout(self.src_attn(x, memory, memory, memory_mask))
+            x = residual + self.dropout(x_src)
         if not self.normalize_before:
             x = self.norm2(x)
 
@@ -114,8 +195,4 @@ class DecoderLayer(nn.Module):
         x = residual + self.dropout(self.feed_forward(x))
         if not self.normalize_before:
             x = self.norm3(x)
-
-        if cache is not None:
-            x = torch.cat([cache, x], dim=1)
-
-        return x, tgt_mask, memory, memory_mask
+        return x
@@ -75,15 +75,24 @@ class PositionalEncoding(torch.nn.Module):
         pe = pe.unsqueeze(0)
         self.pe = pe.to(device=x.device, dtype=x.dtype)
 
-    def forward(self, x: torch.Tensor):
+    def forward(self, x: torch.Tensor, offset: int = 0):
         """Add positional encoding.
         Args:
             x (torch.Tensor): Input tensor (batch, time, `*`).
+            offset (int): Position of the first frame of x,
+                used for incremental decoding.
         Returns:
             torch.Tensor: Encoded tensor (batch, time, `*`).
         """
-        self.extend_pe(x)
-        x = x * self.xscale + self.pe[:, : x.size(1)]
+        if offset == 0:
+            self.extend_pe(x)
+        else:
+            self.extend_pe(
+                torch.tensor(0.0, dtype=x.dtype, device=x.device).expand(
+                    1, offset + x.size(1)
+                )
+            )
+        x = x * self.xscale + self.pe[:, offset : offset + x.size(1)]
         return self.dropout(x)
 
 
@@ -105,15 +114,24 @@ class ScaledPositionalEncoding(PositionalEncoding):
         """Reset parameters."""
         self.alpha.data = torch.tensor(1.0)
 
-    def forward(self, x):
+    def forward(self, x, offset=0):
         """Add positional encoding.
         Args:
             x (torch.Tensor): Input tensor (batch, time, `*`).
+            offset (int): Position of the first frame of x,
+                used for incremental decoding.
         Returns:
             torch.Tensor: Encoded tensor (batch, time, `*`).
         """
-        self.extend_pe(x)
-        x = x + self.alpha * self.pe[:, : x.size(1)]
+        if offset == 0:
+            self.extend_pe(x)
+        else:
+            self.extend_pe(
+                torch.tensor(0.0, dtype=x.dtype, device=x.device).expand(
+                    1, offset + x.size(1)
+                )
+            )
+        x = x + self.alpha * self.pe[:, offset : offset + x.size(1)]
         return self.dropout(x)
 
 
@@ -201,17 +219,27 @@ class RelPositionalEncoding(torch.nn.Module):
         pe = torch.cat([pe_positive, pe_negative], dim=1)
         self.pe = pe.to(device=x.device, dtype=x.dtype)
 
-    def forward(self, x: torch.Tensor):
+    def forward(self, x: torch.Tensor, left: int = 0):
         """Add positional encoding.
         Args:
             x (torch.Tensor): Input tensor (batch, time, `*`).
+            left (int): Number of previous frames attended by x,
+                used for chunk-wise streaming.
         Returns:
             torch.Tensor: Encoded tensor (batch, time, `*`).
+            torch.Tensor: Positional embedding tensor
+                (1, left + 2 * time - 1, `*`).
         """
-        self.extend_pe(x)
+        if left == 0:
+            self.extend_pe(x)
+        else:
+            self.extend_pe(
+                torch.tensor(0.0, dtype=x.dtype, device=x.device).expand(
+                    1, left + x.size(1)
+                )
+            )
         x = x * self.xscale
-        pos_emb = self.pe[
-            :,
-            self.pe.size(1) // 2 - x.size(1) + 1 : self.pe.size(1) // 2 + x.size(1),
-        ]
+        # relative positions from left + time - 1 down to -(time - 1)
+        center = self.pe.size(1) // 2
+        pos_emb = self.pe[:, center - left - x.size(1) + 1 : center + x.size(1)]
         return self.dropout(x), self.dropout(pos_emb)
@@ -8,6 +8,8 @@
 
 import torch
 
+from espnet.nets.pytorch_backend.nets_utils import make_pad_mask
+from espnet.nets.pytorch_backend.nets_utils import pad_list
 from espnet.nets.pytorch_backend.nets_utils import rename_state_dict
 #from espnet.nets.pytorch_backend.transducer.vgg import VGG2L
 from espnet.nets.pytorch_backend.transformer.attention import (
@@ -22,7 +24,10 @@ from espnet.nets.pytorch_backend.transformer.embedding import (
     LegacyRelPositionalEncoding, # noqa: H301
 )
 from espnet.nets.pytorch_backend.transformer.encoder_layer import EncoderLayer
+from espnet.nets.pytorch_backend.transformer.kv_cache import KVCache
 from espnet.nets.pytorch_backend.transformer.layer_norm import LayerNorm
+from espnet.nets.pytorch_backend.transformer.mask import chunk_attention_mask
+from espnet.nets.pytorch_backend.transformer.mask import subsequent_mask
 from espnet.nets.pytorch_backend.transformer.multi_layer_conv import Conv1dLinear
 from espnet.nets.pytorch_backend.transformer.multi_layer_conv import MultiLayeredConv1d
 from espnet.nets.pytorch_backend.transformer.positionwise_feed_forward import (
@@ -227,12 +232,35 @@ class Encoder(torch.nn.Module):
         if self.normalize_before:
             self.after_norm = LayerNorm(attention_dim)
 
-    def forward(self, xs, masks, extract_resnet_feats=False):
+    def set_query_chunk_size(self, query_chunk_size=None):
+        """Attend the self-attention queries by chunks, e.g. for long clips.
+
+        See :meth:`MultiHeadedAttention.forward_chunked`, the attention memory
+        grows with `query_chunk_size` times the clip length instead of the
+        square of the clip length.
+
+        :param int query_chunk_size: the number of queries of a chunk,
+            None to attend all the queries at once
+        """
+        for module in self.modules():
+            if isinstance(module, MultiHeadedAttention):
+                module.query_chunk_size = query_chunk_size
+
+    def forward(
+        self, xs, masks, extract_resnet_feats=False, chunk_size=None, left_chunks=-1
+    ):
         """Encode input sequence.
 
+        With `chunk_size`, every frame only attends to its chunk and the
+        `left_chunks` previous ones, and the convolution modules do not look
+        past the end of its chunk: this is the offline equivalent of
+        :meth:`forward_chunk`.
+
         :param torch.Tensor xs: input tensor
         :param torch.Tensor masks: input mask
         :param str extract_features: the position for feature extraction
+        :param int chunk_size: the number of frames of a chunk or None
+        :param int left_chunks: the number of chunks of left context, -1 for all
         :return: position embedded tensor and mask
         :rtype Tuple[torch.Tensor, torch.Tensor]:
         """
@@ -240,13 +268,34 @@ class Encoder(torch.nn.Module):
             xs = self.frontend(xs)
         if extract_resnet_feats:
             return xs
+        return self.forward_backend(xs, masks, chunk_size, left_chunks)
+
+    def forward_backend(self, xs, masks, chunk_size=None, left_chunks=-1):
+        """Encode the output of the frontend, see :meth:`forward`.
 
+        :param torch.Tensor xs: frontend output (batch, time, 512) or input tensor
+            without frontend
+        :param torch.Tensor masks: input mask (batch, 1, time) or None
+        :param int chunk_size: the number of frames of a chunk or None
+        :param int left_chunks: the number of chunks of left context, -1 for all
+        :return: position embedded tensor and mask
+        :rtype Tuple[torch.Tensor, torch.Tensor]:
+        """
         if isinstance(self.embed, Conv2dSubsampling):
             xs, masks = self.embed(xs, masks)
         else:
             xs = self.embed(xs)
-        
-        xs, masks = self.encoders(xs, masks)
+
+        if chunk_size is None:
+            xs, masks = self.encoders(xs, masks)
+        else:
+            x = xs[0] if isinstance(xs, tuple) else xs
+            chunk_masks = chunk_attention_mask(
+                x.size(1), chunk_size, left_chunks, device=x.device
+            ).unsqueeze(0)
+            masks = chunk_masks if masks is None else masks & chunk_masks
+            for e in self.encoders:
+                xs, masks = e(xs, masks, chunk_size=chunk_size)
 
         if isinstance(xs, tuple):
             xs = xs[0]
@@ -256,6 +305,35 @@ class Encoder(torch.nn.Module):
 
         return xs, masks
 
+    def forward_list(self, xs):
+        """Encode a batch of unbatched inputs of different lengths.
+
+        The inputs are zero padded, and the padded frames are masked in the
+        self-attention and zeroed before the depthwise convolutions, so that
+        the output of each input is the one of :meth:`forward` on it alone.
+        The 1D convolutions of the audio frontend would see the padding,
+        so the audio frontend runs on each input before padding.
+
+        :param List[torch.Tensor] xs: inputs (channel, time, height, width)
+            for `input_layer="conv3d"`, (samples, 1) for `"conv1d"`
+            and (time, idim) otherwise
+        :return: encoded inputs [(time_i, attention_dim), ...]
+        :rtype List[torch.Tensor]:
+        """
+        if isinstance(self.frontend, Conv3dResNet):
+            # pad the time axis, the stem convolution sees zeros after every clip
+            xs_pad = pad_list([x.transpose(0, 1) for x in xs], 0.0).transpose(1, 2)
+            lengths = [x.size(1) for x in xs]
+            xs_pad = self.frontend(xs_pad)
+        else:
+            if isinstance(self.frontend, Conv1dResNet):
+                xs = [self.frontend(x.unsqueeze(0)).squeeze(0) for x in xs]
+            xs_pad = pad_list(xs, 0.0)
+            lengths = [x.size(0) for x in xs]
+        masks = (~make_pad_mask(lengths)).unsqueeze(-2).to(xs_pad.device)
+        xs_pad, _ = self.forward_backend(xs_pad, masks)
+        return [x[:length] for x, length in zip(xs_pad, lengths)]
+
     def forward_one_step(self, xs, masks, cache=None):
         """Encode input frame.
 
@@ -281,3 +359,98 @@ class Encoder(torch.nn.Module):
         if self.normalize_before:
             xs = self.after_norm(xs)
         return xs, masks, new_cache
+
+    def forward_incremental(self, xs, cache=None):
+        """Encode new frames of a causal encoder with a key/value cache.
+
+        Unlike :meth:`forward_one_step`, only the new frames are fed and
+        projected, the previous frames are read from `cache`.
+        Only supported for `input_layer="linear"` or `None`
+        with absolute positional encoding and without convolution module.
+
+        :param torch.Tensor xs: new input frames (batch, time, idim)
+        :param KVCache cache: cache of the previous frames or None
+        :return: encoded new frames and the updated cache
+        :rtype Tuple[torch.Tensor, KVCache]:
+        """
+        if not isinstance(self.embed, torch.nn.Sequential) or isinstance(
+            self.embed[-1], (LegacyRelPositionalEncoding, RelPositionalEncoding)
+        ):
+            raise NotImplementedError(
+                "forward_incremental supports only linear input layer "
+                "with absolute positional encoding."
+            )
+        self_attn = self.encoders[0].self_attn
+        if cache is None:
+            cache = KVCache(
+                len(self.encoders),
+                xs.size(0),
+                self_attn.h,
+                self_attn.d_k,
+                dtype=xs.dtype,
+                device=xs.device,
+            )
+        offset = cache.length
+        pos_enc = self.embed[-1]
+        xs = self.embed[:-1](xs)
+        if isinstance(pos_enc, PositionalEncoding):
+            xs = pos_enc(xs, offset)
+        else:
+            xs = pos_enc(xs)
+
+        masks = None
+        if xs.size(1) > 1:
+            # new frame t attends to the cached frames and new frames up to t
+            masks = subsequent_mask(offset + xs.size(1), device=xs.device)
+            masks = masks[offset:].unsqueeze(0)
+        for layer, e in enumerate(self.encoders):
+            xs = e.forward_incremental(xs, cache, layer, masks)
+        cache.advance(xs.size(1))
+        if self.normalize_before:
+            xs = self.after_norm(xs)
+        return xs, cache
+
+    def forward_chunk(self, xs, chunk_size, left_chunks=-1, cache=None):
+        """Encode the next chunk of a stream with cached left context.
+
+        The output is the one of :meth:`forward` with the same `chunk_size`
+        and `left_chunks` on the whole stream, but only the frames of the chunk
+        are computed: each layer caches the projected keys/values of its left
+        context and the last inputs of its depthwise convolution. The latency
+        is thus bounded by the chunk size instead of the utterance length.
+        Only supported for `rel_mha` attention without subsampling.
+        The frontend is not run, `xs` is its output for the conv frontends.
+
+        :param torch.Tensor xs: frames of the chunk (batch, time, idim),
+            only the last chunk of a stream may be shorter than `chunk_size`
+        :param int chunk_size: the number of frames of a chunk
+        :param int left_chunks: the number of chunks of left context, -1 for all
+        :param list cache: per-layer keys, values and convolution state
+            from the previous call or None at the start of the stream
+        :return: encoded chunk and the updated cache
+        :rtype Tuple[torch.Tensor, List[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]]:
+        """
+        if not isinstance(self.embed, torch.nn.Sequential) or not isinstance(
+            self.embed[-1], RelPositionalEncoding
+        ):
+            raise NotImplementedError(
+                "forward_chunk supports only rel_mha attention without subsampling."
+            )
+        assert xs.size(1) <= chunk_size, "chunk longer than chunk_size"
+        if cache is None:
+            cache = [None for _ in range(len(self.encoders))]
+        left = 0 if cache[0] is None else cache[0][0].size(2)
+        xs = self.embed[:-1](xs)
+        xs, pos_emb = self.embed[-1](xs, left)
+
+        new_cache = []
+        for c, e in zip(cache, self.encoders):
+            xs, (k, v, conv) = e.forward_chunk(xs, pos_emb, c)
+            if left_chunks >= 0:
+                # the next chunk only attends to the last left_chunks chunks
+                start = max(k.size(2) - left_chunks * chunk_size, 0)
+                k, v = k[:, :, start:], v[:, :, start:]
+            new_cache.append((k, v, conv))
+        if self.normalize_before:
+            xs = self.after_norm(xs)
+        return xs, new_cache
@@ -72,12 +72,14 @@ class EncoderLayer(nn.Module):
         if self.concat_after:
             self.concat_linear = nn.Linear(size + size, size)
 
-    def forward(self, x_input, mask, cache=None):
+    def forward(self, x_input, mask, cache=None, chunk_size=None):
         """Compute encoded features.
 
         :param torch.Tensor x_input: encoded source features (batch, max_time_in, size)
         :param torch.Tensor mask: mask for x (batch, max_time_in)
         :param torch.Tensor cache: cache for x (batch, max_time_in - 1, size)
+        :param int chunk_size: chunk size of the convolution module, see
+            :meth:`ConvolutionModule.forward`
         :rtype: Tuple[torch.Tensor, torch.Tensor]
         """
         if isinstance(x_input, tuple):
@@ -125,7 +127,11 @@ class EncoderLayer(nn.Module):
             residual = x
             if self.normalize_before:
                 x = self.norm_conv(x)
-            x = residual + self.dropout(self.conv_module(x))
+            mask_pad = None
+            if mask is not None and cache is None:
+                # the diagonal of a (batch, time, time) mask marks the non-padded frames
+                mask_pad = mask if mask.size(1) == 1 else mask.diagonal(0, 1, 2).unsqueeze(1)
+            x = residual + self.dropout(self.conv_module(x, chunk_size, mask_pad))
             if not self.normalize_before:
                 x = self.norm_conv(x)
 
@@ -147,3 +153,103 @@ class EncoderLayer(nn.Module):
             return (x, pos_emb), mask
         else:
             return x, mask
+
+    def forward_incremental(self, x, kv_cache, layer, mask=None):
+        """Compute encoded features of new frames with a key/value cache.
+
+        Only causal layers without convolution module are supported,
+        since the cached frames are not recomputed.
+
+        :param torch.Tensor x: new frames (batch, time, size)
+        :param KVCache kv_cache: cached self-attention keys and values
+        :param int layer: index of this layer in `kv_cache`
+        :param torch.Tensor mask: mask of the cached and new frames
+            (batch, time, cache_length + time) or None
+        :return: encoded features of the new frames (batch, time, size)
+        :rtype: torch.Tensor
+        """
+        assert self.conv_module is None, "convolution module cannot be cached"
+
+        if self.macaron_style:
+            residual = x
+            if self.normalize_before:
+                x = self.norm_ff_macaron(x)
+            x = residual + self.ff_scale * self.dropout(self.feed_forward_macaron(x))
+            if not self.normalize_before:
+                x = self.norm_ff_macaron(x)
+
+        residual = x
+        if self.normalize_before:
+            x = self.norm_mha(x)
+        x_att = self.self_attn.forward_cached(x, kv_cache, layer, mask)
+        if self.concat_after:
+            x_concat = torch.cat((x, x_att), dim=-1)
+            x = residual + self.concat_linear(x_concat)
+        else:
+            x = residual + self.dropout(x_att)
+        if not self.normalize_before:
+            x = self.norm_mha(x)
+
+        residual = x
+        if self.normalize_before:
+            x = self.norm_ff(x)
+        x = residual + self.ff_scale * self.dropout(self.feed_forward(x))
+        if not self.normalize_before:
+            x = self.norm_ff(x)
+        return x
+
+    def forward_chunk(self, x, pos_emb, cache=None):
+        """Compute encoded features of the next chunk of a stream.
+
+        Only layers with relative positional self-attention are supported.
+
+        :param torch.Tensor x: frames of the chunk (batch, time, size)
+        :param torch.Tensor pos_emb: positional embedding of the cached and new frames
+            (1, cache_length + 2 * time - 1, size)
+        :param tuple cache: projected keys, values and convolution state
+            of the previous frames from the last call or None
+        :return: encoded chunk (batch, time, size) and the keys, values
+            and convolution state including it
+        :rtype: Tuple[torch.Tensor, Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]
+        """
+        kv_cache, conv_cache = (None, None) if cache is None else (cache[:2], cache[2])
+
+        if self.macaron_style:
+            residual = x
+            if self.normalize_before:
+                x = self.norm_ff_macaron(x)
+            x = residual + self.ff_scale * self.dropout(self.feed_forward_macaron(x))
+            if not self.normalize_before:
+                x = self.norm_ff_macaron(x)
+
+        residual = x
+        if self.normalize_before:
+            x = self.norm_mha(x)
+        x_att, (k, v) = self.self_attn.forward_chunk(x, pos_emb, kv_cache)
+        if self.concat_after:
+            x_concat = torch.cat((x, x_att), dim=-1)
+            x = residual + self.concat_linear(x_concat)
+        else:
+            x = residual + self.dropout(x_att)
+        if not self.normalize_before:
+            x = self.norm_mha(x)
+
+        if self.conv_module is not None:
+            residual = x
+            if self.normalize_before:
+                x = self.norm_conv(x)
+            x_conv, conv_cache = self.conv_module.forward_chunk(x, conv_cache)
+            x = residual + self.dropout(x_conv)
+            if not self.normalize_before:
+                x = self.norm_conv(x)
+
+        residual = x
+        if self.normalize_before:
+            x = self.norm_ff(x)
+        x = residual + self.ff_scale * self.dropout(self.feed_forward(x))
+        if not self.normalize_before:
+            x = self.norm_ff(x)
+
+        if self.conv_module is not None:
+            x = self.norm_final(x)
+        return x, (k, v, conv_cache)
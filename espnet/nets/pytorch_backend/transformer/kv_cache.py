@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Key/value cache for incremental self-attention."""
+
+import torch
+
+
+class KVCache(object):
+    """Preallocated cache of projected self-attention keys and values.
+
+    Keys and values of all the layers are stored in
+    `(n_layers, n_batch, n_head, capacity, d_k)` buffers, so that an
+    incremental step only projects the newest frames. The capacity is doubled
+    when it is exceeded.
+
+    Decoders may also keep the cross-attention keys and values of the encoder
+    memory in `memory` (one `(k, v)` pair per layer, projected once per
+    utterance) with its mask `memory_mask`. They are shared by all the
+    sequences of an utterance, which are grouped contiguously in the batch.
+
+    :param int n_layers: the number of self-attention layers
+    :param int n_batch: the number of sequences (e.g. hypotheses in the beam)
+    :param int n_head: the number of attention heads
+    :param int d_k: the dimension of each head
+    :param int capacity: the number of frames preallocated
+    :param torch.dtype dtype: dtype of the keys and values
+    :param torch.device device: device of the keys and values
+    :param bool zero_tail: keep the frames after `length` zeroed, for
+        static-shape attention that reads the whole buffers under a mask
+    """
+
+    def __init__(
+        self,
+        n_layers,
+        n_batch,
+        n_head,
+        d_k,
+        capacity=64,
+        dtype=torch.float32,
+        device="cpu",
+        zero_tail=False,
+    ):
+        """Construct a KVCache object."""
+        shape = (n_layers, n_batch, n_head, capacity, d_k)
+        alloc = torch.zeros if zero_tail else torch.empty
+        self.k = alloc(shape, dtype=dtype, device=device)
+        self.v = alloc(shape, dtype=dtype, device=device)
+        self.length = 0
+        self.zero_tail = zero_tail
+        self.memory = None
+        self.memory_mask = None
+
+    @property
+    def capacity(self):
+        """Return the number of frames that fit in the buffers."""
+        return self.k.size(3)
+
+    def __len__(self):
+        """Return the number of sequences in the cache."""
+        return self.k.size(1)
+
+    def reserve(self, length):
+        """Make room for `length` frames, doubling the capacity if needed."""
+        if length > self.capacity:
+            self._extend(length)
+
+    def _extend(self, length):
+        capacity = self.capacity
+        while capacity < length:
+            capacity *= 2
+        shape = self.k.shape[:3] + (capacity,) + self.k.shape[4:]
+        k, v = self._alloc(shape)
+        k[:, :, :, : self.length] = self.k[:, :, :, : self.length]
+        v[:, :, :, : self.length] = self.v[:, :, :, : self.length]
+        self.k, self.v = k, v
+
+    def _alloc(self, shape):
+        k, v = self.k.new_empty(shape), self.v.new_empty(shape)
+        if self.zero_tail:
+            # the frames before `length` are copied over by the caller
+            k[:, :, :, self.length :].zero_()
+            v[:, :, :, self.length :].zero_()
+        return k, v
+
+    def update(self, layer, k, v):
+        """Write the keys and values of new frames of one layer.
+
+        The cache length is not changed until :meth:`advance` is called,
+        so that every layer writes at the same position.
+
+        :param int layer: layer index
+        :param torch.Tensor k: projected keys (n_batch, n_head, time, d_k)
+        :param torch.Tensor v: projected values (n_batch, n_head, time, d_k)
+        :return: keys and values of all the frames (n_batch, n_head, length, d_k)
+        :rtype: Tuple[torch.Tensor, torch.Tensor]
+        """
+        end = self.length + k.size(2)
+        self.reserve(end)
+        self.k[layer, :, :, self.length : end] = k
+        self.v[layer, :, :, self.length : end] = v
+        return self.k[layer, :, :, :end], self.v[layer, :, :, :end]
+
+    def advance(self, n=1):
+        """Move the cache length forward after all the layers are updated."""
+        self.length += n
+
+    def index_select(self, ids):
+        """Gather the sequences of the cache (e.g. reorder the beam).
+
+        :param torch.Tensor ids: torch.int64 sequence indices (n_select,)
+        :return: new cache with the selected sequences
+        :rtype: KVCache
+        """
+        new = KVCache.__new__(KVCache)
+        new.zero_tail = self.zero_tail
+        shape = self.k.shape[:1] + (len(ids),) + self.k.shape[2:]
+        new.k, new.v = self._alloc(shape)
+        # only the filled frames are gathered, straight into the new buffers
+        torch.index_select(
+            self.k[:, :, :, : self.length], 1, ids, out=new.k[:, :, :, : self.length]
+        )
+        torch.index_select(
+            self.v[:, :, :, : self.length], 1, ids, out=new.v[:, :, :, : self.length]
+        )
+        new.length = self.length
+        # the selected sequences keep their utterance grouping
+        new.memory = self.memory
+        new.memory_mask = self.memory_mask
+        return new
@@ -49,3 +49,31 @@ def target_mask(ys_in_pad, ignore_id):
     ys_mask = ys_in_pad != ignore_id
     m = subsequent_mask(ys_mask.size(-1), device=ys_mask.device).unsqueeze(0)
     return ys_mask.unsqueeze(-2) & m
+
+
+def chunk_attention_mask(size, chunk_size, left_chunks=-1, device="cpu", dtype=datatype):
+    """Create mask for chunk-wise attention with limited left context (size, size).
+
+    Frame `i` attends to the frames of its own chunk and of the `left_chunks`
+    previous chunks, i.e. to the context a streaming encoder has when it
+    receives the input `chunk_size` frames at a time.
+
+    :param int size: size of mask
+    :param int chunk_size: the number of frames of a chunk
+    :param int left_chunks: the number of chunks of left context, -1 for all
+    :param str device: "cpu" or "cuda" or torch.Tensor.device
+    :param torch.dtype dtype: result dtype
+    :rtype: torch.Tensor
+    >>> chunk_attention_mask(4, 2, 0)
+    [[1, 1, 0, 0],
+     [1, 1, 0, 0],
+     [0, 0, 1, 1],
+     [0, 0, 1, 1]]
+    """
+    chunk = torch.arange(size, device=device) // chunk_size
+    # distance in chunks from the query frame to the key frame
+    diff = chunk.unsqueeze(1) - chunk.unsqueeze(0)
+    ret = diff >= 0
+    if left_chunks >= 0:
+        ret = ret & (diff <= left_chunks)
+    return ret.type(dtype)
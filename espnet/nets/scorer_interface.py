@@ -96,8 +96,31 @@ class BatchScorerInterface(ScorerInterface):
         """
         return self.init_state(x)
 
+    def batch_select_state(
+        self, states: Any, ids: torch.Tensor, new_ids: torch.Tensor = None
+    ) -> Any:
+        """Select states of the best hypotheses in the batch beam search.
+
+        Args:
+            states: Batched scorer states returned by `batch_score`
+            ids (torch.Tensor): torch.int64 indices of the selected hypotheses
+            new_ids (torch.Tensor): torch.int64 new label indices
+                of the selected hypotheses if necessary
+
+        Returns:
+            Selected states for `ids`
+
+        """
+        if states is None:
+            return None
+        return [states[i] for i in ids.tolist()]
+
     def batch_score(
-        self, ys: torch.Tensor, states: List[Any], xs: torch.Tensor
+        self,
+        ys: torch.Tensor,
+        states: List[Any],
+        xs: torch.Tensor,
+        xs_mask: torch.Tensor = None,
     ) -> Tuple[torch.Tensor, List[Any]]:
         """Score new token batch (required).
 
@@ -106,6 +129,8 @@ class BatchScorerInterface(ScorerInterface):
             states (List[Any]): Scorer states for prefix tokens.
             xs (torch.Tensor):
                 The encoder feature that generates ys (n_batch, xlen, n_feat).
+            xs_mask (torch.Tensor): Mask of the valid frames in xs (n_batch, 1, xlen).
+                `None` means that no frame is padded.
 
         Returns:
             tuple[torch.Tensor, List[Any]]: Tuple of
@@ -120,6 +145,8 @@ class BatchScorerInterface(ScorerInterface):
         )
         scores = list()
         outstates = list()
+        if xs_mask is not None:
+            xs = [x[m[0]] for x, m in zip(xs, xs_mask)]
         for i, (y, state, x) in enumerate(zip(ys, states, xs)):
             score, outstate = self.score(y, state, x)
             outstates.append(outstate)
@@ -128,6 +155,169 @@ class BatchScorerInterface(ScorerInterface):
         return scores, outstates
 
 
+def index_select_state(state: Any, ids: torch.Tensor) -> Any:
+    """Select hypotheses of a batched scorer state.
+
+    Tensors are selected along their first dimension, lists, tuples and dicts
+    recursively, and any other object by its own `index_select(ids)` method.
+
+    Args:
+        state: Batched scorer state
+        ids (torch.Tensor): torch.int64 indices of the selected hypotheses
+
+    Returns:
+        The state of the selected hypotheses
+
+    """
+    if state is None:
+        return None
+    if isinstance(state, torch.Tensor):
+        return state.index_select(0, ids)
+    if isinstance(state, (list, tuple)):
+        return type(state)(index_select_state(s, ids) for s in state)
+    if isinstance(state, dict):
+        return {k: index_select_state(v, ids) for k, v in state.items()}
+    return state.index_select(ids)
+
+
+class BatchStateScorerInterface(BatchScorerInterface):
+    """Batch scorer interface with one batched state for all the hypotheses.
+
+    Unlike :class:`BatchScorerInterface`, the state is never split into
+    per-hypothesis slices: `batch_score` receives and returns one object
+    (e.g. tensors whose first dimension is the hypotheses) and the beam search
+    reorders it with :meth:`batch_select_state`. The initial hypotheses use the
+    value of :meth:`batch_init_state` itself, not a list of states.
+
+    """
+
+    def batch_init_state(self, x: torch.Tensor, xlens: torch.Tensor = None) -> Any:
+        """Get the batched initial state for decoding (optional).
+
+        Args:
+            x (torch.Tensor): The encoded feature tensor (T, D),
+                or padded encoded features of utterances (B, T, D)
+            xlens (torch.Tensor): The lengths of the utterances (B,)
+
+        Returns: batched initial state of one hypothesis per utterance
+
+        """
+        return None
+
+    def batch_select_state(
+        self, states: Any, ids: torch.Tensor, new_ids: torch.Tensor = None
+    ) -> Any:
+        """Select states of the best hypotheses in the batch beam search.
+
+        Args:
+            states: Batched scorer state returned by `batch_score`
+            ids (torch.Tensor): torch.int64 indices of the selected hypotheses
+            new_ids (torch.Tensor): torch.int64 new label indices
+                of the selected hypotheses if necessary
+
+        Returns:
+            Batched state of the selected hypotheses
+
+        """
+        return index_select_state(states, ids)
+
+    def batch_set_shortlist(
+        self, ids: torch.Tensor = None, mask: torch.Tensor = None
+    ) -> None:
+        """Restrict the scored tokens to a shortlist (optional).
+
+        Scorers with a vocabulary-sized output layer compute it on the
+        shortlisted tokens only, normalize their scores over them and give
+        `-inf` to the other tokens. With `mask`, the hypotheses are grouped by
+        utterance and each utterance only keeps the tokens of its own shortlist.
+
+        Args:
+            ids (torch.Tensor): Sorted torch.int64 ids of the shortlisted tokens,
+                None to score all the tokens again
+            mask (torch.Tensor): Tokens of `ids` in the shortlist of each
+                utterance (n_utt, len(ids)), None if all the utterances share `ids`
+
+        """
+        pass
+
+    def batch_score_prefix(
+        self, ys: torch.Tensor, xs: torch.Tensor, xs_mask: torch.Tensor = None
+    ) -> Tuple[torch.Tensor, Any]:
+        """Score every position of whole prefixes from the initial state.
+
+        The default implementation feeds the prefixes one token at a time,
+        scorers with a parallel teacher-forced forward override it.
+
+        Args:
+            ys (torch.Tensor): torch.int64 prefix tokens starting with <sos>
+                (n_batch, ylen).
+            xs (torch.Tensor):
+                The encoder feature that generates ys (n_batch, xlen, n_feat).
+            xs_mask (torch.Tensor): Mask of the valid frames in xs (n_batch, 1, xlen).
+                `None` means that no frame is padded.
+
+        Returns:
+            tuple[torch.Tensor, Any]: Tuple of
+                scores for the token following each prefix position
+                with shape of `(n_batch, ylen, n_vocab)` and batched state for ys.
+
+        """
+        xlens = None if xs_mask is None else xs_mask.sum(dim=-1).view(-1)
+        state = self.batch_init_state(xs, xlens)
+        scores = []
+        for i in range(1, ys.size(1) + 1):
+            score, state = self.batch_score(ys[:, :i], state, xs, xs_mask)
+            scores.append(score)
+        return torch.stack(scores, dim=1), state
+
+    def batch_init_prefix_state(
+        self, ys: torch.Tensor, xs: torch.Tensor, xs_mask: torch.Tensor = None
+    ) -> Tuple[torch.Tensor, Any]:
+        """Get the batched state after whole prefixes and their scores.
+
+        Args:
+            ys (torch.Tensor): torch.int64 prefix tokens starting with <sos>
+                (n_batch, ylen).
+            xs (torch.Tensor):
+                The encoder feature that generates ys (n_batch, xlen, n_feat).
+            xs_mask (torch.Tensor): Mask of the valid frames in xs (n_batch, 1, xlen).
+
+        Returns:
+            tuple[torch.Tensor, Any]: Tuple of
+                the accumulated scores of `ys[:, 1:]` (n_batch,)
+                and batched state for ys.
+
+        """
+        scores, state = self.batch_score_prefix(ys, xs, xs_mask)
+        scores = scores[:, :-1].gather(2, ys[:, 1:].unsqueeze(2)).sum(dim=(1, 2))
+        return scores, state
+
+    def batch_score(
+        self,
+        ys: torch.Tensor,
+        states: Any,
+        xs: torch.Tensor,
+        xs_mask: torch.Tensor = None,
+    ) -> Tuple[torch.Tensor, Any]:
+        """Score new token batch (required).
+
+        Args:
+            ys (torch.Tensor): torch.int64 prefix tokens (n_batch, ylen).
+            states: Batched scorer state for prefix tokens.
+            xs (torch.Tensor):
+                The encoder feature that generates ys (n_batch, xlen, n_feat).
+            xs_mask (torch.Tensor): Mask of the valid frames in xs (n_batch, 1, xlen).
+                `None` means that no frame is padded.
+
+        Returns:
+            tuple[torch.Tensor, Any]: Tuple of
+                batchfied scores for next token with shape of `(n_batch, n_vocab)`
+                and batched state for ys.
+
+        """
+        raise NotImplementedError
+
+
 class PartialScorerInterface(ScorerInterface):
     """Partial scorer interface for beam search.
 
@@ -186,3 +376,13 @@ class BatchPartialScorerInterface(BatchScorerInterface, PartialScorerInterface):
                 and next states for ys
         """
         raise NotImplementedError
+
+
+class BatchStatePartialScorerInterface(
+    BatchStateScorerInterface, BatchPartialScorerInterface
+):
+    """Batch partial scorer interface with one batched state.
+
+    See :class:`BatchStateScorerInterface`.
+
+    """
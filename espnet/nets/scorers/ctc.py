@@ -5,23 +5,39 @@ import torch
 
 from espnet.nets.ctc_prefix_score import CTCPrefixScore
 from espnet.nets.ctc_prefix_score import CTCPrefixScoreTH
-from espnet.nets.scorer_interface import BatchPartialScorerInterface
+from espnet.nets.scorer_interface import BatchStatePartialScorerInterface
 
 
-class CTCPrefixScorer(BatchPartialScorerInterface):
+class CTCPrefixScorer(BatchStatePartialScorerInterface):
     """Decoder interface wrapper for CTCPrefixScore."""
 
-    def __init__(self, ctc: torch.nn.Module, eos: int):
+    def __init__(
+        self,
+        ctc: torch.nn.Module,
+        eos: int,
+        margin: int = 0,
+        decoder: torch.nn.Module = None,
+    ):
         """Initialize class.
 
         Args:
             ctc (torch.nn.Module): The CTC implementation.
                 For example, :class:`espnet.nets.pytorch_backend.ctc.CTC`
             eos (int): The end-of-sequence id.
+            margin (int): The number of frames around the decoder attention
+                focus covered by the CTC forward recursion in the batch beam
+                search (0 means no windowing).
+            decoder (torch.nn.Module): The decoder that provides
+                `src_attention_weights()` for windowing. It must be scored
+                before this scorer in each step, as full scorers are.
 
         """
         self.ctc = ctc
         self.eos = eos
+        self.margin = margin if decoder is not None else 0
+        self.decoder = decoder
+        if self.margin > 0:
+            decoder.store_src_attention_weights()
         self.impl = None
 
     def init_state(self, x: torch.Tensor):
@@ -85,46 +101,89 @@ class CTCPrefixScorer(BatchPartialScorerInterface):
         )
         return tscore, (presub_score, new_st)
 
-    def batch_init_state(self, x: torch.Tensor):
+    def batch_init_state(self, x: torch.Tensor, xlens: torch.Tensor = None):
         """Get an initial state for decoding.
 
         Args:
-            x (torch.Tensor): The encoded feature tensor
+            x (torch.Tensor): The encoded feature tensor (T, D),
+                or padded encoded features of utterances (B, T, D)
+            xlens (torch.Tensor): The lengths of the utterances (B,)
 
         Returns: initial state
 
         """
-        logp = self.ctc.log_softmax(x.unsqueeze(0))  # assuming batch_size = 1
-        xlen = torch.tensor([logp.size(1)])
-        self.impl = CTCPrefixScoreTH(logp, xlen, 0, self.eos)
+        if x.dim() == 2:
+            x = x.unsqueeze(0)
+        logp = self.ctc.log_softmax(x)
+        if xlens is None:
+            xlens = torch.full((logp.size(0),), logp.size(1), dtype=torch.int64)
+        self.impl = CTCPrefixScoreTH(logp, xlens, 0, self.eos, self.margin)
         return None
 
+    def batch_init_prefix_state(self, ys, xs, xs_mask=None):
+        """Get the CTC state after whole prefixes.
+
+        Args:
+            ys (torch.Tensor): prefix tokens starting with <sos> (n_batch, ylen),
+                one prefix per utterance
+            xs (torch.Tensor): padded encoded features of utterances (B, T, D)
+            xs_mask (torch.Tensor): Mask of the valid frames in xs (B, 1, T)
+
+        Returns:
+            tuple[torch.Tensor, Any]: Tuple of the CTC prefix scores of ys (n_batch,)
+                and the batched CTC state `(r, s, f_min, f_max)` of ys
+
+        """
+        xlens = None if xs_mask is None else xs_mask.sum(dim=-1).view(-1).cpu()
+        self.batch_init_state(xs, xlens)
+        return self.impl.prefix_state(ys[:, 1:])
+
     def batch_score_partial(self, y, ids, state, x):
         """Score new token.
 
         Args:
-            y (torch.Tensor): 1D prefix token
-            ids (torch.Tensor): torch.int64 next token to score
-            state: decoder state for prefix tokens
-            x (torch.Tensor): 2D encoder feature that generates ys
+            y (torch.Tensor): prefix tokens (n_batch, ylen)
+            ids (torch.Tensor): torch.int64 next tokens to score (n_batch, n_token)
+            state: batched CTC state `(r, s, f_min, f_max)` of the prefix tokens,
+                None at the first step
+            x (torch.Tensor): encoder feature that generates ys
 
         Returns:
             tuple[torch.Tensor, Any]:
-                Tuple of a score tensor for y that has a shape `(len(next_tokens),)`
+                Tuple of a score tensor for y that has a shape `(n_batch, n_vocab)`
                 and next state for ys
 
         """
-        batch_state = (
-            (
-                torch.stack([s[0] for s in state], dim=2),
-                torch.stack([s[1] for s in state]),
-                state[0][2],
-                state[0][3],
-            )
-            if state[0] is not None
-            else None
-        )
-        return self.impl(y, batch_state, ids)
+        att_w = None
+        if self.margin > 0:
+            # attention of the decoder step that scored the same hypotheses
+            att_w = self.decoder.src_attention_weights()
+        return self.impl(y, state, ids, att_w)
+
+    def batch_select_state(self, state, ids, new_ids=None):
+        """Select states of the best hypotheses in the batch beam search.
+
+        Args:
+            state: CTC state returned by `batch_score_partial`,
+                or a state already selected by this method
+            ids (torch.Tensor): torch.int64 indices of the selected hypotheses
+            new_ids (torch.Tensor): torch.int64 new label indices
+                of the selected hypotheses
+
+        Returns:
+            tuple: batched CTC state `(r, s, f_min, f_max)`
+
+        """
+        if state is None:
+            return None
+        if new_ids is None:
+            r, s, f_min, f_max = state
+            return r.index_select(2, ids), s.index_select(0, ids), f_min, f_max
+        # convert to the per-utterance (B, W) ids expected by CTCPrefixScoreTH,
+        # the selected hypotheses are grouped by utterance
+        n_hyps = state[1].size(0) // self.impl.batch
+        best_ids = ((ids % n_hyps) * self.impl.odim + new_ids).view(self.impl.batch, -1)
+        return self.impl.index_select_state(state, best_ids)
 
     def extend_prob(self, x: torch.Tensor):
         """Extend probs for decoding.
@@ -146,13 +205,10 @@ class CTCPrefixScorer(BatchPartialScorerInterface):
         as in Eq (14) in https://arxiv.org/abs/2006.14941
 
         Args:
-            state: The states of hyps
+            state: batched CTC state `(r, s, f_min, f_max)` of the hypotheses,
+                None before the first step
 
         Returns: exteded state
 
         """
-        new_state = []
-        for s in state:
-            new_state.append(self.impl.extend_state(s))
-
-        return new_state
+        return self.impl.extend_state(state)
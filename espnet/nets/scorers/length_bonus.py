@@ -1,14 +1,13 @@
 """Length bonus module."""
 from typing import Any
-from typing import List
 from typing import Tuple
 
 import torch
 
-from espnet.nets.scorer_interface import BatchScorerInterface
+from espnet.nets.scorer_interface import BatchStateScorerInterface
 
 
-class LengthBonus(BatchScorerInterface):
+class LengthBonus(BatchStateScorerInterface):
     """Length bonus in beam search."""
 
     def __init__(self, n_vocab: int):
@@ -37,20 +36,25 @@ class LengthBonus(BatchScorerInterface):
         return torch.tensor([1.0], device=x.device, dtype=x.dtype).expand(self.n), None
 
     def batch_score(
-        self, ys: torch.Tensor, states: List[Any], xs: torch.Tensor
-    ) -> Tuple[torch.Tensor, List[Any]]:
+        self,
+        ys: torch.Tensor,
+        states: Any,
+        xs: torch.Tensor,
+        xs_mask: torch.Tensor = None,
+    ) -> Tuple[torch.Tensor, Any]:
         """Score new token batch.
 
         Args:
             ys (torch.Tensor): torch.int64 prefix tokens (n_batch, ylen).
-            states (List[Any]): Scorer states for prefix tokens.
+            states: Scorer state for prefix tokens, always None.
             xs (torch.Tensor):
                 The encoder feature that generates ys (n_batch, xlen, n_feat).
+            xs_mask (torch.Tensor): Mask of the valid frames in xs, unused.
 
         Returns:
-            tuple[torch.Tensor, List[Any]]: Tuple of
+            tuple[torch.Tensor, Any]: Tuple of
                 batchfied scores for next token with shape of `(n_batch, n_vocab)`
-                and next state list for ys.
+                and None
 
         """
         return (
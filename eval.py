@@ -5,10 +5,15 @@
 # Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
 import os
+import time
+import itertools
 import torch
 import hydra
 from pipelines.metrics.measures import get_wer
 from pipelines.metrics.measures import get_cer
+from pipelines.batching import length_batches
+from pipelines.batching import padding_fraction
+from pipelines.batching import probe_num_frames
 from pipelines.pipeline import InferencePipeline
 
 
@@ -31,28 +36,138 @@ class AverageMeter:
         self.avg = self.total / self.count
 
 
-def benchmark_inference(inference_pipeline, data_dir, landmarks_dir, lines, data_ext=".mp4", landmarks_ext=".pkl"):
+def batched_inference(inference_pipeline, filenames, batch_frames, max_padding=0.1):
+    """Transcribe `(data_filename, landmarks_filename)` pairs by length-bucketed batches, in input order."""
+    lengths = [probe_num_frames(data_filename) for data_filename, _ in filenames]
+    batches = length_batches(lengths, batch_frames, max_padding)
+    print(f"{len(batches)} batches of at most {batch_frames} frames, padding: {padding_fraction(lengths, batches)*100:.1f}% of the encoded frames")
+    outputs = [None] * len(filenames)
+    for batch in batches:
+        data_filenames, landmarks_filenames = zip(*[filenames[i] for i in batch])
+        for i, output in zip(batch, inference_pipeline.forward_batch(data_filenames, landmarks_filenames)):
+            outputs[i] = output
+    return outputs
+
+
+def benchmark_inference(inference_pipeline, data_dir, landmarks_dir, lines, data_ext=".mp4", landmarks_ext=".pkl", batch_frames=None, max_padding=0.1):
     wer, cer = AverageMeter(), AverageMeter()
-    for idx, line in enumerate(lines):
+    groundtruths, filenames = [], []
+    for line in lines:
         basename, groundtruth = line.split()[0], " ".join(line.split()[1:])
         data_filename = os.path.join(data_dir, f"{basename}{data_ext}")
         landmarks_filename = os.path.join(landmarks_dir, f"{basename}{landmarks_ext}") if landmarks_dir else None
-        output = inference_pipeline(data_filename, landmarks_filename)
-
+        groundtruths.append(groundtruth)
+        filenames.append((data_filename, landmarks_filename))
+    if batch_frames is None:
+        outputs = (inference_pipeline(data_filename, landmarks_filename) for data_filename, landmarks_filename in filenames)
+    else:
+        outputs = batched_inference(inference_pipeline, filenames, batch_frames, max_padding)
+    for idx, (output, groundtruth) in enumerate(zip(outputs, groundtruths)):
         print(f"hyp: {output}\nref: {groundtruth}" if groundtruth is not None else "")
+        # the decoding paths of a batch are not in label order
+        if inference_pipeline.model.cascade_threshold is not None and batch_frames is None:
+            print(f"path: {inference_pipeline.model.last_decode_path}")
         if groundtruth is not None:
             wer.update(get_wer(output, groundtruth), len(groundtruth.split()))
             cer.update(get_cer(output, groundtruth), len(groundtruth))
             print(f"progress: {idx+1}/{len(lines)}\tcur WER: {wer.val*100:.2f}\tcur CER: {cer.val*100:.2f}\tavg WER: {wer.avg*100:.2f}\tavg CER: {cer.avg*100:.2f}")
+    if inference_pipeline.model.cascade_threshold is not None:
+        paths = inference_pipeline.model.decode_paths
+        print(f"cascade: {paths['ctc_greedy']} greedy CTC, {paths['beam_search']} beam search")
+    if inference_pipeline.feature_cache is not None:
+        cache = inference_pipeline.feature_cache
+        print(f"feature cache: {cache.hits}/{cache.hits + cache.misses} utterances hit")
+    if inference_pipeline.model.ctc_draft:
+        accepted, drafted = inference_pipeline.model.draft_accepted, inference_pipeline.model.draft_tokens
+        print(f"ctc draft: {accepted}/{drafted} draft tokens accepted by the decoder")
+
+
+SWEEP_PARAMS = ["beam_size", "ctc_weight", "lm_weight", "penalty"]
+# model and encoder features of a sweep worker
+sweep_state = {}
+
+
+def sweep_grid(sweep, decode_params):
+    """Return the decoding parameters of every grid point, unswept ones keep the config value."""
+    values = []
+    for key in SWEEP_PARAMS:
+        if sweep[key] is None:
+            values.append([decode_params[key]])
+        elif isinstance(sweep[key], (int, float)):
+            values.append([sweep[key]])
+        else:
+            values.append(list(sweep[key]))
+    return [dict(zip(SWEEP_PARAMS, point)) for point in itertools.product(*values)]
+
+
+def init_sweep_worker(config_filename, device, enc_feats, groundtruths, model=None):
+    """Load the model of a sweep worker, unless it is given, and keep the shared encoder features."""
+    if model is None:
+        model = InferencePipeline(config_filename, face_track=False, device=device).model
+    sweep_state.update(model=model, enc_feats=enc_feats, groundtruths=groundtruths)
+
+
+def decode_grid_point(decode_params):
+    """Decode all the encoder features with one grid point, return its WER, CER and decode time per utterance."""
+    model = sweep_state["model"]
+    model.set_decode_params(**decode_params)
+    wer, cer = AverageMeter(), AverageMeter()
+    start = time.perf_counter()
+    outputs = [model.decode(feats.to(model.device)) for feats in sweep_state["enc_feats"]]
+    elapsed = time.perf_counter() - start
+    for output, groundtruth in zip(outputs, sweep_state["groundtruths"]):
+        wer.update(get_wer(output, groundtruth), len(groundtruth.split()))
+        cer.update(get_cer(output, groundtruth), len(groundtruth))
+    return decode_params, wer.avg, cer.avg, elapsed / max(len(outputs), 1)
+
+
+def sweep_inference(inference_pipeline, cfg, data_dir, landmarks_dir, lines, data_ext=".mp4", landmarks_ext=".pkl"):
+    """Encode every utterance once, then decode them with each grid point of `cfg.sweep` in a process pool."""
+    enc_feats, groundtruths = [], []
+    for idx, line in enumerate(lines):
+        basename, groundtruth = line.split()[0], " ".join(line.split()[1:])
+        data_filename = os.path.join(data_dir, f"{basename}{data_ext}")
+        landmarks_filename = os.path.join(landmarks_dir, f"{basename}{landmarks_ext}") if landmarks_dir else None
+        enc_feats.append(inference_pipeline.encode(data_filename, landmarks_filename).cpu())
+        groundtruths.append(groundtruth)
+        print(f"encoded: {idx+1}/{len(lines)}")
+
+    grid = sweep_grid(cfg.sweep, inference_pipeline.model.decode_params)
+    print(f"sweep: {len(grid)} grid points, {cfg.sweep_workers} workers")
+    if cfg.sweep_workers > 1:
+        # each worker loads its own model, the features are shared through torch.multiprocessing
+        context = torch.multiprocessing.get_context("spawn")
+        device = inference_pipeline.model.device
+        with context.Pool(cfg.sweep_workers, init_sweep_worker, (cfg.config_filename, device, enc_feats, groundtruths)) as pool:
+            results = pool.map(decode_grid_point, grid, chunksize=1)
+    else:
+        init_sweep_worker(cfg.config_filename, None, enc_feats, groundtruths, inference_pipeline.model)
+        results = [decode_grid_point(decode_params) for decode_params in grid]
+
+    header = SWEEP_PARAMS + ["WER", "CER", "ms/utt"]
+    rows = [
+        [str(decode_params[key]) for key in SWEEP_PARAMS] + [f"{wer*100:.2f}", f"{cer*100:.2f}", f"{sec*1000:.1f}"]
+        for decode_params, wer, cer, sec in sorted(results, key=lambda result: result[1])
+    ]
+    print("".join(f"{name:>12}" for name in header))
+    for row in rows:
+        print("".join(f"{value:>12}" for value in row))
+    if cfg.sweep_results:
+        with open(cfg.sweep_results, "w") as f:
+            f.write("\n".join("\t".join(row) for row in [header] + rows) + "\n")
 
 
 @hydra.main(version_base=None, config_path="hydra_configs", config_name="default")
 def main(cfg):
     device = torch.device(f"cuda:{cfg.gpu_idx}") if torch.cuda.is_available() and cfg.gpu_idx >= 0 else "cpu"
-    inference_pipeline = InferencePipeline(config_filename=cfg.config_filename, detector=cfg.detector, face_track=not cfg.landmarks_filename and not cfg.landmarks_dir, device=device)
+    inference_pipeline = InferencePipeline(config_filename=cfg.config_filename, detector=cfg.detector, face_track=not cfg.landmarks_filename and not cfg.landmarks_dir, device=device, feature_cache_dir=cfg.feature_cache_dir, feature_cache_size_mb=cfg.feature_cache_size_mb, feature_cache_content_hash=cfg.feature_cache_content_hash)
     assert os.path.isdir(cfg.data_dir), f"{cfg.data_dir} is not a directory."
     assert os.path.isfile(cfg.labels_filename), f"{cfg.labels_filename} does not exist."
-    benchmark_inference(inference_pipeline, cfg.data_dir, cfg.landmarks_dir, open(cfg.labels_filename).read().splitlines(), cfg.data_ext, cfg.landmarks_ext)
+    lines = open(cfg.labels_filename).read().splitlines()
+    if any(values is not None for values in cfg.sweep.values()):
+        sweep_inference(inference_pipeline, cfg, cfg.data_dir, cfg.landmarks_dir, lines, cfg.data_ext, cfg.landmarks_ext)
+    else:
+        benchmark_inference(inference_pipeline, cfg.data_dir, cfg.landmarks_dir, lines, cfg.data_ext, cfg.landmarks_ext, cfg.batch_frames, cfg.max_padding)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,61 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import av
+
+# frame rate of the encoder input, the audio frontend outputs 25 frames per second
+FRAME_RATE = 25
+
+
+def probe_num_frames(filename):
+    """Return the number of video frames of a file from its container, without decoding.
+
+    The frame count of the stream header is used when the container has one,
+    else its duration, else the packets of the stream are counted. The length
+    of audio-only files is their duration at the encoder frame rate.
+    """
+    with av.open(filename) as container:
+        if not container.streams.video:
+            return int(container.duration / av.time_base * FRAME_RATE)
+        stream = container.streams.video[0]
+        if stream.frames:
+            return stream.frames
+        if stream.duration and stream.average_rate:
+            return int(round(float(stream.duration * stream.time_base * stream.average_rate)))
+        return sum(1 for packet in container.demux(stream) if packet.size)
+
+
+def length_batches(lengths, max_frames, max_padding=0.1):
+    """Group utterances of similar lengths into batches under a frame budget.
+
+    The utterances are sorted by decreasing length and a batch takes the next
+    one as long as its padded size, the number of utterances times the longest
+    one, stays within `max_frames` and the padded frames stay below
+    `max_padding` of it. An utterance longer than `max_frames` is a batch alone.
+
+    :param list lengths: the number of frames of each utterance
+    :param int max_frames: the frame budget of a padded batch
+    :param float max_padding: the maximum fraction of padded frames of a batch
+    :return: batches of indices in `lengths`
+    :rtype: List[List[int]]
+    """
+    batches, batch, n_frames = [], [], 0
+    for idx in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+        if batch:
+            padded = (len(batch) + 1) * max(lengths[batch[0]], 1)
+            if padded > max_frames or 1 - (n_frames + lengths[idx]) / padded > max_padding:
+                batches.append(batch)
+                batch, n_frames = [], 0
+        batch.append(idx)
+        n_frames += lengths[idx]
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def padding_fraction(lengths, batches):
+    """Return the fraction of padded frames over all the padded batches."""
+    padded = sum(len(batch) * max(lengths[i] for i in batch) for batch in batches)
+    return 1 - sum(lengths) / max(padded, 1)
@@ -0,0 +1,131 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import hashlib
+import os
+
+import numpy as np
+import torch
+
+
+def file_digest(filename, chunk_size=2**20):
+    """Return the sha1 hex digest of the content of a file."""
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stat_key(filename):
+    """Return the (real path, size, modification time in ns) of a file."""
+    filename = os.path.realpath(filename)
+    stat = os.stat(filename)
+    return filename, stat.st_size, stat.st_mtime_ns
+
+
+class FeatureCache:
+    """Size-bounded LRU cache of encoder features on disk.
+
+    The features of an utterance are stored as a float16 `.npy` file named by
+    the hash of the input file, its landmarks and the model, and are read back
+    memory-mapped. The modification time of a file is its last access, the
+    least recently used files are removed once the cache exceeds `max_size_mb`.
+
+    The input and landmarks files are identified by their real path, size and
+    modification time, which only takes a `stat`. With `content_hash`, they
+    are identified by the sha1 of their content instead, e.g. when the same
+    clips are copied to other paths, and the digests are memoized by the stat.
+
+    :param str cache_dir: directory of the cached features
+    :param float max_size_mb: size bound of the cache in MB
+    :param model_files: checkpoint files the features depend on
+    :param bool content_hash: identify the input files by their content
+    :param model_options: options the features depend on, e.g. the modality
+    """
+
+    def __init__(self, cache_dir, max_size_mb, *model_files, content_hash=False, **model_options):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 2**20
+        digests = [file_digest(f) for f in model_files] + [repr(sorted(model_options.items()))]
+        self.model_digest = hashlib.sha1("\n".join(digests).encode()).hexdigest()
+        self.content_hash = content_hash
+        self.digests = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, data_filename, landmarks_filename=None):
+        """Return the key of the features of an input file and its landmarks file.
+
+        Without a landmarks file, the landmarks are detected from the input,
+        which only depends on the detector of the model options.
+        """
+        digests = [self.model_digest, self.file_key(data_filename)]
+        if landmarks_filename is not None:
+            digests.append(self.file_key(landmarks_filename))
+        return hashlib.sha1("\n".join(digests).encode()).hexdigest()
+
+    def file_key(self, filename):
+        """Return the identity of an input file in the key of its features."""
+        stat_key = file_stat_key(filename)
+        if not self.content_hash:
+            return repr(stat_key)
+        if stat_key not in self.digests:
+            self.digests[stat_key] = file_digest(stat_key[0])
+        return self.digests[stat_key]
+
+    def _filename(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def get(self, key, device="cpu"):
+        """Return the cached features (T, D) of a key as float32 on `device`, or None.
+
+        The float16 features are copied once from the memory map, by the
+        conversion to float32 on the device.
+        """
+        filename = self._filename(key)
+        try:
+            # copy-on-write, so that the tensor can share the memory map
+            feats = np.load(filename, mmap_mode="c")
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(filename)
+        self.hits += 1
+        return torch.from_numpy(feats).to(device=device, dtype=torch.float32)
+
+    def put(self, key, enc_feats):
+        """Store the features (T, D) of a key and return them as they are read back.
+
+        The stored features are rounded to float16, returning them keeps the
+        first decoding pass identical to the cached ones.
+        """
+        feats = enc_feats.detach().cpu().to(torch.float16).numpy()
+        filename = self._filename(key)
+        # write then rename, so that a concurrent reader never sees a partial file
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, "wb") as f:
+            np.save(f, feats)
+        os.replace(tmp_filename, filename)
+        self.evict()
+        return torch.from_numpy(feats).to(device=enc_feats.device, dtype=torch.float32)
+
+    def evict(self):
+        """Remove the least recently used features until the cache fits its size bound."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for _, file_size, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            size -= file_size
@@ -6,24 +6,52 @@
 
 import os
 import json
+import contextlib
 import torch
 import argparse
+import logging
 import numpy as np
+from collections import Counter, defaultdict
+from torch.nn.utils.rnn import pad_sequence
 
 from espnet.asr.asr_utils import torch_load
 from espnet.asr.asr_utils import get_model_conf
 from espnet.asr.asr_utils import add_results_to_json
 from espnet.nets.batch_beam_search import BatchBeamSearch
+from espnet.nets.batch_beam_search_online import BatchBeamSearchOnline
+from espnet.nets.beam_search import Hypothesis
 from espnet.nets.lm_interface import dynamic_import_lm
+from espnet.nets.scorers.ctc import CTCPrefixScorer
 from espnet.nets.scorers.length_bonus import LengthBonus
 from espnet.nets.pytorch_backend.e2e_asr_transformer import E2E
+from espnet.nets.pytorch_backend.nets_utils import make_pad_mask
+from espnet.nets.pytorch_backend.transformer.mask import subsequent_mask
+from pipelines.onnx_encoder import OnnxEncoder
 
 
 class AVSR(torch.nn.Module):
     def __init__(self, modality, model_path, model_conf, rnnlm=None, rnnlm_conf=None,
-        penalty=0., ctc_weight=0.1, lm_weight=0., beam_size=40, device="cuda:0"):
+        penalty=0., ctc_weight=0.1, lm_weight=0., beam_size=40, device="cuda:0", ctc_window_margin=0,
+        score_beam=None, max_active=None, pre_beam_threshold=None, cascade_threshold=None, cascade_decoder_rescore=False, exact_stop=False,
+        rescore_nbest=0, first_pass_beam_size=None, ctc_draft=False, shortlist_threshold=None,
+        compile_step=False, precision="fp32", encoder_backend="torch", encoder_onnx=None, streaming=False,
+        attention_query_chunk_size=None):
         super(AVSR, self).__init__()
         self.device = device
+        self.ctc_weight = ctc_weight
+        # cascade decoding: keep greedy CTC outputs whose confidence reaches the threshold
+        self.cascade_threshold = cascade_threshold
+        self.cascade_decoder_rescore = cascade_decoder_rescore
+        # the number of utterances decoded by each path, and the path of the last one
+        self.decode_paths = Counter()
+        self.last_decode_path = None
+        # draft decoding: the decoder verifies greedy CTC tokens in one parallel pass
+        self.ctc_draft = ctc_draft
+        # running sums of the accepted and drafted tokens of draft decoding
+        self.draft_accepted = 0
+        self.draft_tokens = 0
+        # vocabulary shortlist: tokens whose CTC posterior reaches the threshold in some frame
+        self.shortlist_threshold = shortlist_threshold
 
         if modality == "audiovisual":
             from espnet.nets.pytorch_backend.e2e_asr_transformer_av import E2E
@@ -45,40 +73,287 @@ class AVSR(torch.nn.Module):
 
         self.model = E2E(self.odim, self.train_args)
         self.model.load_state_dict(torch.load(model_path, map_location=lambda storage, loc: storage))
+
+        # the encoder can run through onnxruntime on cpu, the beam search stays in pytorch
+        if encoder_backend == "onnxruntime":
+            self.onnx_encoder = OnnxEncoder(encoder_onnx)
+            # release the pytorch encoder, only the decoder and ctc are moved to the device
+            for name in ["encoder", "aux_encoder", "fusion"]:
+                if hasattr(self.model, name):
+                    setattr(self.model, name, None)
+        elif encoder_backend == "torch":
+            self.onnx_encoder = None
+            # long clips: the encoder self-attention attends by chunks of queries
+            if attention_query_chunk_size:
+                for name in ["encoder", "aux_encoder"]:
+                    if hasattr(self.model, name):
+                        getattr(self.model, name).set_query_chunk_size(attention_query_chunk_size)
+        else:
+            raise ValueError(f"unknown encoder backend: {encoder_backend}")
         self.model.to(device=self.device).eval()
 
-        self.beam_search = get_beam_search_decoder(self.model, self.token_list, rnnlm, rnnlm_conf, penalty, ctc_weight, lm_weight, beam_size)
+        # two-pass decoding: beam search without LM, then LM rescoring of the n-best
+        self.rescore_nbest = rescore_nbest if rnnlm else 0
+        self.lm = None
+        self.fusion_lm = None
+        if self.rescore_nbest > 0:
+            self.lm = load_lm(self.token_list, rnnlm, rnnlm_conf).to(device=self.device)
+            beam_size = first_pass_beam_size or beam_size
+        elif rnnlm:
+            self.fusion_lm = load_lm(self.token_list, rnnlm, rnnlm_conf)
+
+        if precision == "int8":
+            if torch.device(self.device).type != "cpu":
+                raise ValueError(f"precision int8 runs on cpu, not on {self.device}")
+            quantize_dynamic(self.model)
+            for lm in [self.lm, self.fusion_lm]:
+                if lm is not None:
+                    quantize_dynamic(lm)
+        elif precision == "bf16" and not hasattr(torch, "autocast"):
+            raise ValueError(f"precision bf16 requires torch >= 1.10 (torch.autocast), found {torch.__version__}")
+        elif precision not in ["fp32", "bf16"]:
+            raise ValueError(f"unknown precision: {precision}")
+        # bf16: the networks run under autocast, the CTC prefix scores and the
+        # beam scores are accumulated in fp32
+        self.precision = precision
+
+        self.compile_step = compile_step
+        self.search_options = dict(
+            ctc_window_margin=ctc_window_margin, score_beam=score_beam, max_active=max_active,
+            pre_beam_threshold=pre_beam_threshold, exact_stop=exact_stop, streaming=streaming,
+        )
+        self.set_decode_params(beam_size, ctc_weight, lm_weight, penalty)
+
+    def set_decode_params(self, beam_size, ctc_weight, lm_weight, penalty):
+        """Build the beam search of other decoding parameters, without reloading the networks.
+
+        In two-pass decoding, `beam_size` is the beam of the first pass and
+        `lm_weight` weights the rescoring LM.
+        """
+        self.ctc_weight = ctc_weight
+        self.lm_weight = lm_weight
+        self.decode_params = dict(beam_size=beam_size, ctc_weight=ctc_weight, lm_weight=lm_weight, penalty=penalty)
+        if self.lm is not None:
+            lm_weight = 0.
+        self.beam_search = get_beam_search_decoder(
+            self.model, self.token_list, None, None, penalty, ctc_weight, lm_weight, beam_size, lm=self.fusion_lm, **self.search_options
+        )
         self.beam_search.to(device=self.device).eval()
-        
+        if self.compile_step:
+            self.beam_search.enable_static_step(compile=True)
+
     def infer(self, data):
-        with torch.no_grad():
-            if isinstance(data, tuple):
-                enc_feats = self.model.encode(data[0].to(self.device), data[1].to(self.device))
-            else:
-                enc_feats = self.model.encode(data.to(self.device))
-            nbest_hyps = self.beam_search(enc_feats)
-            nbest_hyps = [h.asdict() for h in nbest_hyps[: min(len(nbest_hyps), 1)]]
-            transcription = add_results_to_json(nbest_hyps, self.token_list)
-            transcription = transcription.replace("▁", " ").strip()
+        if isinstance(data, list):
+            return self.infer_batch(data)
+        with torch.no_grad(), self.autocast():
+            return self.decode(self.encode(data))
+
+    def decode(self, enc_feats):
+        """Transcribe the encoder features (T, D) of one utterance."""
+        with torch.no_grad(), self.autocast():
+            if self.cascade_threshold is not None:
+                greedy_hyp = self.cascade(enc_feats)
+                if greedy_hyp is not None:
+                    return self.get_transcription([greedy_hyp])
+            if self.shortlist_threshold is not None:
+                self.beam_search.set_shortlist(self.ctc_shortlist(enc_feats))
+            prefix = None
+            if self.ctc_draft:
+                prefix = self.verify_drafts(enc_feats.unsqueeze(0), torch.tensor([len(enc_feats)]))[0]
+            nbest_hyps = self.beam_search(enc_feats, prefix=prefix)
+            if self.lm is not None:
+                nbest_hyps = rescore_nbest(self.lm, self.lm_weight, nbest_hyps, self.rescore_nbest)
+        self.count_decode_path("beam_search")
+        return self.get_transcription(nbest_hyps)
+
+    def infer_batch(self, data_list):
+        with torch.no_grad(), self.autocast():
+            return self.decode_batch(self.encode_batch(data_list))
+
+    def decode_batch(self, enc_feats):
+        """Transcribe the encoder features [(T_i, D), ...] of several utterances in one search."""
+        with torch.no_grad(), self.autocast():
+            transcriptions = [None] * len(enc_feats)
+            if self.cascade_threshold is not None:
+                for i, feats in enumerate(enc_feats):
+                    greedy_hyp = self.cascade(feats)
+                    if greedy_hyp is not None:
+                        transcriptions[i] = self.get_transcription([greedy_hyp])
+            remained = [i for i, t in enumerate(transcriptions) if t is None]
+            if remained:
+                xlens = torch.tensor([len(enc_feats[i]) for i in remained])
+                xs = pad_sequence([enc_feats[i] for i in remained], batch_first=True)
+                prefixes = self.verify_drafts(xs, xlens) if self.ctc_draft else [xlens.new_zeros(0)] * len(remained)
+                # utterances with as many accepted draft tokens are searched together,
+                # the beam search of a batch starts at the same position
+                groups = defaultdict(list)
+                for j, prefix in enumerate(prefixes):
+                    groups[len(prefix)].append(j)
+                nbest_hyps = [None] * len(remained)
+                for n_prefix, group in groups.items():
+                    ids = torch.tensor(group)
+                    prefix = torch.stack([prefixes[j] for j in group]) if n_prefix > 0 else None
+                    group_xlens = xlens[ids]
+                    group_xs = xs[ids.to(xs.device), : int(group_xlens.max())]
+                    if self.shortlist_threshold is not None:
+                        # each utterance keeps its own shortlist within the batched search
+                        self.beam_search.set_shortlist([self.ctc_shortlist(enc_feats[remained[j]]) for j in group])
+                    for j, hyps in zip(group, self.beam_search.batch_forward(group_xs, group_xlens, prefix=prefix)):
+                        nbest_hyps[j] = hyps
+                for i, hyps in zip(remained, nbest_hyps):
+                    if self.lm is not None:
+                        hyps = rescore_nbest(self.lm, self.lm_weight, hyps, self.rescore_nbest)
+                    transcriptions[i] = self.get_transcription(hyps)
+                    self.count_decode_path("beam_search")
+        return transcriptions
+
+    def stream(self, enc_block, is_final=False):
+        """Decode the next block of encoder features (T_block, D) of a stream.
+
+        Returns the stable part of the transcription so far, which later
+        blocks only extend, and the final transcription once `is_final`.
+        It requires the online beam search of the `streaming` decode option.
+        """
+        with torch.no_grad(), self.autocast():
+            nbest_hyps = self.beam_search.forward_block(enc_block.float(), is_final)
+            if not is_final:
+                eos = torch.tensor([self.odim - 1])
+                tokens = self.beam_search.stable_prefix().cpu()
+                return self.get_transcription([Hypothesis(yseq=torch.cat([eos, tokens, eos]), score=0.)])
+            if self.lm is not None:
+                nbest_hyps = rescore_nbest(self.lm, self.lm_weight, nbest_hyps, self.rescore_nbest)
+        self.count_decode_path("streaming")
+        return self.get_transcription(nbest_hyps)
+
+    def cascade(self, enc_feats):
+        """Return the greedy CTC hypothesis if it is confident enough, otherwise None.
+
+        The confidence is the average frame log posterior of the greedy CTC path,
+        interpolated with the average token log probability of one teacher-forced
+        decoder pass over the collapsed tokens when `cascade_decoder_rescore` is set.
+        """
+        token_ids, best_logp = self.ctc_greedy(enc_feats)
+        confidence = best_logp.mean()
+        if self.cascade_decoder_rescore:
+            decoder_confidence = self.decoder_confidence(enc_feats, token_ids)
+            confidence = self.ctc_weight * confidence + (1.0 - self.ctc_weight) * decoder_confidence
+        confidence = float(confidence.exp())
+        if confidence < self.cascade_threshold:
+            logging.info(f"greedy CTC confidence {confidence:.3f}, falling back to beam search")
+            return None
+        self.count_decode_path("ctc_greedy")
+        eos = torch.tensor([self.odim - 1], device=token_ids.device)
+        return Hypothesis(yseq=torch.cat([eos, token_ids, eos]), score=confidence)
+
+    def ctc_greedy(self, enc_feats):
+        """Return the collapsed greedy CTC tokens and the frame log posteriors of the path."""
+        logp = self.model.ctc.log_softmax(enc_feats.unsqueeze(0)).squeeze(0)
+        best_logp, best_ids = logp.max(dim=-1)
+        # collapse repeated labels and remove blanks (id 0)
+        keep = best_ids != 0
+        keep[1:] &= best_ids[1:] != best_ids[:-1]
+        return best_ids[keep], best_logp
+
+    def ctc_shortlist(self, enc_feats):
+        """Return the tokens whose CTC posterior reaches `shortlist_threshold` in some frame.
+
+        The tokens of the greedy CTC path are always kept, so that CTC drafts
+        stay in the shortlist.
+        """
+        logp = self.model.ctc.log_softmax(enc_feats.unsqueeze(0)).squeeze(0)
+        keep = logp.max(dim=0)[0] >= np.log(self.shortlist_threshold)
+        keep[logp.argmax(dim=-1)] = True
+        keep[0] = False  # blank
+        return torch.nonzero(keep, as_tuple=False).view(-1)
+
+    def verify_drafts(self, xs, xlens):
+        """Return the prefixes of the greedy CTC drafts that the decoder agrees with.
+
+        The drafts of all the utterances are checked by one teacher-forced decoder
+        pass: a draft token is accepted while it is the best next token of the
+        decoder. Each utterance keeps its own accepted prefix, one tensor of
+        token ids per utterance.
+        """
+        sos = eos = self.odim - 1
+        drafts = [self.ctc_greedy(xs[b, : xlens[b]])[0] for b in range(len(xs))]
+        ys_in = pad_sequence(
+            [torch.cat([d.new_full((1,), sos), d]) for d in drafts], batch_first=True, padding_value=eos
+        )
+        ys_mask = subsequent_mask(ys_in.size(1), device=ys_in.device).unsqueeze(0)
+        memory_mask = ~make_pad_mask(xlens, maxlen=xs.size(1)).to(xs.device).unsqueeze(1)
+        logits, _ = self.model.decoder(ys_in, ys_mask, xs, memory_mask)
+        agree = logits[:, :-1].argmax(dim=-1) == ys_in[:, 1:]
+        dlens = torch.tensor([len(d) for d in drafts], device=agree.device)
+        agree &= torch.arange(agree.size(1), device=agree.device) < dlens.unsqueeze(1)
+        n_accepted = agree.long().cumprod(dim=1).sum(dim=1)
+        self.draft_accepted += int(n_accepted.sum())
+        self.draft_tokens += int(dlens.sum())
+        logging.info(f"accepted {n_accepted.tolist()} of {dlens.tolist()} CTC draft tokens")
+        return [d[:n] for d, n in zip(drafts, n_accepted.tolist())]
+
+    def decoder_confidence(self, enc_feats, token_ids):
+        sos = eos = torch.tensor([self.odim - 1], device=token_ids.device)
+        ys_in = torch.cat([sos, token_ids]).unsqueeze(0)
+        ys_out = torch.cat([token_ids, eos])
+        ys_mask = subsequent_mask(ys_in.size(1), device=ys_in.device).unsqueeze(0)
+        logits, _ = self.model.decoder(ys_in, ys_mask, enc_feats.unsqueeze(0), None)
+        logp = logits.squeeze(0).log_softmax(dim=-1)
+        return logp.gather(1, ys_out.unsqueeze(1)).mean()
+
+    def encode(self, data):
+        if self.onnx_encoder is not None:
+            xs = data if isinstance(data, tuple) else (data,)
+            return self.onnx_encoder(*xs).to(self.device)
+        if isinstance(data, tuple):
+            enc_feats = self.model.encode(data[0].to(self.device), data[1].to(self.device))
+        else:
+            enc_feats = self.model.encode(data.to(self.device))
+        # the beam search accumulates its scores in the dtype of the features
+        return enc_feats.float()
+
+    def encode_batch(self, data_list):
+        """Encode the inputs of several utterances in one padded forward pass."""
+        if self.onnx_encoder is not None:
+            return [self.encode(data) for data in data_list]
+        if isinstance(data_list[0], tuple):
+            videos, audios = zip(*data_list)
+            enc_feats = self.model.encode_batch(
+                [x.to(self.device) for x in videos], [x.to(self.device) for x in audios]
+            )
+        else:
+            enc_feats = self.model.encode_batch([x.to(self.device) for x in data_list])
+        return [feats.float() for feats in enc_feats]
+
+    def autocast(self):
+        """Return the bf16 autocast context of `precision = bf16`, a no-op context otherwise."""
+        if self.precision != "bf16":
+            return contextlib.nullcontext()
+        return torch.autocast(torch.device(self.device).type, dtype=torch.bfloat16)
+
+    def count_decode_path(self, path):
+        """Record the decoding path of an utterance."""
+        self.decode_paths[path] += 1
+        self.last_decode_path = path
+
+    def get_transcription(self, nbest_hyps):
+        if len(nbest_hyps) == 0:
+            return ""
+        nbest_hyps = [h.asdict() for h in nbest_hyps[: min(len(nbest_hyps), 1)]]
+        transcription = add_results_to_json(nbest_hyps, self.token_list)
+        transcription = transcription.replace("▁", " ").strip()
         return transcription.replace("<eos>", "")
 
 
-def get_beam_search_decoder(model, token_list, rnnlm=None, rnnlm_conf=None, penalty=0, ctc_weight=0.1, lm_weight=0., beam_size=40):
+def get_beam_search_decoder(model, token_list, rnnlm=None, rnnlm_conf=None, penalty=0, ctc_weight=0.1, lm_weight=0., beam_size=40, ctc_window_margin=0, score_beam=None, max_active=None, pre_beam_threshold=None, exact_stop=False, lm=None, streaming=False):
     sos = model.odim - 1
     eos = model.odim - 1
     scorers = model.scorers()
+    if ctc_window_margin > 0 and ctc_weight < 1.0:
+        # limit the CTC prefix recursion to the frames around the decoder attention
+        scorers["ctc"] = CTCPrefixScorer(model.ctc, eos, margin=ctc_window_margin, decoder=model.decoder)
 
-    if not rnnlm:
-        lm = None
-    else:
-        lm_args = get_model_conf(rnnlm, rnnlm_conf)
-        lm_model_module = getattr(lm_args, "model_module", "default")
-        lm_class = dynamic_import_lm(lm_model_module, lm_args.backend)
-        lm = lm_class(len(token_list), lm_args)
-        torch_load(rnnlm, lm)
-        lm.eval()
-
-    scorers["lm"] = lm
+    # an LM already loaded is shared, e.g. by the beam searches of a parameter sweep
+    scorers["lm"] = lm if lm is not None else (load_lm(token_list, rnnlm, rnnlm_conf) if rnnlm else None)
     scorers["length_bonus"] = LengthBonus(len(token_list))
     weights = dict(
         decoder=1.0 - ctc_weight,
@@ -87,7 +362,9 @@ def get_beam_search_decoder(model, token_list, rnnlm=None, rnnlm_conf=None, pena
         length_bonus=penalty,
     )
 
-    return BatchBeamSearch(
+    # the online beam search also decodes encoder output block by block
+    search_class = BatchBeamSearchOnline if streaming else BatchBeamSearch
+    return search_class(
         beam_size=beam_size,
         vocab_size=len(token_list),
         weights=weights,
@@ -96,4 +373,45 @@ def get_beam_search_decoder(model, token_list, rnnlm=None, rnnlm_conf=None, pena
         eos=eos,
         token_list=token_list,
         pre_beam_score_key=None if ctc_weight == 1.0 else "decoder",
+        score_beam=score_beam,
+        max_active=max_active,
+        pre_beam_threshold=pre_beam_threshold,
+        exact_stop=exact_stop,
     )
+
+
+def load_lm(token_list, rnnlm, rnnlm_conf):
+    lm_args = get_model_conf(rnnlm, rnnlm_conf)
+    lm_model_module = getattr(lm_args, "model_module", "default")
+    lm_class = dynamic_import_lm(lm_model_module, lm_args.backend)
+    lm = lm_class(len(token_list), lm_args)
+    torch_load(rnnlm, lm)
+    return lm.eval()
+
+
+def quantize_dynamic(module):
+    """Quantize the weights of the Linear and LSTM layers of a module to int8 in place.
+
+    Activations are quantized on the fly, which only runs on cpu.
+    """
+    return torch.quantization.quantize_dynamic(
+        module, {torch.nn.Linear, torch.nn.LSTM, torch.nn.LSTMCell, torch.nn.GRUCell}, dtype=torch.qint8, inplace=True
+    )
+
+
+def rescore_nbest(lm, lm_weight, nbest_hyps, nbest=10):
+    """Add weighted LM scores to the `nbest` best hypotheses and sort them again.
+
+    All the hypotheses are scored by one batched teacher-forced LM forward.
+    """
+    nbest_hyps = nbest_hyps[:nbest]
+    if len(nbest_hyps) == 0:
+        return nbest_hyps
+    ys = pad_sequence([h.yseq for h in nbest_hyps], batch_first=True, padding_value=0)
+    ylens = torch.tensor([len(h.yseq) for h in nbest_hyps])
+    lm_scores = lm.score_sequences(ys, ylens).tolist()
+    rescored = [
+        h._replace(score=float(h.score) + lm_weight * s, scores={**h.scores, "lm": s})
+        for h, s in zip(nbest_hyps, lm_scores)
+    ]
+    return sorted(rescored, key=lambda h: h.score, reverse=True)
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+import torch
+
+# samples of 16 kHz audio per 25 fps video frame
+AUDIO_RATE_RATIO = 640
+# dynamic time axes of the inputs of each modality
+INPUT_TIME_AXES = {
+    "video": {"x": {2: "frames"}},
+    "audio": {"x": {1: "samples"}},
+    "audiovisual": {"x": {2: "frames"}, "aux_x": {1: "samples"}},
+}
+
+
+class EncoderModule(torch.nn.Module):
+    """Batched `E2E.encode` of any modality, as exported to ONNX."""
+
+    def __init__(self, model):
+        super(EncoderModule, self).__init__()
+        self.model = model
+
+    def forward(self, x, aux_x=None):
+        feat, _ = self.model.encoder(x, None)
+        if aux_x is None:
+            return feat
+        aux_feat, _ = self.model.aux_encoder(aux_x, None)
+        return self.model.fusion(torch.cat((feat, aux_feat), dim=-1))
+
+
+def dummy_inputs(modality, n_frames):
+    """Return random unbatched inputs of `n_frames` video frames, as `AVSRDataLoader.load_data`."""
+    video = torch.randn(1, n_frames, 88, 88)
+    audio = torch.randn(n_frames * AUDIO_RATE_RATIO, 1)
+    if modality == "video":
+        return (video,)
+    if modality == "audio":
+        return (audio,)
+    return video, audio
+
+
+def export_encoder(model, modality, filename, n_frames=50, opset_version=14):
+    """Export the encoder of an E2E model to ONNX with a dynamic time axis.
+
+    :param torch.nn.Module model: E2E model
+    :param str modality: video, audio or audiovisual
+    :param str filename: the ONNX file
+    :param int n_frames: the number of video frames of the traced inputs
+    :param int opset_version: ONNX opset version
+    """
+    inputs = tuple(x.unsqueeze(0) for x in dummy_inputs(modality, n_frames))
+    time_axes = INPUT_TIME_AXES[modality]
+    with torch.no_grad():
+        torch.onnx.export(
+            EncoderModule(model).eval(),
+            inputs,
+            filename,
+            input_names=list(time_axes),
+            output_names=["enc_out"],
+            dynamic_axes={**time_axes, "enc_out": {1: "frames"}},
+            opset_version=opset_version,
+        )
+
+
+class OnnxEncoder:
+    """Run an encoder exported by `export_encoder` with onnxruntime on cpu."""
+
+    def __init__(self, filename, num_threads=0):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(filename, options, providers=["CPUExecutionProvider"])
+        self.input_names = [x.name for x in self.session.get_inputs()]
+
+    def __call__(self, *xs):
+        """Encode unbatched inputs as `E2E.encode` does, returns (T, D) features."""
+        feeds = {name: x.unsqueeze(0).cpu().numpy() for name, x in zip(self.input_names, xs)}
+        enc_out = self.session.run(["enc_out"], feeds)[0]
+        return torch.from_numpy(enc_out).squeeze(0)
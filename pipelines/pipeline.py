@@ -10,11 +10,12 @@ import pickle
 from configparser import ConfigParser
 
 from pipelines.model import AVSR
+from pipelines.feature_cache import FeatureCache
 from pipelines.data.data_module import AVSRDataLoader
 
 
 class InferencePipeline(torch.nn.Module):
-    def __init__(self, config_filename, detector="retinaface", face_track=False, device="cuda:0"):
+    def __init__(self, config_filename, detector="retinaface", face_track=False, device="cuda:0", feature_cache_dir=None, feature_cache_size_mb=10240, feature_cache_content_hash=False):
         super(InferencePipeline, self).__init__()
         assert os.path.isfile(config_filename), f"config_filename: {config_filename} does not exist."
 
@@ -32,6 +33,14 @@ class InferencePipeline(torch.nn.Module):
         # model configuration
         model_path = config.get("model","model_path")
         model_conf = config.get("model","model_conf")
+        # fp32, int8 for dynamic quantization of the Linear/LSTM layers on cpu,
+        # or bf16 to run the networks under bfloat16 autocast
+        precision = config.get("model", "precision", fallback="fp32")
+        # torch, or onnxruntime to run the encoder exported by tools/export_encoder_onnx.py
+        encoder_backend = config.get("model", "encoder_backend", fallback="torch")
+        encoder_onnx = config.get("model", "encoder_onnx", fallback=None)
+        # encoder self-attention by chunks of queries, bounds its memory on long clips
+        attention_query_chunk_size = config.getint("model", "attention_query_chunk_size", fallback=None)
 
         # language model configuration
         rnnlm = config.get("model", "rnnlm")
@@ -40,9 +49,38 @@ class InferencePipeline(torch.nn.Module):
         ctc_weight = config.getfloat("decode", "ctc_weight")
         lm_weight = config.getfloat("decode", "lm_weight")
         beam_size = config.getint("decode", "beam_size")
+        ctc_window_margin = config.getint("decode", "ctc_window_margin", fallback=0)
+        # beam pruning, disabled when not set
+        score_beam = config.getfloat("decode", "score_beam", fallback=None)
+        max_active = config.getint("decode", "max_active", fallback=None)
+        pre_beam_threshold = config.getfloat("decode", "pre_beam_threshold", fallback=None)
+        exact_stop = config.getboolean("decode", "exact_stop", fallback=False)
+        # two-pass decoding, the LM rescores the n-best of a first pass without LM
+        rescore_nbest = config.getint("decode", "rescore_nbest", fallback=0)
+        first_pass_beam_size = config.getint("decode", "first_pass_beam_size", fallback=None)
+        # draft decoding, the beam search starts after the verified greedy CTC tokens
+        ctc_draft = config.getboolean("decode", "ctc_draft", fallback=False)
+        # vocabulary shortlist, searched tokens must reach this CTC posterior in some frame
+        shortlist_threshold = config.getfloat("decode", "shortlist_threshold", fallback=None)
+        # static-shape beam search with a compiled decoder step
+        compile_step = config.getboolean("decode", "compile_step", fallback=False)
+        # online beam search, encoder output can be decoded block by block by AVSR.stream
+        streaming = config.getboolean("decode", "streaming", fallback=False)
+        # cascade decoding, greedy CTC is accepted above the confidence threshold
+        cascade_threshold = config.getfloat("decode", "cascade_threshold", fallback=None)
+        cascade_decoder_rescore = config.getboolean("decode", "cascade_decoder_rescore", fallback=False)
 
         self.dataloader = AVSRDataLoader(modality, speed_rate=input_v_fps/model_v_fps, detector=detector)
-        self.model = AVSR(modality, model_path, model_conf, rnnlm, rnnlm_conf, penalty, ctc_weight, lm_weight, beam_size, device)
+        self.model = AVSR(
+            modality, model_path, model_conf, rnnlm, rnnlm_conf, penalty, ctc_weight, lm_weight, beam_size, device,
+            ctc_window_margin=ctc_window_margin, score_beam=score_beam, max_active=max_active,
+            pre_beam_threshold=pre_beam_threshold, cascade_threshold=cascade_threshold,
+            cascade_decoder_rescore=cascade_decoder_rescore, exact_stop=exact_stop, rescore_nbest=rescore_nbest,
+            first_pass_beam_size=first_pass_beam_size, ctc_draft=ctc_draft,
+            shortlist_threshold=shortlist_threshold, compile_step=compile_step, precision=precision,
+            encoder_backend=encoder_backend, encoder_onnx=encoder_onnx, streaming=streaming,
+            attention_query_chunk_size=attention_query_chunk_size,
+        )
         if face_track and self.modality in ["video", "audiovisual"]:
             if detector == "mediapipe":
                 from pipelines.detectors.mediapipe.detector import LandmarksDetector
@@ -53,6 +91,16 @@ class InferencePipeline(torch.nn.Module):
         else:
             self.landmarks_detector = None
 
+        # encoder features cached on disk, keyed by the input, its landmarks and the model,
+        # the inputs are identified by path, size and mtime unless feature_cache_content_hash
+        self.feature_cache = None
+        if feature_cache_dir:
+            model_files = [model_path] + ([encoder_onnx] if encoder_backend == "onnxruntime" else [])
+            self.feature_cache = FeatureCache(
+                feature_cache_dir, feature_cache_size_mb, *model_files, content_hash=feature_cache_content_hash, modality=modality, speed_rate=input_v_fps/model_v_fps,
+                detector=detector, precision=precision, encoder_backend=encoder_backend,
+            )
+
 
     def process_landmarks(self, data_filename, landmarks_filename):
         if self.modality == "audio":
@@ -67,7 +115,42 @@ class InferencePipeline(torch.nn.Module):
 
     def forward(self, data_filename, landmarks_filename=None):
         assert os.path.isfile(data_filename), f"data_filename: {data_filename} does not exist."
+        if self.feature_cache is not None:
+            return self.model.decode(self.encode(data_filename, landmarks_filename))
         landmarks = self.process_landmarks(data_filename, landmarks_filename)
         data = self.dataloader.load_data(data_filename, landmarks)
         transcript = self.model.infer(data)
-        return transcript
\ No newline at end of file
+        return transcript
+
+
+    def forward_batch(self, data_filenames, landmarks_filenames=None):
+        """Transcribe several inputs with one padded encoder pass and one batched search."""
+        if landmarks_filenames is None:
+            landmarks_filenames = [None] * len(data_filenames)
+        if self.feature_cache is not None:
+            enc_feats = [self.encode(*filenames) for filenames in zip(data_filenames, landmarks_filenames)]
+        else:
+            data_list = []
+            for data_filename, landmarks_filename in zip(data_filenames, landmarks_filenames):
+                landmarks = self.process_landmarks(data_filename, landmarks_filename)
+                data_list.append(self.dataloader.load_data(data_filename, landmarks))
+            with torch.no_grad(), self.model.autocast():
+                enc_feats = self.model.encode_batch(data_list)
+        return self.model.decode_batch(enc_feats)
+
+
+    def encode(self, data_filename, landmarks_filename=None):
+        """Return the encoder features of an input, through the feature cache when it is set."""
+        key = None
+        if self.feature_cache is not None:
+            key = self.feature_cache.key(data_filename, landmarks_filename)
+            enc_feats = self.feature_cache.get(key, self.model.device)
+            if enc_feats is not None:
+                return enc_feats
+        landmarks = self.process_landmarks(data_filename, landmarks_filename)
+        data = self.dataloader.load_data(data_filename, landmarks)
+        with torch.no_grad(), self.model.autocast():
+            enc_feats = self.model.encode(data)
+        if key is not None:
+            enc_feats = self.feature_cache.put(key, enc_feats)
+        return enc_feats
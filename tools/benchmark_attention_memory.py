@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Peak memory and latency of the encoder self-attention across clip lengths.
+
+Random frontend features of each length are encoded by the conformer layers
+with full attention (`--query-chunk-sizes 0`, the default of the models) and
+with query-chunked attention, enabled by `attention_query_chunk_size` in the
+`[model]` section of the `.ini` config. The peak is the extra memory allocated by the forward pass on
+cuda, and the growth of the peak resident set size of a fresh process per
+measurement on cpu. For example, up to 5 minutes of video:
+
+    python -m tools.benchmark_attention_memory --config-filename configs/LRS3_V_WER19.1.ini \
+        --lengths 500 2000 7500 --query-chunk-sizes 0 256 64
+"""
+
+import argparse
+import multiprocessing
+import resource
+
+import torch
+
+from espnet.nets.pytorch_backend.transformer.attention import MultiHeadedAttention
+from pipelines.pipeline import InferencePipeline
+from tools.benchmark_utils import timed
+
+# model of a measurement process
+state = {}
+
+
+def set_attention(encoder, query_chunk_size, store_attn):
+    """Set the query chunk size (0 for full attention) of every attention module."""
+    encoder.set_query_chunk_size(query_chunk_size or None)
+    for module in encoder.modules():
+        if isinstance(module, MultiHeadedAttention):
+            module.store_attn = store_attn
+            module.attn = None
+
+
+def encode(encoder, n_frames, device):
+    """Encode random frontend features of `n_frames` frames, return the time in seconds."""
+    torch.manual_seed(0)
+    xs = torch.randn(1, n_frames, encoder.embed[0].in_features, device=device)
+    with torch.no_grad():
+        _, sec = timed(encoder.forward_backend, device, xs, None)
+    return sec
+
+
+def measure(config_filename, device, n_frames, query_chunk_size, store_attn):
+    """Return the peak extra memory in MB and the time in seconds of one encoder pass."""
+    if "encoder" not in state:
+        pipeline = InferencePipeline(config_filename, face_track=False, device=device)
+        state["encoder"] = pipeline.model.model.encoder
+    encoder = state["encoder"]
+    set_attention(encoder, query_chunk_size, store_attn)
+    if torch.device(device).type == "cuda":
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+        sec = encode(encoder, n_frames, device)
+        return (torch.cuda.max_memory_allocated(device) - base) / 2**20, sec
+    # ru_maxrss is in KB on linux
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sec = encode(encoder, n_frames, device)
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base) / 2**10, sec
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config-filename", required=True, help=".ini config")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[500, 2000, 7500])
+    parser.add_argument("--query-chunk-sizes", type=int, nargs="+", default=[0, 256, 64])
+    parser.add_argument("--store-attn", action="store_true", help="also keep the attention weights")
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    print(f"{'frames':>8}{'chunk':>7}{'peak MB':>10}{'ms':>10}")
+    for n_frames in args.lengths:
+        for query_chunk_size in args.query_chunk_sizes:
+            measure_args = (args.config_filename, args.device, n_frames, query_chunk_size, args.store_attn)
+            if torch.device(args.device).type == "cuda":
+                peak, sec = measure(*measure_args)
+            else:
+                # the peak resident set size of a process never decreases
+                with multiprocessing.get_context("spawn").Pool(1) as pool:
+                    peak, sec = pool.apply(measure, measure_args)
+            chunk = query_chunk_size or "full"
+            print(f"{n_frames:>8}{chunk:>7}{peak:>10.0f}{sec * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Equivalence and latency of the padded batched encoder against one clip per forward pass.
+
+Random clips of the given lengths are encoded one by one with `E2E.encode`
+and together with `E2E.encode_batch`. The command fails when a feature
+differs by more than `--atol`, e.g.
+
+    python -m tools.benchmark_batched_encode --config-filename configs/LRS3_V_WER19.1.ini \
+        --lengths 40 75 120 200 --device cpu
+"""
+
+import argparse
+import sys
+
+import torch
+
+from pipelines.onnx_encoder import dummy_inputs
+from pipelines.pipeline import InferencePipeline
+from tools.benchmark_utils import timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config-filename", required=True, help=".ini config")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[40, 75, 120, 200])
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    pipeline = InferencePipeline(args.config_filename, face_track=False, device=args.device)
+    model = pipeline.model
+    torch.manual_seed(0)
+    data_list = [dummy_inputs(pipeline.modality, n_frames) for n_frames in args.lengths]
+    if pipeline.modality != "audiovisual":
+        data_list = [data[0] for data in data_list]
+
+    with torch.no_grad():
+        refs, single_sec = timed(
+            lambda: [model.encode(data) for data in data_list], args.device
+        )
+        outs, batch_sec = timed(model.encode_batch, args.device, data_list)
+    diff = max(float((out - ref).abs().max()) for out, ref in zip(outs, refs))
+    print(f"{'clips':>6}{'max diff':>12}{'single ms':>11}{'batch ms':>10}{'speedup':>9}")
+    print(
+        f"{len(data_list):>6}{diff:>12.2e}{single_sec * 1000:>11.1f}"
+        f"{batch_sec * 1000:>10.1f}{single_sec / batch_sec:>8.2f}x"
+    )
+    if diff > args.atol:
+        print(f"the batched encoder differs from one clip per pass by more than {args.atol}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Validate the hypotheses of bf16 autocast decoding against fp32.
+
+The labelled subset is decoded with the fp32 model of the `.ini` config and
+again under bf16 autocast (as `precision = bf16` in `[model]` does). Besides
+the WER and latency of both, the bf16 hypotheses are scored against the fp32
+ones; the command fails when their WER exceeds `--max-hyp-wer`, e.g.
+
+    python -m tools.benchmark_bf16 --config-filename configs/LRS3_V_WER19.1.ini \
+        --data-dir ... --labels-filename ... --landmarks-dir ... --gpu-idx -1
+"""
+
+import argparse
+import sys
+
+import torch
+
+from tools.benchmark_int8 import decode
+from tools.benchmark_utils import add_pipeline_arguments
+from tools.benchmark_utils import build_pipeline
+from tools.benchmark_utils import error_rates
+from tools.benchmark_utils import load_subset
+from tools.benchmark_utils import read_subset
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_pipeline_arguments(parser)
+    parser.add_argument("--num-threads", type=int, default=None)
+    parser.add_argument("--max-hyp-wer", type=float, default=0.01, help="WER of bf16 against fp32 hypotheses")
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    pipeline = build_pipeline(args)
+    model = pipeline.model
+    subset = read_subset(args)
+    refs = [groundtruth for _, _, groundtruth in subset]
+    inputs = load_subset(pipeline, subset)
+
+    print(f"{'precision':<10}{'WER':>8}{'CER':>8}{'ms/utt':>10}{'speedup':>9}")
+    hyps, baseline = {}, None
+    for precision in ["fp32", "bf16"]:
+        model.precision = precision
+        hyps[precision], latency = decode(model, inputs)
+        wer, cer = error_rates(hyps[precision], refs)
+        baseline = baseline or latency
+        print(
+            f"{precision:<10}{wer * 100:>8.2f}{cer * 100:>8.2f}"
+            f"{latency * 1000:>10.1f}{baseline / latency:>8.2f}x"
+        )
+
+    hyp_wer, hyp_cer = error_rates(hyps["bf16"], hyps["fp32"])
+    n_same = sum(h == r for h, r in zip(hyps["bf16"], hyps["fp32"]))
+    print(f"bf16 against fp32: {n_same}/{len(inputs)} identical, WER {hyp_wer * 100:.2f}, CER {hyp_cer * 100:.2f}")
+    for (data_filename, _, _), h, r in zip(subset, hyps["bf16"], hyps["fp32"]):
+        if h != r:
+            print(f"  {data_filename}\n    fp32: {r}\n    bf16: {h}")
+    if hyp_wer > args.max_hyp_wer:
+        print(f"the bf16 hypotheses differ from fp32 by more than a WER of {args.max_hyp_wer}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
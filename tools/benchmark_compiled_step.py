@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Compile cost and steady-state speedup of the static-shape decoding step.
+
+Every utterance is encoded once, then decoded by the default beam search
+(`eager`), by the padded static-shape search (`static`) and by the same search
+with a decoder step compiled by `torch.compile` (`compiled`). The first
+utterance of a mode includes the compilation of the first length bucket and is
+reported apart, e.g.
+
+    python -m tools.benchmark_compiled_step --config-filename configs/LRS3_V_WER19.1.ini \
+        --data-dir ... --labels-filename ... --landmarks-dir ... --gpu-idx -1
+"""
+
+import argparse
+
+import torch
+
+from tools.benchmark_utils import add_pipeline_arguments
+from tools.benchmark_utils import build_pipeline
+from tools.benchmark_utils import error_rates
+from tools.benchmark_utils import load_subset
+from tools.benchmark_utils import read_subset
+from tools.benchmark_utils import timed
+
+MODES = ["eager", "static", "compiled"]
+
+
+def set_mode(beam_search, mode):
+    """Switch the beam search and its decoder to an eager, static or compiled step."""
+    decoder = beam_search.full_scorers["decoder"]
+    if mode == "eager":
+        beam_search.static_shapes = False
+        decoder.static_step = None
+    else:
+        beam_search.enable_static_step(compile=mode == "compiled")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_pipeline_arguments(parser)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args)
+    model = pipeline.model
+    subset = read_subset(args)
+    refs = [groundtruth for _, _, groundtruth in subset]
+    with torch.no_grad():
+        enc_feats = [model.encode(data) for data in load_subset(pipeline, subset)]
+
+    print(f"{'mode':<10}{'WER':>8}{'CER':>8}{'first ms':>10}{'ms/utt':>10}{'compile s':>11}{'speedup':>9}")
+    baseline = None
+    for mode in args.modes:
+        set_mode(model.beam_search, mode)
+        hyps, times = [], []
+        with torch.no_grad():
+            for feats in enc_feats:
+                nbest_hyps, sec = timed(model.beam_search, model.device, feats)
+                hyps.append(model.get_transcription(nbest_hyps))
+                times.append(sec)
+        wer, cer = error_rates(hyps, refs)
+        # steady state excludes the first utterance, longer utterances
+        # may still compile new length buckets
+        steady = sum(times[1:]) / max(len(times) - 1, 1)
+        baseline = baseline or steady
+        print(
+            f"{mode:<10}{wer * 100:>8.2f}{cer * 100:>8.2f}{times[0] * 1000:>10.1f}"
+            f"{steady * 1000:>10.1f}{max(times[0] - steady, 0.0):>11.2f}{baseline / steady:>8.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Microbenchmark of one CTCPrefixScoreTH step against the beam size.
+
+Random CTC posteriors are scored the way BatchBeamSearch does: every step
+scores the pre-beam candidates of all the hypotheses and keeps the `beam` best
+ones. Run from the repository root:
+
+    python -m tools.benchmark_ctc_prefix_score --beam-sizes 10 20 40 60
+"""
+
+import argparse
+import time
+
+import torch
+
+from espnet.nets.ctc_prefix_score import CTCPrefixScoreTH
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def benchmark_step(n_frames, n_vocab, beam, pre_beam, n_steps, device):
+    """Return the average time of one scoring step in seconds.
+
+    :param int pre_beam: the number of scored labels per hypothesis,
+        0 scores the full vocabulary
+    """
+    blank, eos = 0, n_vocab - 1
+    x = torch.randn(1, n_frames, n_vocab, device=device).log_softmax(dim=-1)
+    impl = CTCPrefixScoreTH(x, torch.tensor([n_frames]), blank, eos)
+    y = torch.full((1, 1), eos, dtype=torch.int64, device=device)
+    state = None
+    elapsed = 0.0
+    for step in range(n_steps):
+        n_bh = y.size(0)
+        scoring_ids = None
+        if pre_beam > 0:
+            scores = torch.randn(n_bh, n_vocab, device=device)
+            scoring_ids = scores.topk(pre_beam, dim=-1)[1]
+        synchronize(device)
+        start = time.perf_counter()
+        local_scores, ctc_state = impl(y, state, scoring_ids)
+        synchronize(device)
+        # the first step scores a single hypothesis, skip it in the average
+        if step > 0:
+            elapsed += time.perf_counter() - start
+        # keep the best hypotheses as the beam search does
+        local_scores[:, eos] = impl.logzero
+        top_ids = local_scores.view(1, -1).topk(beam, dim=-1)[1]
+        prev_ids = torch.div(top_ids, n_vocab, rounding_mode="trunc").view(-1)
+        new_ids = (top_ids % n_vocab).view(-1)
+        state = impl.index_select_state(ctc_state, top_ids)
+        y = torch.cat([y[prev_ids], new_ids.unsqueeze(1)], dim=1)
+    return elapsed / max(n_steps - 1, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--beam-sizes", type=int, nargs="+", default=[10, 20, 40, 60])
+    parser.add_argument(
+        "--pre-beam-ratios",
+        type=float,
+        nargs="+",
+        default=[1.5, 3.0, 0.0],
+        help="pre-beam width as a multiple of the beam size, 0 for full vocabulary",
+    )
+    parser.add_argument("--n-frames", type=int, default=150)
+    parser.add_argument("--n-vocab", type=int, default=5049)
+    parser.add_argument("--n-steps", type=int, default=30)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+    print(f"{'beam':>6}{'pre-beam':>10}{'ms/step':>10}")
+    for beam in args.beam_sizes:
+        for ratio in args.pre_beam_ratios:
+            pre_beam = min(int(ratio * beam), args.n_vocab)
+            with torch.no_grad():
+                sec = benchmark_step(
+                    args.n_frames, args.n_vocab, beam, pre_beam, args.n_steps, device
+                )
+            width = pre_beam if pre_beam > 0 else "full"
+            print(f"{beam:>6}{width:>10}{sec * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
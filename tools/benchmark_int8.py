@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""WER delta, speedup and model size of int8 dynamic quantization on cpu.
+
+The fp32 model of the `.ini` config decodes the labelled subset, then its
+Linear/LSTM layers are quantized in place (as `precision = int8` in `[model]`
+does at load time) and the subset is decoded again. Run it once per benchmark
+config, e.g.
+
+    python -m tools.benchmark_int8 --config-filename configs/LRS3_V_WER19.1.ini \
+        --data-dir ... --labels-filename ... --landmarks-dir ...
+"""
+
+import argparse
+import io
+
+import torch
+
+from pipelines.model import quantize_dynamic
+from tools.benchmark_utils import add_pipeline_arguments
+from tools.benchmark_utils import build_pipeline
+from tools.benchmark_utils import error_rates
+from tools.benchmark_utils import load_subset
+from tools.benchmark_utils import read_subset
+from tools.benchmark_utils import timed
+
+
+def model_size(model):
+    """Return the size of the serialized weights of the AVSR model in MB."""
+    modules = [model.model, model.beam_search] + ([model.lm] if model.lm is not None else [])
+    buffer = io.BytesIO()
+    # the decoder and ctc of the beam search are shared with the E2E model
+    torch.save([m.state_dict() for m in modules], buffer)
+    return buffer.getbuffer().nbytes / 2**20
+
+
+def decode(model, inputs):
+    """Return the transcriptions and the average encode + decode time in seconds."""
+    hyps, elapsed = [], 0.0
+    for data in inputs:
+        transcription, sec = timed(model.infer, model.device, data)
+        hyps.append(transcription)
+        elapsed += sec
+    return hyps, elapsed / max(len(inputs), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_pipeline_arguments(parser)
+    parser.add_argument("--num-threads", type=int, default=None)
+    args = parser.parse_args()
+    # dynamic quantization only runs on cpu
+    args.gpu_idx = -1
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    pipeline = build_pipeline(args)
+    model = pipeline.model
+    subset = read_subset(args)
+    refs = [groundtruth for _, _, groundtruth in subset]
+    inputs = load_subset(pipeline, subset)
+
+    print(f"{'precision':<10}{'WER':>8}{'CER':>8}{'ms/utt':>10}{'MB':>9}{'speedup':>9}")
+    wers, baseline = {}, None
+    for precision in ["fp32", "int8"]:
+        if precision == "int8":
+            quantize_dynamic(model.model)
+            quantize_dynamic(model.beam_search)
+            if model.lm is not None:
+                quantize_dynamic(model.lm)
+        hyps, latency = decode(model, inputs)
+        wers[precision], cer = error_rates(hyps, refs)
+        baseline = baseline or latency
+        print(
+            f"{precision:<10}{wers[precision] * 100:>8.2f}{cer * 100:>8.2f}"
+            f"{latency * 1000:>10.1f}{model_size(model):>9.1f}{baseline / latency:>8.2f}x"
+        )
+    print(f"WER delta: {(wers['int8'] - wers['fp32']) * 100:+.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Equivalence and cpu latency of the ONNX encoder against pytorch across clip lengths.
+
+Random clips of each length are encoded by the pytorch encoder and by the file
+of `tools/export_encoder_onnx.py` through onnxruntime. The command fails when
+an output differs by more than `--atol`, e.g.
+
+    python -m tools.benchmark_onnx_encoder --config-filename configs/LRS3_V_WER19.1.ini \
+        --onnx encoder.onnx --lengths 25 50 100 200 400
+"""
+
+import argparse
+import sys
+
+import torch
+
+from pipelines.onnx_encoder import OnnxEncoder
+from pipelines.onnx_encoder import dummy_inputs
+from pipelines.pipeline import InferencePipeline
+from tools.benchmark_utils import timed
+
+
+def median_time(fn, *xs, n_runs=5):
+    """Return the output of `fn` and its median time over `n_runs` in seconds."""
+    times = []
+    for _ in range(n_runs):
+        out, sec = timed(fn, "cpu", *xs)
+        times.append(sec)
+    return out, sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config-filename", required=True, help=".ini config")
+    parser.add_argument("--onnx", required=True, help="exported encoder")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[25, 50, 100, 200, 400])
+    parser.add_argument("--n-runs", type=int, default=5)
+    parser.add_argument("--num-threads", type=int, default=0)
+    parser.add_argument("--atol", type=float, default=1e-3)
+    args = parser.parse_args()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+
+    pipeline = InferencePipeline(args.config_filename, face_track=False, device="cpu")
+    model = pipeline.model.model
+    onnx_encoder = OnnxEncoder(args.onnx, args.num_threads)
+    torch.manual_seed(0)
+
+    print(f"{'frames':>8}{'max diff':>12}{'torch ms':>10}{'ort ms':>10}{'speedup':>9}")
+    passed = True
+    for n_frames in args.lengths:
+        xs = dummy_inputs(pipeline.modality, n_frames)
+        with torch.no_grad():
+            ref, torch_sec = median_time(model.encode, *xs, n_runs=args.n_runs)
+        out, ort_sec = median_time(onnx_encoder, *xs, n_runs=args.n_runs)
+        diff = float((out - ref).abs().max())
+        passed &= diff <= args.atol
+        print(
+            f"{n_frames:>8}{diff:>12.2e}{torch_sec * 1000:>10.1f}"
+            f"{ort_sec * 1000:>10.1f}{torch_sec / ort_sec:>8.2f}x"
+        )
+    if not passed:
+        print(f"the ONNX encoder differs from pytorch by more than {args.atol}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
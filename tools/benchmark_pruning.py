@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""WER/latency trade-off of the beam pruning options on a labelled subset.
+
+Every utterance is encoded once, then decoded with each pruning setting.
+A setting is a comma separated list of `score_beam`, `max_active` and
+`pre_beam_threshold` values, `none` decodes without pruning:
+
+    python -m tools.benchmark_pruning --config-filename configs/LRS3_V_WER19.1.ini \
+        --data-dir ... --labels-filename ... --landmarks-dir ... \
+        --settings none score_beam=10 score_beam=10,max_active=10,pre_beam_threshold=5
+"""
+
+import argparse
+
+import torch
+
+from tools.benchmark_utils import add_pipeline_arguments
+from tools.benchmark_utils import build_pipeline
+from tools.benchmark_utils import error_rates
+from tools.benchmark_utils import load_subset
+from tools.benchmark_utils import read_subset
+from tools.benchmark_utils import timed
+
+PRUNING_OPTIONS = {"score_beam": float, "max_active": int, "pre_beam_threshold": float}
+
+
+def parse_setting(setting):
+    """Parse `key=value,...` into pruning options, unset ones are None."""
+    options = dict.fromkeys(PRUNING_OPTIONS)
+    if setting != "none":
+        for item in setting.split(","):
+            key, value = item.split("=")
+            options[key] = PRUNING_OPTIONS[key](value)
+    return options
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_pipeline_arguments(parser)
+    parser.add_argument("--settings", nargs="+", default=["none"])
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args)
+    model = pipeline.model
+    subset = read_subset(args)
+    refs = [groundtruth for _, _, groundtruth in subset]
+    with torch.no_grad():
+        enc_feats = [model.encode(data) for data in load_subset(pipeline, subset)]
+
+    print(f"{'setting':<50}{'WER':>8}{'CER':>8}{'ms/utt':>10}{'speedup':>9}")
+    baseline = None
+    for setting in args.settings:
+        for key, value in parse_setting(setting).items():
+            setattr(model.beam_search, key, value)
+        hyps, elapsed = [], 0.0
+        with torch.no_grad():
+            for feats in enc_feats:
+                nbest_hyps, sec = timed(model.beam_search, model.device, feats)
+                hyps.append(model.get_transcription(nbest_hyps))
+                elapsed += sec
+        wer, cer = error_rates(hyps, refs)
+        latency = elapsed / max(len(enc_feats), 1)
+        baseline = baseline or latency
+        print(
+            f"{setting:<50}{wer * 100:>8.2f}{cer * 100:>8.2f}"
+            f"{latency * 1000:>10.1f}{baseline / latency:>8.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""WER and partial-transcript stability of block-wise streaming decoding.
+
+The encoder output of every utterance is decoded offline, then fed block by
+block to the online beam search (`streaming` decode option). For each block
+size, the command reports the WER, the time per block and the share of the
+final words that were already stable before the final block, e.g.
+
+    python -m tools.benchmark_streaming --config-filename configs/LRS3_V_WER19.1.ini \
+        --data-dir ... --labels-filename ... --landmarks-dir ... --block-frames 8 16 32
+"""
+
+import argparse
+
+import torch
+
+from tools.benchmark_utils import add_pipeline_arguments
+from tools.benchmark_utils import build_pipeline
+from tools.benchmark_utils import error_rates
+from tools.benchmark_utils import load_subset
+from tools.benchmark_utils import read_subset
+from tools.benchmark_utils import timed
+
+
+def stream(model, feats, block_frames):
+    """Return the final transcription, the last partial one and the time per block."""
+    partial, elapsed, n_blocks = "", 0.0, 0
+    for start in range(0, len(feats), block_frames):
+        is_final = start + block_frames >= len(feats)
+        transcription, sec = timed(model.stream, model.device, feats[start : start + block_frames], is_final)
+        elapsed += sec
+        n_blocks += 1
+        if not is_final:
+            partial = transcription
+    return transcription, partial, elapsed / n_blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_pipeline_arguments(parser)
+    parser.add_argument("--block-frames", type=int, nargs="+", default=[8, 16, 32])
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args)
+    model = pipeline.model
+    # rebuild the beam search of the config as an online one
+    model.search_options["streaming"] = True
+    model.set_decode_params(**model.decode_params)
+    subset = read_subset(args)
+    refs = [groundtruth for _, _, groundtruth in subset]
+    with torch.no_grad():
+        enc_feats = [model.encode(data) for data in load_subset(pipeline, subset)]
+
+    print(f"{'blocks':<10}{'WER':>8}{'CER':>8}{'ms/block':>10}{'stable':>9}")
+    hyps = [model.decode(feats) for feats in enc_feats]
+    wer, cer = error_rates(hyps, refs)
+    print(f"{'offline':<10}{wer * 100:>8.2f}{cer * 100:>8.2f}{'':>10}{'':>9}")
+    for block_frames in args.block_frames:
+        hyps, n_stable, n_words, elapsed = [], 0, 0, 0.0
+        for feats in enc_feats:
+            hyp, partial, sec = stream(model, feats, block_frames)
+            hyps.append(hyp)
+            n_stable += len(partial.split())
+            n_words += len(hyp.split())
+            elapsed += sec
+        wer, cer = error_rates(hyps, refs)
+        latency = elapsed / max(len(enc_feats), 1)
+        print(
+            f"{block_frames:<10}{wer * 100:>8.2f}{cer * 100:>8.2f}"
+            f"{latency * 1000:>10.1f}{n_stable / max(n_words, 1) * 100:>8.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    main()
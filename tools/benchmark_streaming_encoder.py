@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Equivalence and latency of the chunk-wise streaming encoder across chunk sizes.
+
+Random clips are encoded chunk by chunk with `Encoder.forward_chunk` and
+offline with `Encoder.forward` under the same chunk masking. The command
+fails when an output differs by more than `--atol`, e.g.
+
+    python -m tools.benchmark_streaming_encoder --config-filename configs/LRS3_V_WER19.1.ini \
+        --chunk-sizes 4 8 16 --left-chunks 4 --n-frames 200
+"""
+
+import argparse
+import sys
+
+import torch
+
+from pipelines.onnx_encoder import dummy_inputs
+from pipelines.pipeline import InferencePipeline
+from tools.benchmark_utils import timed
+
+
+def stream(encoder, feats, chunk_size, left_chunks, device):
+    """Encode frontend features (1, T, D) chunk by chunk, return the output and chunk times."""
+    cache, outputs, times = None, [], []
+    for start in range(0, feats.size(1), chunk_size):
+        (out, cache), sec = timed(
+            encoder.forward_chunk,
+            device,
+            feats[:, start : start + chunk_size],
+            chunk_size,
+            left_chunks,
+            cache,
+        )
+        outputs.append(out)
+        times.append(sec)
+    return torch.cat(outputs, dim=1), times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config-filename", required=True, help=".ini config")
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--left-chunks", type=int, default=4, help="-1 for all")
+    parser.add_argument("--n-frames", type=int, default=200)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    pipeline = InferencePipeline(args.config_filename, face_track=False, device=args.device)
+    model = pipeline.model.model
+    # the video encoder, or the audio one for audio-only models
+    encoder = model.encoder
+    torch.manual_seed(0)
+    x = dummy_inputs(pipeline.modality, args.n_frames)[0].unsqueeze(0).to(args.device)
+
+    with torch.no_grad():
+        feats = encoder(x, None, extract_resnet_feats=True)
+        _, offline_sec = timed(encoder, args.device, x, None)
+        print(f"offline encoder: {offline_sec * 1000:.1f} ms for {feats.size(1)} frames")
+        print(f"{'chunk':>6}{'max diff':>12}{'mean ms':>10}{'max ms':>10}")
+        passed = True
+        for chunk_size in args.chunk_sizes:
+            ref, _ = encoder(x, None, chunk_size=chunk_size, left_chunks=args.left_chunks)
+            out, times = stream(encoder, feats, chunk_size, args.left_chunks, args.device)
+            diff = float((out - ref).abs().max())
+            passed &= diff <= args.atol
+            print(
+                f"{chunk_size:>6}{diff:>12.2e}{sum(times) / len(times) * 1000:>10.1f}"
+                f"{max(times) * 1000:>10.1f}"
+            )
+    if not passed:
+        print(f"the streaming encoder differs from the masked offline one by more than {args.atol}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
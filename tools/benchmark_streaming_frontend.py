@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Equivalence and latency of the incremental video frontend across frame group sizes.
+
+A random clip is fed to `Conv3dResNetStream` a few frames at a time, as from
+a camera, and its features are compared to the offline `Conv3dResNet`. The
+command fails when a feature differs by more than `--atol`, e.g.
+
+    python -m tools.benchmark_streaming_frontend --config-filename configs/LRS3_V_WER19.1.ini \
+        --group-sizes 1 2 5 --n-frames 100
+"""
+
+import argparse
+import sys
+
+import torch
+
+from espnet.nets.pytorch_backend.backbones.conv3d_extractor import Conv3dResNet
+from espnet.nets.pytorch_backend.backbones.conv3d_extractor import Conv3dResNetStream
+from pipelines.onnx_encoder import dummy_inputs
+from pipelines.pipeline import InferencePipeline
+from tools.benchmark_utils import timed
+
+
+def stream(frontend, x, group_size, device):
+    """Feed a clip (1, 1, T, H, W) by groups of frames, return the features and group times."""
+    outputs, times = [], []
+    n_frames = x.size(2)
+    for start in range(0, n_frames, group_size):
+        end = min(start + group_size, n_frames)
+        out, sec = timed(
+            frontend.forward_frames, device, x[:, :, start:end], is_final=end == n_frames
+        )
+        outputs.append(out)
+        times.append(sec)
+    return torch.cat(outputs, dim=1), times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config-filename", required=True, help=".ini config")
+    parser.add_argument("--group-sizes", type=int, nargs="+", default=[1, 2, 5])
+    parser.add_argument("--n-frames", type=int, default=100)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    pipeline = InferencePipeline(args.config_filename, face_track=False, device=args.device)
+    frontend = pipeline.model.model.encoder.frontend
+    if not isinstance(frontend, Conv3dResNet):
+        sys.exit("the incremental frontend needs a video encoder")
+    torch.manual_seed(0)
+    x = dummy_inputs("video", args.n_frames)[0].unsqueeze(0).to(args.device)
+
+    with torch.no_grad():
+        ref, offline_sec = timed(frontend, args.device, x)
+        print(f"offline frontend: {offline_sec * 1000:.1f} ms for {args.n_frames} frames")
+        print(f"{'group':>6}{'max diff':>12}{'ms/frame':>10}{'max ms':>10}")
+        passed = True
+        for group_size in args.group_sizes:
+            out, times = stream(Conv3dResNetStream(frontend), x, group_size, args.device)
+            diff = float((out - ref).abs().max())
+            passed &= out.shape == ref.shape and diff <= args.atol
+            print(
+                f"{group_size:>6}{diff:>12.2e}{sum(times) / args.n_frames * 1000:>10.2f}"
+                f"{max(times) * 1000:>10.1f}"
+            )
+    if not passed:
+        print(f"the incremental frontend differs from the offline one by more than {args.atol}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
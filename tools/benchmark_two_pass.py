@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""WER/latency of two-pass LM rescoring against single-pass shallow fusion.
+
+The single pass is the LM-fused beam search of the `.ini` config. The two-pass
+decoder runs a smaller beam search without LM, then rescores its n-best with
+one batched teacher-forced forward of the same LM, e.g.
+
+    python -m tools.benchmark_two_pass --config-filename configs/LRS3_V_WER19.1.ini \
+        --data-dir ... --labels-filename ... --landmarks-dir ... \
+        --first-pass-beam-sizes 10 20 --nbest 10
+    python -m tools.benchmark_two_pass --config-filename configs/CMLR_V_WER8.0.ini ...
+"""
+
+import argparse
+
+import torch
+
+from pipelines.model import get_beam_search_decoder
+from pipelines.model import rescore_nbest
+from tools.benchmark_utils import add_pipeline_arguments
+from tools.benchmark_utils import build_pipeline
+from tools.benchmark_utils import error_rates
+from tools.benchmark_utils import load_subset
+from tools.benchmark_utils import read_subset
+from tools.benchmark_utils import timed
+
+
+def decode(fn, model, enc_feats):
+    """Return the transcriptions of `fn` and its average latency in seconds."""
+    hyps, elapsed = [], 0.0
+    with torch.no_grad():
+        for feats in enc_feats:
+            nbest_hyps, sec = timed(fn, model.device, feats)
+            hyps.append(model.get_transcription(nbest_hyps))
+            elapsed += sec
+    return hyps, elapsed / max(len(enc_feats), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_pipeline_arguments(parser)
+    parser.add_argument("--first-pass-beam-sizes", type=int, nargs="+", default=[10])
+    parser.add_argument("--nbest", type=int, default=10)
+    args = parser.parse_args()
+
+    pipeline = build_pipeline(args)
+    model = pipeline.model
+    single_pass = model.beam_search
+    lm = single_pass.full_scorers.get("lm")
+    if lm is None:
+        raise ValueError(f"{args.config_filename} decodes without a language model")
+    weights = single_pass.weights
+    subset = read_subset(args)
+    refs = [groundtruth for _, _, groundtruth in subset]
+    with torch.no_grad():
+        enc_feats = [model.encode(data) for data in load_subset(pipeline, subset)]
+
+    print(f"{'decoder':<30}{'WER':>8}{'CER':>8}{'ms/utt':>10}{'speedup':>9}")
+    hyps, baseline = decode(single_pass, model, enc_feats)
+    wer, cer = error_rates(hyps, refs)
+    name = f"fusion beam={single_pass.beam_size}"
+    print(f"{name:<30}{wer * 100:>8.2f}{cer * 100:>8.2f}{baseline * 1000:>10.1f}{1:>8.2f}x")
+
+    for beam_size in args.first_pass_beam_sizes:
+        first_pass = get_beam_search_decoder(
+            model.model,
+            model.token_list,
+            penalty=weights.get("length_bonus", 0.0),
+            ctc_weight=weights.get("ctc", 0.0),
+            lm_weight=0.0,
+            beam_size=beam_size,
+        )
+        first_pass.to(device=model.device).eval()
+
+        def two_pass(feats):
+            nbest_hyps = first_pass(feats)
+            return rescore_nbest(lm, weights["lm"], nbest_hyps, args.nbest)
+
+        hyps, latency = decode(two_pass, model, enc_feats)
+        wer, cer = error_rates(hyps, refs)
+        name = f"two-pass beam={beam_size} n={args.nbest}"
+        print(
+            f"{name:<30}{wer * 100:>8.2f}{cer * 100:>8.2f}"
+            f"{latency * 1000:>10.1f}{baseline / latency:>8.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Shared helpers of the decoding benchmarks on a labelled subset."""
+
+import os
+import time
+
+import torch
+
+from pipelines.metrics.measures import get_cer
+from pipelines.metrics.measures import get_wer
+from pipelines.pipeline import InferencePipeline
+
+
+def add_pipeline_arguments(parser):
+    """Add the arguments selecting the model and the labelled subset."""
+    parser.add_argument("--config-filename", required=True, help=".ini config")
+    parser.add_argument("--data-dir", required=True)
+    parser.add_argument("--labels-filename", required=True)
+    parser.add_argument("--landmarks-dir", default=None)
+    parser.add_argument("--data-ext", default=".mp4")
+    parser.add_argument("--landmarks-ext", default=".pkl")
+    parser.add_argument("--detector", default="retinaface")
+    parser.add_argument("--num-utts", type=int, default=100)
+    parser.add_argument("--gpu-idx", type=int, default=0)
+    return parser
+
+
+def build_pipeline(args):
+    """Build the InferencePipeline of the parsed arguments."""
+    if torch.cuda.is_available() and args.gpu_idx >= 0:
+        device = torch.device(f"cuda:{args.gpu_idx}")
+    else:
+        device = "cpu"
+    return InferencePipeline(
+        config_filename=args.config_filename,
+        detector=args.detector,
+        face_track=not args.landmarks_dir,
+        device=device,
+    )
+
+
+def read_subset(args):
+    """Return `(data_filename, landmarks_filename, groundtruth)` of the subset."""
+    lines = open(args.labels_filename).read().splitlines()[: args.num_utts]
+    subset = []
+    for line in lines:
+        basename, groundtruth = line.split()[0], " ".join(line.split()[1:])
+        data_filename = os.path.join(args.data_dir, f"{basename}{args.data_ext}")
+        landmarks_filename = (
+            os.path.join(args.landmarks_dir, f"{basename}{args.landmarks_ext}")
+            if args.landmarks_dir
+            else None
+        )
+        subset.append((data_filename, landmarks_filename, groundtruth))
+    return subset
+
+
+def load_subset(pipeline, subset):
+    """Load the pre-processed inputs of the subset, excluded from the timings."""
+    inputs = []
+    for data_filename, landmarks_filename, _ in subset:
+        landmarks = pipeline.process_landmarks(data_filename, landmarks_filename)
+        inputs.append(pipeline.dataloader.load_data(data_filename, landmarks))
+    return inputs
+
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def timed(fn, device, *args, **kwargs):
+    """Run `fn` and return its output and wall-clock time in seconds."""
+    synchronize(device)
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    synchronize(device)
+    return out, time.perf_counter() - start
+
+
+def error_rates(hyps, refs):
+    """Return the corpus WER and CER of the transcriptions."""
+    n_words = sum(len(ref.split()) for ref in refs)
+    n_chars = sum(len(ref.replace(" ", "")) for ref in refs)
+    wer = sum(get_wer(h, r) * len(r.split()) for h, r in zip(hyps, refs))
+    cer = sum(get_cer(h, r) * len(r.replace(" ", "")) for h, r in zip(hyps, refs))
+    return wer / max(n_words, 1), cer / max(n_chars, 1)
@@ -0,0 +1,189 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Equivalence check of the batch beam search and CTC prefix scoring on a tiny random model.
+
+A randomly initialized transformer decoder and CTC layer decode random encoder
+features with the per-hypothesis `BeamSearch`, whose CTC scorer runs the numpy
+`CTCPrefixScore` label by label, and with `BatchBeamSearch` on one utterance,
+on padded utterances (`batch_forward`) and with static shapes. Their n-best
+token sequences must be identical and their scores equal up to `--atol`.
+The CTC prefix scores of `CTCPrefixScoreTH` along random beams of padded
+utterances are also checked against `CTCPrefixScore` for every hypothesis.
+Run from the repository root, it exits with 1 on any mismatch:
+
+    python -m tools.check_search_equivalence --beam-sizes 1 4 10 --n-utts 3
+"""
+
+import argparse
+import copy
+import sys
+
+import numpy as np
+import torch
+
+from espnet.nets.batch_beam_search import BatchBeamSearch
+from espnet.nets.beam_search import BeamSearch
+from espnet.nets.ctc_prefix_score import CTCPrefixScore
+from espnet.nets.ctc_prefix_score import CTCPrefixScoreTH
+from espnet.nets.pytorch_backend.ctc import CTC
+from espnet.nets.pytorch_backend.transformer.decoder import Decoder
+from espnet.nets.scorers.ctc import CTCPrefixScorer
+from espnet.nets.scorers.length_bonus import LengthBonus
+
+
+def build_search(search_class, decoder, ctc, n_vocab, beam, ctc_weight, penalty):
+    eos = n_vocab - 1
+    scorers = dict(
+        decoder=decoder,
+        ctc=CTCPrefixScorer(ctc, eos),
+        length_bonus=LengthBonus(n_vocab),
+    )
+    weights = dict(decoder=1.0 - ctc_weight, ctc=ctc_weight, length_bonus=penalty)
+    return search_class(
+        scorers=scorers,
+        weights=weights,
+        beam_size=beam,
+        vocab_size=n_vocab,
+        sos=eos,
+        eos=eos,
+        pre_beam_score_key=None if ctc_weight == 1.0 else "decoder",
+    )
+
+
+def compare_nbest(name, ref, hyps, atol):
+    """Return the number of mismatches between two n-best lists."""
+    n_errors = 0
+    if len(ref) != len(hyps):
+        print(f"{name}: {len(hyps)} hypotheses instead of {len(ref)}")
+        return 1
+    for rank, (r, h) in enumerate(zip(ref, hyps)):
+        if r.yseq.tolist() != h.yseq.tolist():
+            print(f"{name}: rank {rank} yseq {h.yseq.tolist()} != {r.yseq.tolist()}")
+            n_errors += 1
+        elif abs(float(r.score) - float(h.score)) > atol:
+            print(f"{name}: rank {rank} score {float(h.score):.6f} != {float(r.score):.6f}")
+            n_errors += 1
+    return n_errors
+
+
+def check_search(decoder, ctc, xs, xlens, beam, args):
+    """Compare the n-best of the batch beam searches with `BeamSearch`."""
+    search_args = (decoder, ctc, args.n_vocab, beam, args.ctc_weight, args.penalty)
+    reference = build_search(BeamSearch, *search_args).eval()
+    batch = build_search(BatchBeamSearch, *search_args).eval()
+    # the static step is enabled on a copy, the decoder is shared by the other searches
+    static = build_search(BatchBeamSearch, copy.deepcopy(decoder), *search_args[1:]).eval()
+    static.enable_static_step(compile=False)
+
+    n_errors = 0
+    refs = [reference(xs[i, : xlens[i]], args.maxlenratio) for i in range(len(xs))]
+    for i, ref in enumerate(refs):
+        n_errors += compare_nbest(
+            f"beam {beam} utt {i} forward", ref, batch(xs[i, : xlens[i]], args.maxlenratio), args.atol
+        )
+        n_errors += compare_nbest(
+            f"beam {beam} utt {i} static", ref, static(xs[i, : xlens[i]], args.maxlenratio), args.atol
+        )
+    for i, (ref, hyps) in enumerate(zip(refs, batch.batch_forward(xs, xlens, args.maxlenratio))):
+        n_errors += compare_nbest(f"beam {beam} utt {i} batch_forward", ref, hyps, args.atol)
+    return n_errors
+
+
+def reference_log_psi(impl, y, cs):
+    """Return the prefix scores of `y + [c]` for the labels `cs` with `CTCPrefixScore`."""
+    r = impl.initial_state()
+    for k in range(1, len(y)):
+        _, states = impl(y[:k], np.array([y[k]]), r)
+        r = states[0]
+    return impl(y, cs, r)[0]
+
+
+def check_ctc(logp, xlens, beam, pre_beam, n_steps, atol):
+    """Compare `CTCPrefixScoreTH` along random beams with `CTCPrefixScore`."""
+    n_utts, _, n_vocab = logp.shape
+    blank, eos = 0, n_vocab - 1
+    impl = CTCPrefixScoreTH(logp, xlens, blank, eos)
+    refs = [CTCPrefixScore(logp[i, : xlens[i]].numpy(), blank, eos, np) for i in range(n_utts)]
+    y = torch.full((n_utts, 1), eos, dtype=torch.int64)
+    state = None
+    n_errors = 0
+    for step in range(n_steps):
+        n_hyps = y.size(0) // n_utts
+        scoring_ids = None
+        if pre_beam > 0:
+            scoring_ids = torch.randn(y.size(0), n_vocab).topk(pre_beam, dim=-1)[1]
+        local_scores, ctc_state = impl(y, state, scoring_ids)
+        log_psi = ctc_state[1]
+        for j in range(y.size(0)):
+            cs = np.arange(n_vocab) if scoring_ids is None else scoring_ids[j].numpy()
+            ref = reference_log_psi(refs[j // n_hyps], y[j].tolist(), cs)
+            err = np.abs(log_psi[j, torch.as_tensor(cs)].numpy() - ref).max()
+            if err > atol:
+                print(f"ctc beam {beam} pre-beam {pre_beam} step {step} hyp {j}: max error {err:.6f}")
+                n_errors += 1
+        # keep random hypotheses among the scored ones as the beam search does
+        noise = torch.rand_like(local_scores).log()
+        local_scores = (local_scores + noise).masked_fill(local_scores <= impl.logzero / 2, impl.logzero)
+        local_scores[:, eos] = impl.logzero
+        top_ids = local_scores.view(n_utts, -1).topk(beam, dim=-1)[1]
+        prev_ids = (
+            torch.div(top_ids, n_vocab, rounding_mode="trunc")
+            + torch.arange(n_utts).view(-1, 1) * n_hyps
+        ).view(-1)
+        new_ids = (top_ids % n_vocab).view(-1)
+        state = impl.index_select_state(ctc_state, top_ids)
+        y = torch.cat([y[prev_ids], new_ids.unsqueeze(1)], dim=1)
+    return n_errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--beam-sizes", type=int, nargs="+", default=[1, 4, 10])
+    parser.add_argument("--n-utts", type=int, default=3, help="padded utterances of batch_forward")
+    parser.add_argument("--n-frames", type=int, default=30, help="frames of the longest utterance")
+    parser.add_argument("--n-vocab", type=int, default=20)
+    parser.add_argument("--adim", type=int, default=32)
+    parser.add_argument("--ctc-weight", type=float, default=0.3)
+    parser.add_argument("--penalty", type=float, default=0.5)
+    parser.add_argument("--maxlenratio", type=float, default=0.0)
+    parser.add_argument("--ctc-steps", type=int, default=8)
+    parser.add_argument("--atol", type=float, default=1e-3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    decoder = Decoder(
+        args.n_vocab,
+        attention_dim=args.adim,
+        attention_heads=2,
+        linear_units=2 * args.adim,
+        num_blocks=2,
+        dropout_rate=0.0,
+        positional_dropout_rate=0.0,
+    ).eval()
+    ctc = CTC(args.n_vocab, args.adim, 0.0, ctc_type="builtin").eval()
+    # the utterances get shorter so that batch_forward runs on padded features
+    xlens = torch.tensor([max(args.n_frames - 7 * i, 4) for i in range(args.n_utts)])
+    xs = torch.randn(args.n_utts, args.n_frames, args.adim)
+    xs.masked_fill_((torch.arange(args.n_frames) >= xlens.unsqueeze(1)).unsqueeze(2), 0.0)
+
+    n_errors = 0
+    with torch.no_grad():
+        for beam in args.beam_sizes:
+            n_errors += check_search(decoder, ctc, xs, xlens, beam, args)
+            logp = ctc.log_softmax(xs)
+            # the pre-beam leaves `beam` labels besides blank and eos
+            for pre_beam in [0, min(int(1.5 * beam) + 2, args.n_vocab)]:
+                n_errors += check_ctc(logp, xlens, beam, pre_beam, args.ctc_steps, args.atol)
+            print(f"beam {beam}: done")
+    if n_errors > 0:
+        print(f"{n_errors} mismatches")
+        sys.exit(1)
+    print("batch beam search and CTC prefix scoring match the per-hypothesis implementations")
+
+
+if __name__ == "__main__":
+    main()
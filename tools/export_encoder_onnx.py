@@ -0,0 +1,38 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Export the encoder of the model of a `.ini` config to ONNX.
+
+The time axis of the inputs and of the encoder output is dynamic. The exported
+encoder is used with `encoder_backend = onnxruntime` and `encoder_onnx = <file>`
+in the `[model]` section of the config, e.g.
+
+    python -m tools.export_encoder_onnx --config-filename configs/LRS3_V_WER19.1.ini \
+        --output benchmarks/LRS3/models/LRS3_V_WER19.1/encoder.onnx
+"""
+
+import argparse
+
+from pipelines.onnx_encoder import export_encoder
+from pipelines.pipeline import InferencePipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config-filename", required=True, help=".ini config")
+    parser.add_argument("--output", required=True, help="ONNX file")
+    parser.add_argument("--n-frames", type=int, default=50, help="frames of the traced inputs")
+    parser.add_argument("--opset-version", type=int, default=14)
+    args = parser.parse_args()
+
+    pipeline = InferencePipeline(args.config_filename, face_track=False, device="cpu")
+    export_encoder(
+        pipeline.model.model, pipeline.modality, args.output, args.n_frames, args.opset_version
+    )
+    print(f"exported the {pipeline.modality} encoder to {args.output}")
+
+
+if __name__ == "__main__":
+    main()